@@ -0,0 +1,133 @@
+"""
+Deterministic fake chat model for offline benchmarks.
+
+Behaves like a provider chat model as far as the server is concerned:
+supports tool binding (agent tool calls and structured output), sync/async
+generation and token streaming (BaseChatModel emits the token
+callbacks), with configurable first-token latency and token rate. Register it with `server.register_chat_model("fake:agent", ...)`.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORDS = (
+    "account pipeline renewal contract procurement spend analysis supplier "
+    "opportunity stage forecast region owner quarter revenue risk summary"
+).split()
+
+
+def fake_from_schema(schema: Dict[str, Any]):
+    """Smallest deterministic value that satisfies a (simple) JSON schema."""
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type", "object")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "string")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {name: fake_from_schema(sub) for name, sub in properties.items()}
+    if kind == "array":
+        return [fake_from_schema(schema.get("items", {"type": "string"}))]
+    if kind in ("number", "integer"):
+        return schema.get("minimum", 1)
+    if kind == "boolean":
+        return True
+    return "sample"
+
+
+class FakeChatModel(BaseChatModel):
+    """Scripted model: one tool call per user turn (if bound), then a streamed answer."""
+
+    first_token_latency: float = 0.2
+    tokens_per_second: float = 200.0
+    response_tokens: int = 60
+    tool_name: Optional[str] = "get_records"
+    tool_args: Dict[str, Any] = {}
+    bound_tools: List[Dict[str, Any]] = []
+    tool_choice: Optional[Any] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+        return self.model_copy(update={
+            "bound_tools": [convert_to_openai_tool(t) for t in tools],
+            "tool_choice": tool_choice,
+        })
+
+    # ------------------------------------------------------------------
+    # Scripted behaviour
+    # ------------------------------------------------------------------
+
+    def _plan(self, messages: List[BaseMessage]) -> AIMessage:
+        names = [t["function"]["name"] for t in self.bound_tools]
+        seed = hashlib.sha256(str(messages[-1].content if messages else "").encode("utf-8")).hexdigest()
+        call_id = f"call_{seed[:12]}"
+
+        # Structured output: a single forced tool carrying the schema
+        if self.tool_choice and len(self.bound_tools) == 1:
+            function = self.bound_tools[0]["function"]
+            args = fake_from_schema(function.get("parameters", {}))
+            return AIMessage(content="", tool_calls=[{"name": function["name"], "args": args, "id": call_id}])
+
+        last_is_tool_result = bool(messages) and isinstance(messages[-1], ToolMessage)
+        if self.tool_name in names and not last_is_tool_result:
+            return AIMessage(content="", tool_calls=[{"name": self.tool_name, "args": dict(self.tool_args), "id": call_id}])
+
+        start = int(seed[:8], 16)
+        text = " ".join(WORDS[(start + i) % len(WORDS)] for i in range(self.response_tokens))
+        return AIMessage(content=text)
+
+    def _generation_seconds(self, message: AIMessage) -> float:
+        tokens = len(str(message.content).split()) or 1
+        return self.first_token_latency + tokens / max(self.tokens_per_second, 1e-6)
+
+    @staticmethod
+    def _tool_call_chunk(message: AIMessage) -> AIMessageChunk:
+        return AIMessageChunk(content="", tool_call_chunks=[
+            {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+            for i, call in enumerate(message.tool_calls)
+        ])
+
+    # ------------------------------------------------------------------
+    # BaseChatModel interface
+    # ------------------------------------------------------------------
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._plan(messages)
+        time.sleep(self._generation_seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._plan(messages)
+        await asyncio.sleep(self._generation_seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        message = self._plan(messages)
+        time.sleep(self.first_token_latency)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=self._tool_call_chunk(message))
+            return
+        for word in str(message.content).split():
+            time.sleep(1 / max(self.tokens_per_second, 1e-6))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._plan(messages)
+        await asyncio.sleep(self.first_token_latency)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=self._tool_call_chunk(message))
+            return
+        for word in str(message.content).split():
+            await asyncio.sleep(1 / max(self.tokens_per_second, 1e-6))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
@@ -0,0 +1,408 @@
+"""
+Offline load test for the DeepAgent server.
+
+Boots the FastAPI app in-process (uvicorn, separate thread) with a
+deterministic fake chat model and, optionally, the local stub MCP server,
+then drives `/api/chat` (SSE), `/api/chat/async`, `/api/chat/structured`
+(direct and agent mode) and `/ws/chat` at increasing concurrency. For each scenario and level it reports
+throughput, p50/p99 latency, time-to-first-token, server event-loop lag and
+process memory. No provider API keys or network access are needed.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --concurrency 1,8,32 --requests 50 --payload-chars 200000
+    python benchmarks/run_benchmarks.py --scenarios chat_stream,structured --no-mcp --json results.json
+    python benchmarks/run_benchmarks.py --cassette cassettes/session.jsonl --time-scale 0.5
+
+With --cassette the server replays a recorded session (CASSETTE_MODE=replay):
+model, MCP and search calls are served from the cassette with their recorded
+timings, and the recorded request payloads replace the synthetic workload.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+SCENARIOS = ["chat_stream", "chat_async", "structured", "structured_agent", "ws"]
+
+STRUCTURED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "score": {"type": "number", "minimum": 1},
+    },
+    "required": ["title", "tags", "score"],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario and level")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="Fake model seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="Fake model token rate")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Fake model answer length")
+    parser.add_argument("--payload-chars", type=int, default=20000, help="Stub MCP response size")
+    parser.add_argument("--tool-latency", type=float, default=0.05, help="Stub MCP tool latency (seconds)")
+    parser.add_argument("--no-mcp", action="store_true", help="Run without the stub MCP server (no tool calls)")
+    parser.add_argument("--cassette", help="Replay this recorded cassette instead of the fake model and stub MCP")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplier for recorded timings with --cassette")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout (seconds)")
+    parser.add_argument("--json", dest="json_path", help="Also write results to this JSON file")
+    return parser.parse_args()
+
+
+# ============================================================================
+# ISOLATED SERVER SETUP
+# ============================================================================
+
+def prepare_environment(args) -> str:
+    """Point every on-disk path at a temp workspace and select the fake models."""
+    workspace = tempfile.mkdtemp(prefix="deepagent-bench-")
+    os.makedirs(os.path.join(workspace, "custom_tools"), exist_ok=True)
+
+    mcp_servers = {}
+    if not args.no_mcp:
+        mcp_servers["bench_stub"] = {
+            "command": sys.executable,
+            "args": [os.path.join(BENCH_DIR, "stub_mcp_server.py")],
+            "transport": "stdio",
+            "env": {
+                "BENCH_PAYLOAD_CHARS": str(args.payload_chars),
+                "BENCH_TOOL_LATENCY": str(args.tool_latency),
+                "PATH": os.environ.get("PATH", ""),
+            },
+            "enabled": True,
+        }
+    with open(os.path.join(workspace, "mcp_config.json"), "w") as f:
+        json.dump({"mcp_servers": mcp_servers}, f, indent=2)
+
+    os.environ.update({
+        "MODEL": "fake:agent",
+        "SUMMARIZER_MODEL": "fake:summarizer",
+        "MCP_CONFIG_FILE": os.path.join(workspace, "mcp_config.json"),
+        "CUSTOM_TOOLS_DIR": os.path.join(workspace, "custom_tools"),
+        "JOB_QUEUE_DB": os.path.join(workspace, "jobs.sqlite3"),
+        "SUMMARY_CACHE_DIR": os.path.join(workspace, "cache", "summaries"),
+        "CONVERSATION_SUMMARY_DIR": os.path.join(workspace, "cache", "conversation_summaries"),
+        "MCP_SPILL_DIR": os.path.join(workspace, "mcp_output"),
+        "RUN_TRACE_SLOW_LOG": os.path.join(workspace, "logs", "slow_runs.jsonl"),
+        "RUN_TRACE_PERSIST": "false",
+        "AGENT_POOL_PREWARM_MODELS": "",
+        "SUPABASE_URL": "",
+        "SUPABASE_SERVICE_KEY": "",
+        "OPENAI_API_KEY": "",
+    })
+    if args.cassette:
+        os.environ.update({
+            "CASSETTE_MODE": "replay",
+            "CASSETTE_PATH": os.path.abspath(args.cassette),
+            "CASSETTE_TIME_SCALE": str(args.time_scale),
+        })
+    # Run from the workspace so no local .env / .env.local leaks real keys in
+    os.chdir(workspace)
+    return workspace
+
+
+def import_server(args):
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCH_DIR)
+    import server
+    from fake_model import FakeChatModel
+
+    server.register_chat_model("fake:agent", lambda: FakeChatModel(
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        tool_name=None if args.no_mcp else "get_records",
+    ))
+    server.register_chat_model("fake:summarizer", lambda: FakeChatModel(
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second * 4,
+        response_tokens=120,
+        tool_name=None,
+    ))
+    return server
+
+
+class ServerThread:
+    """Runs uvicorn in its own thread and event loop, sampling that loop's lag."""
+
+    LAG_INTERVAL = 0.02
+
+    def __init__(self, app):
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.lag_samples = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        sampler = asyncio.create_task(self._sample_lag())
+        try:
+            await self.server.serve()
+        finally:
+            sampler.cancel()
+
+    async def _sample_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.LAG_INTERVAL)
+            self.lag_samples.append(max(0.0, time.perf_counter() - started - self.LAG_INTERVAL))
+
+    def start(self, timeout: float = 120):
+        self._thread.start()
+        deadline = time.time() + timeout
+        while not self.server.started:
+            if time.time() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Server failed to start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=30)
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process (server included) in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ============================================================================
+# SCENARIOS (each returns (latency_s, ttft_s or None))
+# ============================================================================
+
+# Recorded request payloads per endpoint when replaying a cassette
+RECORDED_REQUESTS = {}
+
+
+def user_messages(i: int) -> list:
+    return [{"role": "user", "content": f"Benchmark request {i}: summarize the top accounts."}]
+
+
+def request_payload(endpoint: str, i: int, default: dict) -> dict:
+    """The i-th recorded payload for endpoint (cycling), else the synthetic default."""
+    recorded = RECORDED_REQUESTS.get(endpoint)
+    return dict(recorded[i % len(recorded)]) if recorded else default
+
+
+async def run_chat_stream(client, base_url: str, i: int, timeout: float):
+    started = time.perf_counter()
+    ttft = None
+    payload = {**request_payload("/api/chat", i, {"messages": user_messages(i)}), "stream": True, "chat_id": str(uuid.uuid4())}
+    async with client.stream("POST", f"{base_url}/api/chat", json=payload, timeout=timeout) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event.get("type") == "token" and ttft is None:
+                ttft = time.perf_counter() - started
+            if event.get("type") == "final":
+                break
+    return time.perf_counter() - started, ttft
+
+
+async def run_chat_async(client, base_url: str, i: int, timeout: float):
+    started = time.perf_counter()
+    default = request_payload("/api/chat", i, {"messages": user_messages(i)})
+    payload = {**request_payload("/api/chat/async", i, default), "chat_id": str(uuid.uuid4())}
+    response = await client.post(f"{base_url}/api/chat/async", json=payload, timeout=timeout)
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while time.perf_counter() - started < timeout:
+        job = (await client.get(f"{base_url}/api/jobs/{job_id}")).json()
+        if job["status"] in ("completed", "failed", "cancelled"):
+            if job["status"] != "completed":
+                raise RuntimeError(f"Job {job['status']}: {job.get('error')}")
+            return time.perf_counter() - started, None
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish")
+
+
+async def run_structured(client, base_url: str, i: int, timeout: float, use_tools: bool = False):
+    started = time.perf_counter()
+    payload = request_payload("/api/chat/structured", i, {
+        "messages": user_messages(i), "structured_output_format": STRUCTURED_SCHEMA, "use_tools": use_tools,
+    })
+    response = await client.post(f"{base_url}/api/chat/structured", json=payload, timeout=timeout)
+    response.raise_for_status()
+    if not response.json().get("success"):
+        raise RuntimeError(response.json().get("error"))
+    return time.perf_counter() - started, None
+
+
+async def run_structured_agent(client, base_url: str, i: int, timeout: float):
+    # Agent path: tool loop, then parse (and repair) the final answer
+    return await run_structured(client, base_url, i, timeout, use_tools=True)
+
+
+async def run_ws(client, base_url: str, i: int, timeout: float):
+    import websockets
+
+    started = time.perf_counter()
+    ttft = None
+    url = base_url.replace("http://", "ws://") + "/ws/chat"
+    messages = request_payload("/api/chat", i, {"messages": user_messages(i)})["messages"]
+    async with websockets.connect(url, open_timeout=timeout) as ws:
+        await ws.send(json.dumps({"messages": messages}))
+        while True:
+            message = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+            if message.get("type") == "error":
+                raise RuntimeError(message.get("content"))
+            # The first state snapshot echoes the user turn; count the first model output
+            if ttft is None and message.get("content") not in ("", messages[-1]["content"]):
+                ttft = time.perf_counter() - started
+            if message.get("done"):
+                break
+    return time.perf_counter() - started, ttft
+
+
+SCENARIO_RUNNERS = {
+    "chat_stream": run_chat_stream,
+    "chat_async": run_chat_async,
+    "structured": run_structured,
+    "structured_agent": run_structured_agent,
+    "ws": run_ws,
+}
+
+
+# ============================================================================
+# LOAD DRIVER
+# ============================================================================
+
+def percentile(values: list, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_level(server_thread: ServerThread, scenario: str, concurrency: int, args) -> dict:
+    import httpx
+
+    base_url = f"http://127.0.0.1:{server_thread.port}"
+    runner = SCENARIO_RUNNERS[scenario]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, ttfts, errors = [], [], []
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency * 2)) as client:
+        async def one(i: int):
+            async with semaphore:
+                try:
+                    latency, ttft = await runner(client, base_url, i, args.timeout)
+                    latencies.append(latency)
+                    if ttft is not None:
+                        ttfts.append(ttft)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+
+        server_thread.lag_samples.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        wall = time.perf_counter() - started
+
+    lag = list(server_thread.lag_samples)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000) if latencies else None,
+        "ttft_p50_ms": round(percentile(ttfts, 50) * 1000) if ttfts else None,
+        "loop_lag_p99_ms": round(percentile(lag, 99) * 1000, 1) if lag else None,
+        "loop_lag_max_ms": round(max(lag) * 1000, 1) if lag else None,
+        "rss_mb": round(rss_mb(), 1),
+    }
+
+
+def print_table(rows: list):
+    columns = ["scenario", "concurrency", "errors", "throughput_rps", "p50_ms", "p99_ms",
+               "ttft_p50_ms", "loop_lag_p99_ms", "loop_lag_max_ms", "rss_mb"]
+    widths = {c: max(len(c), *(len(str(r.get(c))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c)).ljust(widths[c]) for c in columns))
+
+
+async def main_async(server_thread: ServerThread, args) -> list:
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIO_RUNNERS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {unknown}")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    rows = []
+    for scenario in scenarios:
+        # Warm-up request: agent build and MCP session setup aren't part of the measurement
+        await run_level(server_thread, scenario, 1, argparse.Namespace(**{**vars(args), "requests": 1}))
+        for level in levels:
+            row = await run_level(server_thread, scenario, level, args)
+            rows.append(row)
+            print(f"[bench] {scenario} c={level}: {row['throughput_rps']} req/s, "
+                  f"p50 {row['p50_ms']} ms, p99 {row['p99_ms']} ms, errors {row['errors']}")
+            if row["first_error"]:
+                print(f"        first error: {row['first_error']}")
+    return rows
+
+
+def main():
+    args = parse_args()
+    if args.json_path:
+        # Resolve against the caller's cwd; prepare_environment chdirs into the workspace
+        args.json_path = os.path.abspath(args.json_path)
+    workspace = prepare_environment(args)
+    server = import_server(args)
+    if args.cassette:
+        for endpoint in ("/api/chat", "/api/chat/async", "/api/chat/structured"):
+            RECORDED_REQUESTS[endpoint] = server.cassette.requests(endpoint)
+        print(f"[bench] Replaying {args.cassette}: " + ", ".join(f"{e} x{len(p)}" for e, p in RECORDED_REQUESTS.items()))
+
+    server_thread = ServerThread(server.app)
+    server_thread.start()
+    try:
+        rows = asyncio.run(main_async(server_thread, args))
+    finally:
+        server_thread.stop()
+
+    print()
+    print_table(rows)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+        print(f"\nResults written to {args.json_path}")
+    print(f"Workspace: {workspace}")
+
+
+if __name__ == "__main__":
+    main()
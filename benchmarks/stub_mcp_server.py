@@ -0,0 +1,55 @@
+"""
+Local stub MCP server (stdio) for offline benchmarks.
+
+Exposes `get_records`, which returns a deterministic JSON payload of roughly
+BENCH_PAYLOAD_CHARS characters after BENCH_TOOL_LATENCY seconds, so the
+server's spill / compaction / summarization path can be load-tested without
+a real MCP backend.
+
+    python benchmarks/stub_mcp_server.py
+"""
+
+import asyncio
+import json
+import os
+
+from fastmcp import FastMCP
+
+PAYLOAD_CHARS = int(os.getenv("BENCH_PAYLOAD_CHARS", "20000"))
+TOOL_LATENCY = float(os.getenv("BENCH_TOOL_LATENCY", "0.05"))
+
+mcp = FastMCP("bench-stub")
+
+
+def build_payload(chars: int) -> str:
+    records = []
+    size = 2
+    i = 0
+    while size < chars:
+        record = {
+            "Id": f"001{i:012d}",
+            "Name": f"Account {i}",
+            "Industry": ["Manufacturing", "Banking", "Retail", "Energy"][i % 4],
+            "AnnualRevenue": (i * 7919) % 10_000_000,
+            "OwnerEmail": f"owner{i % 37}@example.com",
+            "attributes": {"type": "Account", "url": f"/services/data/v59.0/sobjects/Account/001{i:012d}"},
+        }
+        records.append(record)
+        size += len(json.dumps(record)) + 2
+        i += 1
+    return json.dumps({"totalSize": len(records), "done": True, "records": records})
+
+
+@mcp.tool()
+async def get_records(chars: int = 0) -> str:
+    """Return a deterministic list of Salesforce-like account records.
+
+    Args:
+        chars: Approximate payload size in characters (default: BENCH_PAYLOAD_CHARS)
+    """
+    await asyncio.sleep(TOOL_LATENCY)
+    return build_payload(chars or PAYLOAD_CHARS)
+
+
+if __name__ == "__main__":
+    mcp.run()
@@ -1076,6 +1076,16 @@ export function ChatInterface({ projectId, chatId, initialMessages, initialInput
                                             ...newMessages[lastMsgIndex],
                                             content: (lastMsg.content || "") + text
                                         };
+                                    } else if (data.type === 'token_reset') {
+                                        // Text already streamed was a tool-calling step's preamble
+                                        const current = lastMsg.content || "";
+                                        const retracted = data.content || "";
+                                        if (retracted && current.endsWith(retracted)) {
+                                            newMessages[lastMsgIndex] = {
+                                                ...newMessages[lastMsgIndex],
+                                                content: current.slice(0, current.length - retracted.length)
+                                            };
+                                        }
                                     } else if (data.type === 'tool_call') {
                                         const metaRaw = data.metadata || {};
                                         const meta = typeof metaRaw === 'string' ? (JSON.parse(metaRaw) || {}) : metaRaw;
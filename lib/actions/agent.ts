@@ -35,6 +35,7 @@ Include a header row.`;
         ],
         system_prompt: systemPrompt,
         model: "openai:gpt-5",
+        use_tools: false,
         structured_output_format: {
             type: "object",
             properties: {
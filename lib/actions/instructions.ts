@@ -72,6 +72,7 @@ export async function extractBehavioralInstructions(chatId: string) {
             messages: [{ role: "user", content: finalAnalysisPrompt }],
             system_prompt: finalSystemPrompt,
             model: "openai:gpt-4o",
+            use_tools: false,
             structured_output_format: {
                 type: "object",
                 properties: {
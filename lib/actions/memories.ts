@@ -58,6 +58,7 @@ Return a JSON array of memories.`;
                 messages: [{ role: "user", content: analysisPrompt }],
                 system_prompt: "You are a memory extraction assistant. Extract key insights from conversations.",
                 model: "openai:gpt-5",
+                use_tools: false,
                 structured_output_format: {
                     type: "object",
                     properties: {
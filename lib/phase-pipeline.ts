@@ -399,6 +399,11 @@ export async function runPhasePipeline(
                         const obj = JSON.parse(json);
                         if (obj.type === "token" || obj.type === "content") {
                             phaseText += obj.content || obj.token || "";
+                        } else if (obj.type === "token_reset") {
+                            const retracted = obj.content || "";
+                            if (retracted && phaseText.endsWith(retracted)) {
+                                phaseText = phaseText.slice(0, phaseText.length - retracted.length);
+                            }
                         } else if (obj.type === "final" || obj.type === "complete") {
                             if (typeof obj.content === "string" && obj.content.length > phaseText.length) {
                                 phaseText = obj.content;
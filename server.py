@@ -16,21 +16,32 @@ MCP TRUNCATION LIMITS (configurable):
 """
 
 import asyncio
+import contextlib
+import contextvars
+import fnmatch
+import gzip
+import hashlib
 import json
 import os
 import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
 from typing import List, Dict, Any, Optional, Literal
 from datetime import datetime
 
 from fastapi import FastAPI, WebSocket, HTTPException, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from deepagents import create_deep_agent
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.tools import tool
-from langchain_community.tools import DuckDuckGoSearchRun
 import dotenv
 
 # Load environment variables from .env file
@@ -45,17 +56,29 @@ if not os.getenv("LANGCHAIN_API_KEY"):
     os.environ["LANGCHAIN_TRACING_V2"] = "false"
     os.environ["LANGCHAIN_API_KEY"] = ""
 
-# Google Sheets OAuth (graceful degradation)
+# Google Sheets OAuth (graceful degradation, loaded on first use)
 from fastapi.responses import RedirectResponse
-try:
-    from google_sheets_auth import GoogleSheetsAuth
-    sheets_auth = GoogleSheetsAuth()
-    GOOGLE_SHEETS_ENABLED = sheets_auth.is_authenticated() or os.path.exists("client_secrets.json")
-    print(f"✓ Google Sheets integration: {'READY' if sheets_auth.is_authenticated() else 'NOT AUTHENTICATED'}")
-except Exception as e:
-    sheets_auth = None
-    GOOGLE_SHEETS_ENABLED = False
-    print(f"⚠️  Google Sheets integration disabled: {e}")
+_sheets_auth = None
+_sheets_auth_loaded = False
+_sheets_auth_lock = threading.Lock()
+
+def get_sheets_auth():
+    """Google Sheets auth helper, or None when not installed or not configured."""
+    global _sheets_auth, _sheets_auth_loaded
+    with _sheets_auth_lock:
+        if not _sheets_auth_loaded:
+            _sheets_auth_loaded = True
+            try:
+                from google_sheets_auth import GoogleSheetsAuth
+                auth = GoogleSheetsAuth()
+                if auth.is_authenticated() or os.path.exists("client_secrets.json"):
+                    _sheets_auth = auth
+                    print(f"✓ Google Sheets integration: {'READY' if auth.is_authenticated() else 'NOT AUTHENTICATED'}")
+                else:
+                    print("⚠️  Google Sheets integration disabled: no credentials")
+            except Exception as e:
+                print(f"⚠️  Google Sheets integration disabled: {e}")
+        return _sheets_auth
 
 # Configure logging to suppress verbose MCP warnings
 logging.getLogger("fastmcp").setLevel(logging.ERROR)
@@ -74,12 +97,19 @@ class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
     
+    # Supabase (service role, for server-side chat logging)
+    SUPABASE_URL = os.getenv("SUPABASE_URL", "") or os.getenv("NEXT_PUBLIC_SUPABASE_URL", "")
+    SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "") or os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+    
     # MCP configuration file path
     MCP_CONFIG_FILE = os.getenv("MCP_CONFIG_FILE", "mcp_config.json")
     
     # Custom tools directory
     CUSTOM_TOOLS_DIR = os.getenv("CUSTOM_TOOLS_DIR", "custom_tools")
     
+    # Defer importing unchanged custom tool modules until a tool is first called
+    CUSTOM_TOOLS_LAZY_IMPORT = os.getenv("CUSTOM_TOOLS_LAZY_IMPORT", "false").lower() == "true"
+    
     # =========================================================================
     # MCP TRUNCATION LIMITS (CONFIGURABLE)
     # =========================================================================
@@ -104,185 +134,1839 @@ class Config:
     
     # Max chars to feed into the summarizer LLM at once
     SUMMARIZER_INPUT_LIMIT = int(os.getenv("SUMMARIZER_INPUT_LIMIT", "200000"))
+    
+    # Rolling per-chat conversation summaries (persisted so restarts don't re-summarize)
+    CONVERSATION_SUMMARY_DIR = os.getenv("CONVERSATION_SUMMARY_DIR", "cache/conversation_summaries")
+    
+    # Map-reduce summarization for payloads beyond SUMMARIZER_INPUT_LIMIT
+    SUMMARIZER_MAX_CONCURRENCY = int(os.getenv("SUMMARIZER_MAX_CONCURRENCY", "4"))
+    SUMMARIZER_MAX_CHUNKS = int(os.getenv("SUMMARIZER_MAX_CHUNKS", "16"))
+    
+    # Spill store for full MCP responses (content-addressed, gzip-compressed)
+    MCP_SPILL_DIR = os.getenv("MCP_SPILL_DIR", "mcp_output")
+    MCP_SPILL_MAX_BYTES = int(os.getenv("MCP_SPILL_MAX_BYTES", str(1024 * 1024 * 1024)))
+    MCP_SPILL_MAX_AGE_SECONDS = int(os.getenv("MCP_SPILL_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+    MCP_SPILL_COMPRESSION_LEVEL = int(os.getenv("MCP_SPILL_COMPRESSION_LEVEL", "6"))
+    
+    # MCP tool result cache (policies per tool in mcp_config.json "tool_cache")
+    TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "512"))
+    
+    # Run tracing: persisted per-run timelines and a sampled slow-run log
+    RUN_TRACE_PERSIST = os.getenv("RUN_TRACE_PERSIST", "true").lower() == "true"
+    RUN_TRACE_MAX_SPANS = int(os.getenv("RUN_TRACE_MAX_SPANS", "2000"))
+    RUN_TRACE_SLOW_SECONDS = float(os.getenv("RUN_TRACE_SLOW_SECONDS", "120"))
+    RUN_TRACE_SLOW_SAMPLE_RATE = float(os.getenv("RUN_TRACE_SLOW_SAMPLE_RATE", "1.0"))
+    RUN_TRACE_SLOW_LOG = os.getenv("RUN_TRACE_SLOW_LOG", "logs/slow_runs.jsonl")
+    
+    # Record/replay cassettes: "off", "record" (append live LLM/MCP/search calls) or "replay" (serve them offline)
+    CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+    CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassettes/session.jsonl")
+    # Multiplier for recorded timings during replay (0 = no delays, 0.5 = twice as fast)
+    CASSETTE_TIME_SCALE = float(os.getenv("CASSETTE_TIME_SCALE", "1.0"))
+    
+    # Structured output (direct-completion fast path for /api/chat/structured)
+    STRUCTURED_VALIDATOR_CACHE_SIZE = int(os.getenv("STRUCTURED_VALIDATOR_CACHE_SIZE", "128"))
+    
+    # Opt-in response cache for /api/chat/structured (request field "cache": true)
+    STRUCTURED_CACHE_TTL_SECONDS = int(os.getenv("STRUCTURED_CACHE_TTL_SECONDS", "3600"))
+    STRUCTURED_CACHE_MAX_ENTRIES = int(os.getenv("STRUCTURED_CACHE_MAX_ENTRIES", "1024"))
+    
+    # Structured batch endpoint: default/max items in flight, per-item timeout, batch size cap
+    STRUCTURED_BATCH_CONCURRENCY = int(os.getenv("STRUCTURED_BATCH_CONCURRENCY", "4"))
+    STRUCTURED_BATCH_MAX_CONCURRENCY = int(os.getenv("STRUCTURED_BATCH_MAX_CONCURRENCY", "16"))
+    STRUCTURED_BATCH_ITEM_TIMEOUT = float(os.getenv("STRUCTURED_BATCH_ITEM_TIMEOUT", "300"))
+    STRUCTURED_BATCH_MAX_ITEMS = int(os.getenv("STRUCTURED_BATCH_MAX_ITEMS", "500"))
+    
+    # Large tool responses beyond compaction: "summarize" (LLM) or "retrieve" (vector index + search tool)
+    LARGE_RESPONSE_STRATEGY = os.getenv("LARGE_RESPONSE_STRATEGY", "summarize")
+    
+    # Per-chat vector index over large tool responses
+    VECTOR_INDEX_EMBEDDING_MODEL = os.getenv("VECTOR_INDEX_EMBEDDING_MODEL", "text-embedding-3-small")
+    VECTOR_INDEX_CHUNK_CHARS = int(os.getenv("VECTOR_INDEX_CHUNK_CHARS", "2000"))
+    VECTOR_INDEX_MAX_CHUNKS = int(os.getenv("VECTOR_INDEX_MAX_CHUNKS", "2000"))
+    VECTOR_INDEX_MAX_CHATS = int(os.getenv("VECTOR_INDEX_MAX_CHATS", "64"))
+    VECTOR_INDEX_IDLE_SECONDS = int(os.getenv("VECTOR_INDEX_IDLE_SECONDS", str(6 * 3600)))
+    
+    # Token counting: per-message memo size (messages are counted once, then cached)
+    TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "20000"))
+    
+    # Summary cache: in-memory LRU entries, then on-disk tier with TTL and size cap
+    SUMMARY_CACHE_MEMORY_ITEMS = int(os.getenv("SUMMARY_CACHE_MEMORY_ITEMS", "256"))
+    SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", "cache/summaries")
+    SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("SUMMARY_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+    
+    # =========================================================================
+    # AGENT POOL
+    # =========================================================================
+    # Max number of compiled agents kept alive (LRU evicted beyond this)
+    AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "8"))
+    
+    # Comma-separated models to pre-build at startup (e.g. "anthropic:claude-sonnet-4-20250514,openai:gpt-4o")
+    AGENT_POOL_PREWARM_MODELS = [m.strip() for m in os.getenv("AGENT_POOL_PREWARM_MODELS", "").split(",") if m.strip()]
+    
+    # Build the default agent (tools + MCP sessions) before accepting traffic instead of in the background
+    AGENT_WARMUP_BLOCKING = os.getenv("AGENT_WARMUP_BLOCKING", "false").lower() == "true"
+    
+    # =========================================================================
+    # MULTI-WORKER (uvicorn --workers N on one host)
+    # =========================================================================
+    # Cross-worker change notifications and shared cache tiers
+    MULTI_WORKER = os.getenv("MULTI_WORKER", "false").lower() == "true"
+    
+    # Shared event log directory and how often each worker polls it (seconds)
+    WORKER_SYNC_DIR = os.getenv("WORKER_SYNC_DIR", "cache/worker_sync")
+    WORKER_SYNC_INTERVAL = float(os.getenv("WORKER_SYNC_INTERVAL", "1.0"))
+    
+    # Shared on-disk tier of the MCP tool result cache ("" disables; on by default in multi-worker mode)
+    TOOL_CACHE_SHARED_DIR = os.getenv("TOOL_CACHE_SHARED_DIR", "cache/tool_results" if MULTI_WORKER else "")
+    TOOL_CACHE_SHARED_MAX_BYTES = int(os.getenv("TOOL_CACHE_SHARED_MAX_BYTES", str(200 * 1024 * 1024)))
+    
+    # =========================================================================
+    # MCP SESSION POOL
+    # =========================================================================
+    # Seconds between background pings of each persistent MCP session
+    MCP_HEALTH_CHECK_INTERVAL = int(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30"))
+    
+    # Seconds to wait for a ping before the session is considered dead
+    MCP_HEALTH_CHECK_TIMEOUT = int(os.getenv("MCP_HEALTH_CHECK_TIMEOUT", "10"))
+    
+    # =========================================================================
+    # SUPABASE EVENT SINK
+    # =========================================================================
+    # Max pending DB events before producers wait (backpressure)
+    DB_EVENT_QUEUE_SIZE = int(os.getenv("DB_EVENT_QUEUE_SIZE", "1000"))
+    
+    # Max rows per bulk insert
+    DB_EVENT_BATCH_SIZE = int(os.getenv("DB_EVENT_BATCH_SIZE", "50"))
+    
+    # Seconds to wait for more events before flushing a partial batch
+    DB_EVENT_FLUSH_INTERVAL = float(os.getenv("DB_EVENT_FLUSH_INTERVAL", "0.25"))
+    
+    # Insert attempts per batch (exponential backoff between attempts)
+    DB_EVENT_MAX_RETRIES = int(os.getenv("DB_EVENT_MAX_RETRIES", "3"))
+    
+    # =========================================================================
+    # ASYNC CHAT JOB QUEUE
+    # =========================================================================
+    # SQLite file backing /api/chat/async jobs (survives restarts)
+    JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "jobs.db")
+    
+    # Concurrent async agent runs per process
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+    
+    # Max queued (not yet running) jobs before /api/chat/async returns 429
+    JOB_QUEUE_MAX_PENDING = int(os.getenv("JOB_QUEUE_MAX_PENDING", "500"))
 
 config = Config()
 
 # ============================================================================
-# CONTEXT WINDOW MANAGER (ChatGPT-based)
+# CHAT MODEL REGISTRY
 # ============================================================================
 
-class ContextWindowManager:
-    """Manages context window using ChatGPT for summarization.
+# Model name -> factory returning a chat model instance (e.g. offline fakes for benchmarks)
+CHAT_MODEL_FACTORIES: Dict[str, Any] = {}
+
+def register_chat_model(name: str, factory):
+    """Serve the model string `name` from factory() instead of a provider SDK."""
+    CHAT_MODEL_FACTORIES[name] = factory
+
+def resolve_chat_model(name: str, **init_kwargs):
+    """Registered model instance for name, else the name itself (resolved by the provider SDKs).
     
-    Two responsibilities:
-    1. Summarize large MCP tool responses before they enter message history
-    2. Summarize older conversation messages when total tokens exceed threshold
+    With a cassette active the model is wrapped for record/replay; recording
+    needs a live instance, so unregistered names are initialized here.
     """
+    factory = CHAT_MODEL_FACTORIES.get(name)
+    if factory is not None:
+        model = factory()
+    elif cassette.mode == "record":
+        from langchain.chat_models import init_chat_model
+        model = init_chat_model(name, **init_kwargs)
+    else:
+        model = name
+    return cassette.wrap_model(name, model)
+
+# ============================================================================
+# METRICS (Prometheus text format)
+# ============================================================================
+
+class _Metric:
+    """One metric family: values per label combination."""
     
-    def __init__(self):
-        self._summarizer = None
+    kind = ""
     
-    def _get_summarizer(self):
-        """Lazy-initialize the ChatGPT summarizer."""
-        if self._summarizer is None:
+    def __init__(self, name: str, help_text: str, label_names: List[str]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = list(label_names)
+        self._values: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels: Dict[str, Any]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+    
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    
+    def _labels(self, key: tuple, extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = list(zip(self.label_names, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{self._escape(value)}"' for name, value in pairs) + "}"
+    
+    @staticmethod
+    def _number(value: float) -> str:
+        if value == float("inf"):
+            return "+Inf"
+        return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+    
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._labels(key)} {self._number(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    
+    def __init__(self, name: str, help_text: str, label_names: List[str]):
+        super().__init__(name, help_text, label_names)
+        self._function = None
+    
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+    
+    def set_function(self, function):
+        """Compute values at scrape time: function() -> {label tuple: value} (or a number when unlabeled)."""
+        self._function = function
+    
+    def samples(self) -> List[str]:
+        if self._function is not None:
             try:
-                from langchain_openai import ChatOpenAI
-                self._summarizer = ChatOpenAI(
-                    model=config.SUMMARIZER_MODEL,
-                    temperature=0,
-                    max_tokens=4096,
-                    api_key=config.OPENAI_API_KEY or os.getenv("OPENAI_API_KEY"),
-                )
-                print(f"✓ Context summarizer initialized: {config.SUMMARIZER_MODEL}")
-            except Exception as e:
-                print(f"⚠️  Failed to initialize summarizer: {e}")
-                print("   Falling back to truncation-only mode")
-                self._summarizer = None
-        return self._summarizer
+                values = self._function()
+            except Exception:
+                values = {}
+            items = list(values.items()) if isinstance(values, dict) else [((), values)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{self._labels(key)} {self._number(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
     
-    def estimate_tokens(self, text: str) -> int:
-        """Rough token estimate: ~4 chars per token for English text."""
-        return len(text) // 4
+    def __init__(self, name: str, help_text: str, label_names: List[str], buckets: List[float]):
+        super().__init__(name, help_text, label_names)
+        self.buckets = sorted(buckets) + [float("inf")]
     
-    def estimate_messages_tokens(self, messages: list) -> int:
-        """Estimate total tokens across all messages."""
-        total = 0
-        for msg in messages:
-            if hasattr(msg, 'content'):
-                content = str(msg.content)
-            elif isinstance(msg, dict):
-                content = str(msg.get('content', ''))
-            else:
-                content = str(msg)
-            total += self.estimate_tokens(content)
-        return total
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
     
-    async def summarize_tool_response(self, tool_name: str, result_str: str) -> str:
-        """Summarize a large MCP tool response using ChatGPT.
-        
-        Preserves all critical data (IDs, names, amounts, dates, statuses)
-        while removing redundant metadata and formatting.
-        
-        Falls back to intelligent truncation if summarizer is unavailable.
-        """
-        summarizer = self._get_summarizer()
-        
-        if summarizer is None:
-            # Fallback: truncate with context
-            return self._truncate_with_context(result_str)
-        
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]}) for key, v in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._labels(key, {'le': self._number(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {state['sum']}")
+            lines.append(f"{self.name}_count{self._labels(key)} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal in-process metrics registry rendered in Prometheus text format."""
+    
+    LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+    SIZE_BUCKETS = [1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 20_000_000]
+    
+    def __init__(self):
+        self._metrics: "OrderedDict[str, _Metric]" = OrderedDict()
+    
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help_text: str, label_names: Optional[List[str]] = None) -> Counter:
+        return self._register(Counter(name, help_text, label_names or []))
+    
+    def gauge(self, name: str, help_text: str, label_names: Optional[List[str]] = None) -> Gauge:
+        return self._register(Gauge(name, help_text, label_names or []))
+    
+    def histogram(self, name: str, help_text: str, label_names: Optional[List[str]] = None,
+                  buckets: Optional[List[float]] = None) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names or [], buckets or self.LATENCY_BUCKETS))
+    
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+metrics = MetricsRegistry()
+
+AGENT_BUILD_SECONDS = metrics.histogram("agent_build_seconds", "Time to compile a deep agent", ["model"])
+AGENT_TTFT_SECONDS = metrics.histogram("agent_time_to_first_token_seconds", "Time from run start to the first streamed token", ["endpoint"])
+AGENT_RUN_SECONDS = metrics.histogram("agent_run_seconds", "Total agent run time", ["endpoint"])
+AGENT_RUNS_IN_FLIGHT = metrics.gauge("agent_runs_in_flight", "Agent runs currently executing", ["endpoint"])
+TOOL_CALL_SECONDS = metrics.histogram("mcp_tool_call_seconds", "MCP tool call latency (cache hits excluded)", ["tool"])
+TOOL_RESPONSE_CHARS = metrics.histogram("mcp_tool_response_chars", "MCP tool response size in characters", ["tool"], MetricsRegistry.SIZE_BUCKETS)
+TOOL_ERRORS_TOTAL = metrics.counter("mcp_tool_errors_total", "MCP tool calls that raised", ["tool"])
+SUMMARIZER_SECONDS = metrics.histogram("summarizer_call_seconds", "Summarizer LLM call latency", ["kind"])
+SUMMARIZATIONS_TOTAL = metrics.counter("summarizations_total", "Summarizations triggered (cache misses)", ["kind"])
+TRUNCATION_FALLBACKS_TOTAL = metrics.counter("truncation_fallbacks_total", "Times truncation replaced summarization", ["reason"])
+JOB_QUEUE_DEPTH = metrics.gauge("job_queue_depth", "Async chat jobs by state", ["state"])
+DB_EVENT_QUEUE_DEPTH = metrics.gauge("db_event_queue_depth", "Supabase rows waiting to be written")
+
+# ============================================================================
+# RUN TRACING
+# ============================================================================
+
+class RunTrace:
+    """Timeline of spans (LLM steps, tool calls, summarization, DB writes) for one run.
+    
+    Spans are recorded relative to the run start. Completed spans also queue
+    up for the opt-in `timing` SSE event until drained.
+    """
+    
+    def __init__(self, endpoint: str, chat_id: Optional[str] = None):
+        self.run_id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.chat_id = chat_id
+        self.started_at = datetime.utcnow().isoformat()
+        self._started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._pending: List[Dict[str, Any]] = []
+    
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._started) * 1000, 1)
+    
+    def add_span(self, name: str, kind: str, started: float, ended: float,
+                 attrs: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        if len(self.spans) >= config.RUN_TRACE_MAX_SPANS:
+            self.dropped += 1
+            return
+        span = {
+            "name": name,
+            "kind": kind,
+            "start_ms": round((started - self._started) * 1000, 1),
+            "duration_ms": round((ended - started) * 1000, 1),
+        }
+        if attrs:
+            span["attrs"] = attrs
+        if error:
+            span["error"] = error
+        self.spans.append(span)
+        self._pending.append(span)
+    
+    def drain(self) -> List[Dict[str, Any]]:
+        """Spans completed since the last drain."""
+        pending, self._pending = self._pending, []
+        return pending
+    
+    def summary(self) -> Dict[str, Any]:
+        by_kind: Dict[str, Dict[str, float]] = {}
+        for span in self.spans:
+            totals = by_kind.setdefault(span["kind"], {"count": 0, "total_ms": 0.0})
+            totals["count"] += 1
+            totals["total_ms"] = round(totals["total_ms"] + span["duration_ms"], 1)
+        return {
+            "run_id": self.run_id,
+            "endpoint": self.endpoint,
+            "total_ms": self.elapsed_ms(),
+            "spans": len(self.spans),
+            "dropped_spans": self.dropped,
+            "by_kind": by_kind,
+        }
+    
+    def to_record(self) -> Dict[str, Any]:
+        return {**self.summary(), "chat_id": self.chat_id, "started_at": self.started_at, "timeline": self.spans}
+
+# Trace of the run the current task belongs to (None outside traced runs)
+current_trace: contextvars.ContextVar[Optional[RunTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+@contextlib.contextmanager
+def trace_span(name: str, kind: str, **attrs):
+    """Record a span on the current run's trace; a no-op outside traced runs.
+    
+    Yields the attrs dict so callers can attach results (sizes, cache hits).
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.add_span(name, kind, started, time.perf_counter(), attrs, error)
+
+def start_trace(endpoint: str, chat_id: Optional[str] = None) -> RunTrace:
+    trace = RunTrace(endpoint, chat_id)
+    current_trace.set(trace)
+    return trace
+
+async def finish_trace(trace: RunTrace):
+    """Log the run's breakdown, persist its timeline and sample it into the slow-run log."""
+    current_trace.set(None)
+    summary = trace.summary()
+    breakdown = ", ".join(f"{kind} {v['total_ms']:.0f} ms" for kind, v in summary["by_kind"].items())
+    print(f"  ⏱️  Run {trace.run_id} ({trace.endpoint}): {summary['total_ms']:.0f} ms total" + (f" — {breakdown}" if breakdown else ""))
+    
+    if config.RUN_TRACE_PERSIST and trace.chat_id:
+        record = trace.to_record()
+        await event_sink.emit("chat_run_timelines", {
+            "run_id": record["run_id"],
+            "chat_id": record["chat_id"],
+            "endpoint": record["endpoint"],
+            "total_ms": record["total_ms"],
+            "summary": record["by_kind"],
+            "timeline": record["timeline"],
+        })
+    
+    if summary["total_ms"] >= config.RUN_TRACE_SLOW_SECONDS * 1000 and random.random() < config.RUN_TRACE_SLOW_SAMPLE_RATE:
+        print(f"  🐢 Slow run {trace.run_id}: {summary['total_ms'] / 1000:.1f}s (logged to {config.RUN_TRACE_SLOW_LOG})")
         try:
-            from langchain_core.messages import HumanMessage, SystemMessage
-            
-            # Trim input to summarizer's context limit
-            input_text = result_str[:config.SUMMARIZER_INPUT_LIMIT]
-            
-            messages = [
-                SystemMessage(content="""You are a data extraction assistant. Your job is to summarize large tool/API responses 
-into a compact format that preserves ALL actionable information.
+            await asyncio.to_thread(_append_slow_run, trace.to_record())
+        except OSError as e:
+            print(f"  ⚠️  Failed to write slow-run log: {e}")
 
-RULES:
-- Preserve ALL: record IDs, names, amounts, dates, stages, statuses, owners, types
-- Preserve ALL: relationships, lookup fields, reference IDs, counts, aggregates
-- Preserve ALL: error messages, warnings, validation failures
-- Remove: redundant metadata fields (attributes, urls, api types), duplicate nested references
-- Remove: null/empty fields, system timestamps that aren't business-relevant
-- Format: Use structured text, not JSON. Group related records logically.
-- If data contains records/rows, present them as a concise numbered list with key fields
-- Always state the total count of records at the top
-- Keep your summary under 5000 words"""),
-                HumanMessage(content=f"Summarize this {tool_name} response ({len(result_str):,} chars):\n\n{input_text}")
-            ]
-            
-            response = await summarizer.ainvoke(messages)
-            summary = response.content
-            
-            # Add metadata footer
-            summary += f"\n\n[Summarized from {len(result_str):,} chars. Full data saved to disk.]"
-            
-            print(f"  ✓ Summarized {tool_name} response: {len(result_str):,} → {len(summary):,} chars")
-            return summary
-            
-        except Exception as e:
-            print(f"  ⚠️  Summarization failed for {tool_name}: {e}")
-            return self._truncate_with_context(result_str)
+def _append_slow_run(record: Dict[str, Any]):
+    directory = os.path.dirname(config.RUN_TRACE_SLOW_LOG)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(config.RUN_TRACE_SLOW_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+# ============================================================================
+# CASSETTES (record / replay of LLM, MCP and search calls)
+# ============================================================================
+
+def _cassette_key(*parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def _messages_fingerprint(messages: list) -> List[Any]:
+    return [
+        [getattr(m, "type", ""), m.content, [[c["name"], c["args"]] for c in getattr(m, "tool_calls", None) or []]]
+        for m in messages
+    ]
+
+class Cassette:
+    """Records LLM, MCP and search calls to a JSONL file and replays them offline.
     
-    async def summarize_conversation_history(self, messages: list) -> list:
-        """Summarize older messages when conversation exceeds token threshold.
-        
-        Strategy:
-        - Keep the most recent N messages verbatim (they contain current context)
-        - Summarize everything before that into a single context message
-        - The agent sees: [summary_of_history] + [recent_messages]
-        
-        Returns the compressed message list.
-        """
-        total_tokens = self.estimate_messages_tokens(messages)
+    In record mode every model response (with per-chunk stream offsets),
+    MCP/search tool result, MCP tool definition and incoming chat request is
+    appended with its wall time. In replay mode calls are served from the
+    file after the recorded delay times CASSETTE_TIME_SCALE, so recorded
+    production sessions can be re-run against new builds without model
+    providers or MCP servers.
+    
+    Each call is matched on an exact key (model + messages, or tool + args)
+    first, then on looser keys (model + turn shape, model; tool name) so
+    volatile content such as timestamps does not derail a replay.
+    """
+    
+    def __init__(self, path: str, mode: str, time_scale: float):
+        self.path = path
+        self.mode = mode if mode in ("record", "replay") else "off"
+        self.time_scale = max(0.0, time_scale)
+        self._lock = threading.Lock()
+        self._entries: List[Dict[str, Any]] = []
+        self._queues: Dict[tuple, deque] = {}
+        self._used: set = set()
+        self._loaded = False
+        self._recorded_tool_sets: set = set()
+        self.recorded = 0
+        self.exact_hits = 0
+        self.loose_hits = 0
+        self.misses = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+    
+    def scaled(self, seconds) -> float:
+        return max(0.0, float(seconds or 0)) * self.time_scale
+    
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    
+    def record(self, kind: str, keys: List[Optional[str]], **payload):
+        entry = {"kind": kind, "keys": keys, "recorded_at": datetime.utcnow().isoformat(), **payload}
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recorded += 1
+    
+    async def arecord(self, kind: str, keys: List[Optional[str]], **payload):
+        try:
+            await asyncio.to_thread(self.record, kind, keys, **payload)
+        except OSError as e:
+            print(f"  ⚠️  Failed to write cassette entry: {e}")
+    
+    async def record_request(self, endpoint: str, payload: Dict[str, Any]):
+        """Keep the incoming request so the workload itself can be replayed."""
+        if self.mode == "record":
+            await self.arecord("request", [], endpoint=endpoint, payload=payload)
+    
+    async def record_tools(self, tools: List[Any]):
+        """Keep MCP tool definitions so replay can rebuild the tools without servers."""
+        if self.mode != "record":
+            return
+        definitions = []
+        for t in tools:
+            schema = t.args_schema if isinstance(t.args_schema, dict) or t.args_schema is None else t.args_schema.model_json_schema()
+            definitions.append({"name": t.name, "description": t.description, "args_schema": schema})
+        key = _cassette_key("tools", definitions)
+        if key not in self._recorded_tool_sets:
+            self._recorded_tool_sets.add(key)
+            await self.arecord("tools", [key], tools=definitions)
+    
+    # ------------------------------------------------------------------
+    # Replay
+    # ------------------------------------------------------------------
+    
+    def load(self):
+        """Read the cassette into per-key queues (once)."""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = [json.loads(line) for line in f if line.strip()]
+            except FileNotFoundError:
+                print(f"⚠️  Cassette {self.path} not found; replay will miss")
+                return
+            for index, entry in enumerate(self._entries):
+                for key in entry.get("keys") or []:
+                    if key:
+                        self._queues.setdefault((entry["kind"], key), deque()).append(index)
+            print(f"✓ Cassette loaded: {len(self._entries)} entries from {self.path}")
+    
+    def take(self, kind: str, keys: List[Optional[str]]) -> Optional[Dict[str, Any]]:
+        """Consume the next unused entry for the first matching key (exact key first)."""
+        self.load()
+        with self._lock:
+            for position, key in enumerate(keys):
+                queue = self._queues.get((kind, key)) if key else None
+                while queue:
+                    index = queue.popleft()
+                    if index in self._used:
+                        continue
+                    self._used.add(index)
+                    if position == 0:
+                        self.exact_hits += 1
+                    else:
+                        self.loose_hits += 1
+                    return self._entries[index]
+            self.misses += 1
+            return None
+    
+    def entries(self, kind: str) -> List[Dict[str, Any]]:
+        self.load()
+        return [entry for entry in self._entries if entry.get("kind") == kind]
+    
+    def requests(self, endpoint: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Recorded request payloads, optionally for a single endpoint."""
+        return [e["payload"] for e in self.entries("request") if endpoint is None or e.get("endpoint") == endpoint]
+    
+    def replay_tools(self) -> List[Any]:
+        """MCP tools rebuilt from recorded definitions (replay mode only)."""
+        if self.mode != "replay":
+            return []
+        from langchain_core.tools import StructuredTool, ToolException
         
-        if total_tokens < config.CONVERSATION_SUMMARIZE_TOKEN_THRESHOLD:
-            return messages  # No summarization needed
+        definitions: Dict[str, Dict[str, Any]] = {}
+        for entry in self.entries("tools"):
+            for definition in entry.get("tools", []):
+                definitions[definition["name"]] = definition
         
-        keep_count = config.CONVERSATION_KEEP_RECENT_MESSAGES
+        def unrecorded(name: str):
+            async def missing(**kwargs):
+                raise ToolException(f"No recorded response for {name} in cassette {self.path}")
+            return missing
         
-        if len(messages) <= keep_count:
-            return messages  # Not enough messages to summarize
+        return [
+            StructuredTool(
+                name=d["name"],
+                description=d.get("description") or "",
+                args_schema=d.get("args_schema") or {"type": "object", "properties": {}},
+                coroutine=unrecorded(d["name"]),
+            )
+            for d in definitions.values()
+        ]
+    
+    # ------------------------------------------------------------------
+    # Call wrappers
+    # ------------------------------------------------------------------
+    
+    async def call(self, kind: str, name: str, args: Dict[str, Any], fn):
+        """Run `fn()` through the cassette: recorded in record mode, served in replay mode.
         
-        # Split: older messages to summarize, recent messages to keep
-        older_messages = messages[:-keep_count]
-        recent_messages = messages[-keep_count:]
+        Replay misses fall through to the live call.
+        """
+        if self.mode == "off":
+            return await fn()
+        keys = [_cassette_key(kind, name, args), _cassette_key(kind, name)]
         
-        print(f"  📝 Summarizing conversation: {len(messages)} messages ({total_tokens:,} tokens)")
-        print(f"     Summarizing {len(older_messages)} older messages, keeping {len(recent_messages)} recent")
+        if self.mode == "replay":
+            entry = self.take(kind, keys)
+            if entry is not None:
+                await asyncio.sleep(self.scaled(entry.get("elapsed")))
+                if entry.get("error"):
+                    raise RuntimeError(entry["error"])
+                return entry.get("result")
+            print(f"  📼 Cassette miss for {kind} {name}, calling live")
+            return await fn()
         
-        summarizer = self._get_summarizer()
+        started = time.perf_counter()
+        try:
+            result = await fn()
+        except Exception as e:
+            await self.arecord(kind, keys, name=name, args=args, error=f"{type(e).__name__}: {e}",
+                               elapsed=round(time.perf_counter() - started, 4))
+            raise
+        await self.arecord(kind, keys, name=name, args=args, result=result,
+                           elapsed=round(time.perf_counter() - started, 4))
+        return result
+    
+    def wrap_tool(self, kind: str, original):
+        """Route a LangChain tool's calls through the cassette (unchanged when off)."""
+        if self.mode == "off":
+            return original
+        from langchain_core.tools import StructuredTool
         
-        if summarizer is None:
-            # Fallback: just keep recent messages
-            return recent_messages
+        async def recorded(**kwargs):
+            return await self.call(kind, original.name, kwargs, lambda: original.ainvoke(kwargs))
         
-        try:
-            from langchain_core.messages import HumanMessage, SystemMessage
-            
-            # Build text representation of older messages
-            history_text = ""
-            for msg in older_messages:
-                if hasattr(msg, 'content'):
-                    role = getattr(msg, 'type', 'unknown')
-                    content = str(msg.content)
-                elif isinstance(msg, dict):
-                    role = msg.get('role', 'unknown')
-                    content = str(msg.get('content', ''))
-                else:
-                    role = 'unknown'
-                    content = str(msg)
-                
-                # Truncate very long individual messages
-                if len(content) > 10000:
-                    content = content[:10000] + "...[truncated]"
-                
-                history_text += f"[{role}]: {content}\n\n"
-            
-            # Trim to summarizer input limit
-            history_text = history_text[:config.SUMMARIZER_INPUT_LIMIT]
-            
-            summary_messages = [
-                SystemMessage(content="""You are a conversation summarizer for an AI agent system.
+        return StructuredTool(
+            name=original.name,
+            description=original.description,
+            args_schema=original.args_schema,
+            coroutine=recorded,
+        )
+    
+    def wrap_model(self, name: str, model):
+        """Wrap a chat model so its responses are recorded or replayed (unchanged when off)."""
+        if self.mode == "off":
+            return model
+        return CassetteChatModel(recorded_model=name, inner=None if self.mode == "replay" else model)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "time_scale": self.time_scale,
+            "recorded": self.recorded,
+            "loaded_entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "loose_hits": self.loose_hits,
+            "misses": self.misses,
+        }
 
-Summarize the conversation history preserving ALL:
-- What the user asked for and the agent's conclusions/answers
-- Key data points retrieved (record IDs, names, amounts, statuses, dates)
-- Decisions made, actions taken, tools called and their outcomes
-- Any errors encountered and how they were resolved
-- Current task context and what the user is working towards
+cassette = Cassette(config.CASSETTE_PATH, config.CASSETTE_MODE, config.CASSETTE_TIME_SCALE)
 
-Format as a structured summary with sections. Be thorough but concise.
-Keep under 3000 words."""),
-                HumanMessage(content=f"Summarize this conversation history ({len(older_messages)} messages):\n\n{history_text}")
-            ]
-            
-            response = await summarizer.ainvoke(summary_messages)
-            summary_content = response.content
-            
+class CassetteChatModel(BaseChatModel):
+    """Chat model proxy that records the wrapped model's responses or replays them.
+    
+    `inner` is the live model (or its tool-bound runnable) when recording and
+    None when replaying. Streams keep their per-chunk timing.
+    """
+    
+    recorded_model: str
+    inner: Optional[Any] = None
+    tool_names: List[str] = []
+    
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+    
+    def bind_tools(self, tools, **kwargs):
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+        return self.model_copy(update={
+            "inner": self.inner.bind_tools(tools, **kwargs) if self.inner is not None else None,
+            "tool_names": [convert_to_openai_tool(t)["function"]["name"] for t in tools],
+        })
+    
+    def _keys(self, messages: list) -> List[str]:
+        last_type = getattr(messages[-1], "type", "") if messages else ""
+        return [
+            _cassette_key("llm", self.recorded_model, self.tool_names, _messages_fingerprint(messages)),
+            _cassette_key("llm", self.recorded_model, len(messages), last_type),
+            _cassette_key("llm", self.recorded_model),
+        ]
+    
+    def _replay_entry(self, messages: list) -> Dict[str, Any]:
+        entry = cassette.take("llm", self._keys(messages))
+        if entry is None:
+            raise LookupError(f"No recorded {self.recorded_model} response left in cassette {cassette.path}")
+        return entry
+    
+    @staticmethod
+    def _final_message(entry: Dict[str, Any]):
+        """Recorded response as one AIMessage (streamed entries are merged)."""
+        from langchain_core.messages import message_chunk_to_message, messages_from_dict
+        if entry.get("message"):
+            return messages_from_dict([entry["message"]])[0]
+        chunks = messages_from_dict([data for _, data in entry.get("chunks", [])])
+        merged = chunks[0]
+        for chunk in chunks[1:]:
+            merged = merged + chunk
+        return message_chunk_to_message(merged)
+    
+    @staticmethod
+    def _replay_chunks(entry: Dict[str, Any]) -> List[tuple]:
+        """(offset, AIMessageChunk) pairs; generate-recorded entries become one chunk."""
+        from langchain_core.messages import AIMessageChunk, messages_from_dict
+        if entry.get("chunks"):
+            return [(offset, messages_from_dict([data])[0]) for offset, data in entry["chunks"]]
+        message = messages_from_dict([entry["message"]])[0]
+        chunk = AIMessageChunk(content=message.content, tool_call_chunks=[
+            {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+            for i, call in enumerate(getattr(message, "tool_calls", None) or [])
+        ])
+        return [(entry.get("elapsed", 0), chunk)]
+    
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        from langchain_core.messages import message_to_dict
+        from langchain_core.outputs import ChatGeneration, ChatResult
+        if self.inner is None:
+            entry = self._replay_entry(messages)
+            time.sleep(cassette.scaled(entry.get("elapsed")))
+            return ChatResult(generations=[ChatGeneration(message=self._final_message(entry))])
+        started = time.perf_counter()
+        message = self.inner.invoke(messages, stop=stop, **kwargs)
+        cassette.record("llm", self._keys(messages), model=self.recorded_model,
+                        message=message_to_dict(message), elapsed=round(time.perf_counter() - started, 4))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        from langchain_core.messages import message_to_dict
+        from langchain_core.outputs import ChatGeneration, ChatResult
+        if self.inner is None:
+            entry = self._replay_entry(messages)
+            await asyncio.sleep(cassette.scaled(entry.get("elapsed")))
+            return ChatResult(generations=[ChatGeneration(message=self._final_message(entry))])
+        started = time.perf_counter()
+        message = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+        await cassette.arecord("llm", self._keys(messages), model=self.recorded_model,
+                               message=message_to_dict(message), elapsed=round(time.perf_counter() - started, 4))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        from langchain_core.messages import message_to_dict
+        from langchain_core.outputs import ChatGenerationChunk
+        started = time.perf_counter()
+        
+        if self.inner is None:
+            for offset, chunk in self._replay_chunks(self._replay_entry(messages)):
+                delay = cassette.scaled(offset) - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield ChatGenerationChunk(message=chunk)
+            return
+        
+        recorded_chunks = []
+        async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+            recorded_chunks.append([round(time.perf_counter() - started, 4), message_to_dict(chunk)])
+            yield ChatGenerationChunk(message=chunk)
+        await cassette.arecord("llm", self._keys(messages), model=self.recorded_model,
+                               chunks=recorded_chunks, elapsed=round(time.perf_counter() - started, 4))
+
+# ============================================================================
+# CONTEXT WINDOW MANAGER (ChatGPT-based)
+# ============================================================================
+
+class TokenCounter:
+    """Pluggable token counter with per-model tokenizers.
+    
+    Uses tiktoken when it is installed and its encoding files are available;
+    otherwise falls back to an offline heuristic that counts word and
+    punctuation runs (far closer than len/4 for JSON-heavy tool output).
+    Custom tokenizers can be registered per model prefix.
+    
+    Encodings are loaded once per encoding name (at startup via
+    load_encodings, or in a worker thread on first use) and never on the
+    event loop; a failed load is remembered so it is not retried. Until an
+    encoding is available its models are counted with the heuristic.
+    
+    Per-message counts are memoized by message id plus a content hash (a
+    message rewritten under the same id is recounted), and
+    per-conversation running totals make repeat threshold checks cost
+    O(new messages) tokenization plus one hash pass over the history.
+    """
+    
+    _HEURISTIC_PATTERN = re.compile(r"\w+|[^\w\s]")
+    
+    # Non-OpenAI models: a modern BPE is a close approximation
+    DEFAULT_ENCODING = "o200k_base"
+    
+    def __init__(self, cache_size: int):
+        self.cache_size = cache_size
+        self._tokenizers: Dict[str, tuple] = {}  # model -> (tokenizer tag, count_fn)
+        self._registered: List[tuple] = []
+        self._encodings: Dict[str, Any] = {}  # encoding name -> tiktoken Encoding, or None if it failed to load
+        self._encoding_lock = threading.Lock()
+        self._loading: set = set()
+        self._message_counts: "OrderedDict[str, int]" = OrderedDict()
+        # conversation key -> (messages counted, rolling hash of those messages, total)
+        self._running_totals: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def register_tokenizer(self, model_prefix: str, count_fn):
+        """Use `count_fn(text) -> int` for models whose name starts with `model_prefix`."""
+        self._registered.append((model_prefix, count_fn))
+        self._tokenizers.clear()
+    
+    def encoding_name(self, model: str) -> Optional[str]:
+        """tiktoken encoding used for a model, or None when tiktoken is not installed."""
+        try:
+            import tiktoken.model
+        except ImportError:
+            return None
+        try:
+            return tiktoken.model.encoding_name_for_model(model.split(":", 1)[-1])
+        except KeyError:
+            return self.DEFAULT_ENCODING
+    
+    def load_encoding(self, name: str):
+        """Load (or return the cached) encoding; blocking, may download the BPE file."""
+        with self._encoding_lock:
+            if name not in self._encodings:
+                try:
+                    import tiktoken
+                    self._encodings[name] = tiktoken.get_encoding(name)
+                except Exception as e:
+                    print(f"⚠️  tiktoken encoding {name} unavailable ({e}), using heuristic token counts")
+                    self._encodings[name] = None
+                # Models counted with the heuristic while this loaded can switch over now
+                self._tokenizers.clear()
+            self._loading.discard(name)
+            return self._encodings[name]
+    
+    def load_encodings(self, models: List[str]) -> Dict[str, bool]:
+        """Load the encodings for `models` up front (run in a worker thread)."""
+        names = {self.encoding_name(model) for model in models if model}
+        names.discard(None)
+        if names:
+            names.add(self.DEFAULT_ENCODING)
+        return {name: self.load_encoding(name) is not None for name in sorted(names)}
+    
+    def _tokenizer_for(self, model: Optional[str]) -> tuple:
+        model = model or config.MODEL
+        tokenizer = self._tokenizers.get(model)
+        if tokenizer is not None:
+            return tokenizer
+        
+        for prefix, fn in self._registered:
+            if model.startswith(prefix):
+                tokenizer = (f"custom:{prefix}", fn)
+                break
+        
+        if tokenizer is None:
+            name = self.encoding_name(model)
+            if name is None:
+                tokenizer = ("heuristic", self.heuristic_count)
+            elif name not in self._encodings:
+                self._load_in_background(name)
+                # Not cached: the model switches to the real encoding once it has loaded
+                return "heuristic", self.heuristic_count
+            elif self._encodings[name] is None:
+                tokenizer = ("heuristic", self.heuristic_count)
+            else:
+                encoding = self._encodings[name]
+                tokenizer = (f"tiktoken:{name}", lambda text: len(encoding.encode(text, disallowed_special=())))
+        
+        self._tokenizers[model] = tokenizer
+        return tokenizer
+    
+    def _load_in_background(self, name: str):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.load_encoding(name)  # No event loop to block: load inline
+            return
+        if name not in self._loading:
+            self._loading.add(name)
+            loop.run_in_executor(None, self.load_encoding, name)
+    
+    @classmethod
+    def heuristic_count(cls, text: str) -> int:
+        """Offline estimate: one token per punctuation char or word, plus one per 6 chars of long words."""
+        count = 0
+        for match in cls._HEURISTIC_PATTERN.finditer(text):
+            count += 1 + (match.end() - match.start()) // 6
+        return count
+    
+    def count_text(self, text: str, model: Optional[str] = None) -> int:
+        if not text:
+            return 0
+        return self._tokenizer_for(model)[1](text)
+    
+    @staticmethod
+    def _message_parts(msg) -> tuple:
+        if hasattr(msg, 'content'):
+            return getattr(msg, 'id', None), getattr(msg, 'type', ''), str(msg.content)
+        if isinstance(msg, dict):
+            return msg.get('id'), msg.get('role', ''), str(msg.get('content', ''))
+        return None, '', str(msg)
+    
+    def _fingerprint(self, msg, model: Optional[str]) -> tuple:
+        msg_id, role, content = self._message_parts(msg)
+        tag = self._tokenizer_for(model)[0]
+        # Compaction and summary replacement rewrite messages in place, so an id alone is not enough
+        digest = hashlib.blake2b(f"{role}\x00{content}".encode("utf-8", errors="replace"), digest_size=16).hexdigest()
+        key = f"{tag}:id:{msg_id}:{digest}" if msg_id else f"{tag}:{digest}"
+        return key, content
+    
+    def count_message(self, msg, model: Optional[str] = None) -> int:
+        key, content = self._fingerprint(msg, model)
+        count = self._message_counts.get(key)
+        if count is None:
+            count = self.count_text(content, model)
+            self._message_counts[key] = count
+            while len(self._message_counts) > self.cache_size:
+                self._message_counts.popitem(last=False)
+        else:
+            self._message_counts.move_to_end(key)
+        return count
+    
+    def count_messages(self, messages: list, model: Optional[str] = None,
+                       conversation_key: Optional[str] = None) -> int:
+        """Total tokens across messages.
+        
+        With a `conversation_key`, the previous total is reused when the
+        messages counted last time are still the prefix of this list (checked
+        with a rolling hash over every message), so only newly appended
+        messages are tokenized.
+        """
+        if conversation_key is None:
+            return sum(self.count_message(msg, model) for msg in messages)
+        
+        previous = self._running_totals.get(conversation_key)
+        counted = previous[0] if previous is not None else -1
+        rolling = hashlib.blake2b(digest_size=16)
+        prefix_digest = None
+        for index, msg in enumerate(messages):
+            if index == counted:
+                prefix_digest = rolling.hexdigest()
+            rolling.update(self._fingerprint(msg, model)[0].encode("utf-8") + b"\x00")
+        if counted == len(messages):
+            prefix_digest = rolling.hexdigest()
+        
+        start, total = 0, 0
+        if counted > 0 and prefix_digest == previous[1]:
+            start, total = counted, previous[2]
+        for msg in messages[start:]:
+            total += self.count_message(msg, model)
+        
+        if messages:
+            self._running_totals[conversation_key] = (len(messages), rolling.hexdigest(), total)
+            self._running_totals.move_to_end(conversation_key)
+            while len(self._running_totals) > self.cache_size:
+                self._running_totals.popitem(last=False)
+        return total
+
+
+class ConversationSummaryStore:
+    """Per-chat rolling conversation summaries persisted as JSON files.
+    
+    Each record holds the summary text, how many leading messages it covers,
+    and a fingerprint of those messages so edited history can be detected.
+    """
+    
+    MEMORY_ITEMS = 1024
+    
+    def __init__(self, directory: str, memory_items: int = MEMORY_ITEMS):
+        self.directory = directory
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    
+    def _path(self, chat_id: str) -> str:
+        name = hashlib.sha256(chat_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}.json")
+    
+    async def load(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        record = self._memory.get(chat_id)
+        if record is None:
+            record = await asyncio.to_thread(self._read, chat_id)
+            if record is not None:
+                self._remember(chat_id, record)
+        return record
+    
+    def _remember(self, chat_id: str, record: Dict[str, Any]):
+        if self.memory_items <= 0:
+            return
+        self._memory[chat_id] = record
+        self._memory.move_to_end(chat_id)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+    
+    async def save(self, chat_id: str, summary: str, covered: int, fingerprint: str):
+        record = {
+            "summary": summary,
+            "covered": covered,
+            "fingerprint": fingerprint,
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+        self._remember(chat_id, record)
+        await asyncio.to_thread(self._write, chat_id, record)
+    
+    async def invalidate(self, chat_id: str):
+        self._memory.pop(chat_id, None)
+        try:
+            await asyncio.to_thread(os.remove, self._path(chat_id))
+        except OSError:
+            pass
+    
+    def _read(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(chat_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _write(self, chat_id: str, record: Dict[str, Any]):
+        path = self._path(chat_id)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  ⚠️  Failed to persist conversation summary: {e}")
+
+
+class _Table(dict):
+    """Marker for a homogeneous record list encoded as columns + rows."""
+
+
+class ResponseCompactor:
+    """Deterministic, budget-driven compaction of structured tool responses.
+    
+    Runs before any LLM summarization:
+    1. Strip noise recursively: Salesforce `attributes` blobs, nulls, empties,
+       and JSON embedded in long strings is parsed so it can be compacted too.
+    2. Encode homogeneous record lists as {count, columns, rows} tables with
+       nested references flattened to dotted column names (Owner.Name).
+    3. Optionally truncate to a character budget: keep the most list items/rows
+       that fit (deeper lists keep proportionally fewer), shortening long
+       strings only when even one item per list would overflow.
+    """
+    
+    NOISE_KEYS = {"attributes"}
+    
+    # Parse strings longer than this if they look like embedded JSON
+    EMBEDDED_JSON_MIN_LENGTH = 1000
+    
+    # Smallest limits the budget search will shrink to
+    MIN_STRING_LENGTH = 64
+    MIN_LIST_ITEMS = 1
+    
+    def prepare(self, value) -> Optional[Any]:
+        """Lossless compaction (noise stripping + tables); None for plain text."""
+        if not isinstance(value, (dict, list)):
+            return None
+        return self.tabulate(self.strip_noise(value))
+    
+    def render(self, value, budget: Optional[int] = None) -> str:
+        """Serialize compactly, keeping as much as fits within `budget` chars."""
+        rendered = self._dumps(value)
+        if budget is None or len(rendered) <= budget:
+            return rendered
+        
+        items_needed, longest_string = self._extent(value, 0)
+        max_string = max(self.MIN_STRING_LENGTH, min(longest_string, config.MCP_MAX_STRING_LENGTH))
+        
+        # Largest item limit that fits at the configured string length...
+        rendered = self._largest_fitting(
+            lambda max_items: self._dumps(self._truncate(value, max_string, max_items, 0)),
+            self.MIN_LIST_ITEMS, max(self.MIN_LIST_ITEMS, items_needed), budget,
+        )
+        if rendered is not None:
+            return rendered
+        
+        # ...otherwise one item per list, with the longest strings that fit
+        rendered = self._largest_fitting(
+            lambda max_chars: self._dumps(self._truncate(value, max_chars, self.MIN_LIST_ITEMS, 0)),
+            self.MIN_STRING_LENGTH, max_string, budget,
+        )
+        if rendered is not None:
+            return rendered
+        return self._dumps(self._truncate(value, self.MIN_STRING_LENGTH, self.MIN_LIST_ITEMS, 0))[:budget]
+    
+    @staticmethod
+    def _largest_fitting(render, low: int, high: int, budget: int) -> Optional[str]:
+        """Binary search for the largest limit in [low, high] whose rendering fits."""
+        best = None
+        while low <= high:
+            limit = (low + high) // 2
+            rendered = render(limit)
+            if len(rendered) <= budget:
+                best = rendered
+                low = limit + 1
+            else:
+                high = limit - 1
+        return best
+    
+    def _extent(self, value, depth: int) -> tuple:
+        """(item limit that keeps every list whole, longest string) for _truncate."""
+        items_needed, longest_string = 0, 0
+        if isinstance(value, _Table):
+            items_needed = len(value["rows"]) << max(0, depth - 1)
+            children = [cell for row in value["rows"] for cell in row]
+        elif isinstance(value, dict):
+            children = list(value.values())
+        elif isinstance(value, list):
+            items_needed = len(value) << max(0, depth - 1)
+            children = value
+        else:
+            return 0, len(value) if isinstance(value, str) else 0
+        for child in children:
+            child_items, child_string = self._extent(child, depth + 1)
+            items_needed = max(items_needed, child_items)
+            longest_string = max(longest_string, child_string)
+        return items_needed, longest_string
+    
+    def strip_noise(self, value):
+        if isinstance(value, dict):
+            stripped = {}
+            for key, item in value.items():
+                if key in self.NOISE_KEYS:
+                    continue
+                item = self.strip_noise(item)
+                if item is None or item == "" or item == [] or item == {}:
+                    continue
+                stripped[key] = item
+            return stripped
+        if isinstance(value, list):
+            return [self.strip_noise(item) for item in value if item is not None]
+        if (isinstance(value, str) and len(value) > self.EMBEDDED_JSON_MIN_LENGTH
+                and value.lstrip()[:1] in ("{", "[")):
+            try:
+                return self.strip_noise(json.loads(value))
+            except ValueError:
+                return value
+        return value
+    
+    def tabulate(self, value):
+        if isinstance(value, dict):
+            return {key: self.tabulate(item) for key, item in value.items()}
+        if not isinstance(value, list):
+            return value
+        
+        items = [self.tabulate(item) for item in value]
+        if len(items) < 2 or not all(isinstance(item, dict) and not isinstance(item, _Table) for item in items):
+            return items
+        
+        rows = [self._flatten(item) for item in items]
+        columns = []
+        seen = set()
+        for row in rows:
+            for column in row:
+                if column not in seen:
+                    seen.add(column)
+                    columns.append(column)
+        
+        # Only tabulate when records mostly share the same fields
+        filled = sum(len(row) for row in rows)
+        if not columns or filled < 0.5 * len(rows) * len(columns):
+            return items
+        
+        return _Table(
+            count=len(rows),
+            columns=columns,
+            rows=[[row.get(column) for column in columns] for row in rows],
+        )
+    
+    def _flatten(self, record: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+        flat = {}
+        for key, item in record.items():
+            name = f"{prefix}{key}"
+            if isinstance(item, dict) and not isinstance(item, _Table):
+                flat.update(self._flatten(item, f"{name}."))
+            else:
+                flat[name] = item
+        return flat
+    
+    def _truncate(self, value, max_string: int, max_items: int, depth: int):
+        # Below the top-level wrapper, each nesting level keeps half as many items as its parent
+        item_limit = max(self.MIN_LIST_ITEMS, max_items >> max(0, depth - 1))
+        
+        if isinstance(value, _Table):
+            rows = value["rows"]
+            table = _Table(
+                count=value["count"],
+                columns=value["columns"],
+                rows=[
+                    [self._truncate(cell, max_string, max_items, depth + 1) for cell in row]
+                    for row in rows[:item_limit]
+                ],
+            )
+            if len(rows) > item_limit:
+                table["omitted_rows"] = len(rows) - item_limit
+            return table
+        if isinstance(value, dict):
+            return {key: self._truncate(item, max_string, max_items, depth + 1) for key, item in value.items()}
+        if isinstance(value, list):
+            truncated = [self._truncate(item, max_string, max_items, depth + 1) for item in value[:item_limit]]
+            if len(value) > item_limit:
+                truncated.append(f"... and {len(value) - item_limit} more items")
+            return truncated
+        if isinstance(value, str) and len(value) > max_string:
+            return value[:max_string] + f"...[truncated {len(value) - max_string:,} chars]"
+        return value
+    
+    @staticmethod
+    def _dumps(value) -> str:
+        return json.dumps(value, default=str, ensure_ascii=False, separators=(",", ":"))
+
+
+def evict_directory(directory: str, ttl_seconds: float, max_bytes: int) -> int:
+    """Delete files older than ttl_seconds, then the oldest until under max_bytes.
+    
+    Returns the number of files removed.
+    """
+    entries = []
+    removed = 0
+    now = time.time()
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > ttl_seconds:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+        total -= size
+    return removed
+
+
+def find_largest_list(value, path: Optional[list] = None) -> tuple:
+    """(path, list) of the longest list nested anywhere in value, or (None, None)."""
+    path = path or []
+    best = (path, value) if isinstance(value, list) else (None, None)
+    if isinstance(value, dict):
+        children = value.items()
+    elif isinstance(value, list):
+        children = enumerate(value)
+    else:
+        children = []
+    for key, child in children:
+        candidate = find_largest_list(child, path + [key])
+        if candidate[1] is not None and (best[1] is None or len(candidate[1]) > len(best[1])):
+            best = candidate
+    return best
+
+
+def replace_at_path(value, path: list, replacement):
+    """Copy of value with the element at path replaced (containers along the path are copied)."""
+    if not path:
+        return replacement
+    head, rest = path[0], path[1:]
+    copied = type(value)(value) if isinstance(value, dict) else list(value)
+    copied[head] = replace_at_path(value[head], rest, replacement)
+    return copied
+
+
+class SummaryCache:
+    """Two-tier, content-addressed cache for tool response summaries.
+    
+    Keys are a hash of (tool_name, payload, summarizer model, prompt version),
+    so any change to the inputs or the prompt naturally misses. Hot entries
+    live in an in-memory LRU; every entry is also written to disk, where
+    entries expire after SUMMARY_CACHE_TTL_SECONDS and the oldest files are
+    evicted once the directory exceeds SUMMARY_CACHE_MAX_BYTES.
+    """
+    
+    # Run a disk eviction pass every N writes
+    EVICT_EVERY_WRITES = 50
+    
+    def __init__(self, directory: str, memory_items: int, ttl_seconds: int, max_bytes: int):
+        self.directory = directory
+        self.memory_items = max(0, memory_items)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._writes_since_evict = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(tool_name: str, payload: str, model: str, prompt_version: str) -> str:
+        digest = hashlib.sha256()
+        for part in (tool_name, model, prompt_version, payload):
+            digest.update(part.encode("utf-8", errors="replace"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+    
+    async def get(self, key: str) -> Optional[str]:
+        summary = self._memory.get(key)
+        if summary is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return summary
+        
+        summary = await asyncio.to_thread(self._read_disk, key)
+        if summary is not None:
+            self.disk_hits += 1
+            self._remember(key, summary)
+            return summary
+        
+        self.misses += 1
+        return None
+    
+    async def set(self, key: str, summary: str):
+        self._remember(key, summary)
+        await asyncio.to_thread(self._write_disk, key, summary)
+    
+    def _remember(self, key: str, summary: str):
+        if self.memory_items == 0:
+            return
+        self._memory[key] = summary
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+    
+    def _read_disk(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                self.evictions += 1
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def _write_disk(self, key: str, summary: str):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(summary)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  ⚠️  Failed to write summary cache entry: {e}")
+            return
+        
+        self._writes_since_evict += 1
+        if self._writes_since_evict >= self.EVICT_EVERY_WRITES:
+            self._writes_since_evict = 0
+            self._evict_disk()
+    
+    def _evict_disk(self):
+        """Drop expired entries, then the oldest ones until under the size cap."""
+        self.evictions += evict_directory(self.directory, self.ttl_seconds, self.max_bytes)
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class ContextWindowManager:
+    """Manages context window using ChatGPT for summarization.
+    
+    Two responsibilities:
+    1. Summarize large MCP tool responses before they enter message history
+    2. Summarize older conversation messages when total tokens exceed threshold
+    """
+    
+    TOOL_SUMMARY_PROMPT = """You are a data extraction assistant. Your job is to summarize large tool/API responses 
+into a compact format that preserves ALL actionable information.
+
+RULES:
+- Preserve ALL: record IDs, names, amounts, dates, stages, statuses, owners, types
+- Preserve ALL: relationships, lookup fields, reference IDs, counts, aggregates
+- Preserve ALL: error messages, warnings, validation failures
+- Remove: redundant metadata fields (attributes, urls, api types), duplicate nested references
+- Remove: null/empty fields, system timestamps that aren't business-relevant
+- Format: Use structured text, not JSON. Group related records logically.
+- If data contains records/rows, present them as a concise numbered list with key fields
+- Always state the total count of records at the top
+- Keep your summary under 5000 words"""
+    
+    CONVERSATION_SUMMARY_PROMPT = """You are a conversation summarizer for an AI agent system.
+
+Summarize the conversation history preserving ALL:
+- What the user asked for and the agent's conclusions/answers
+- Key data points retrieved (record IDs, names, amounts, statuses, dates)
+- Decisions made, actions taken, tools called and their outcomes
+- Any errors encountered and how they were resolved
+- Current task context and what the user is working towards
+
+Format as a structured summary with sections. Be thorough but concise.
+Keep under 3000 words."""
+    
+    TOOL_SUMMARY_MERGE_PROMPT = """You are a data extraction assistant. You are given partial summaries of
+consecutive parts of ONE large tool/API response. Merge them into a single summary.
+
+RULES:
+- Keep ALL records, IDs, names, amounts, dates, stages, statuses and owners from every part
+- Combine counts and aggregates across parts; state the overall total count at the top
+- Remove duplication introduced by the split (repeated headers, repeated context)
+- Preserve ALL error messages, warnings and validation failures
+- Format: Use structured text, not JSON. Group related records logically.
+- Keep your summary under 5000 words"""
+    
+    # Bump when the summarization prompt or post-processing changes meaning
+    TOOL_SUMMARY_PROMPT_VERSION = hashlib.sha256(
+        (TOOL_SUMMARY_PROMPT + TOOL_SUMMARY_MERGE_PROMPT + "map-reduce").encode("utf-8")
+    ).hexdigest()[:12]
+    
+    # Re-split levels for partials too large to merge, before falling back to truncation
+    MAX_REDUCE_DEPTH = 3
+    
+    def __init__(self):
+        self._summarizer = None
+        self.compactor = ResponseCompactor()
+        self.token_counter = TokenCounter(config.TOKEN_COUNT_CACHE_SIZE)
+        # Other workers update the same chats' summaries, so multi-worker mode reads them from disk
+        self.conversation_summaries = ConversationSummaryStore(
+            config.CONVERSATION_SUMMARY_DIR,
+            0 if config.MULTI_WORKER else ConversationSummaryStore.MEMORY_ITEMS,
+        )
+        self.summary_cache = SummaryCache(
+            directory=config.SUMMARY_CACHE_DIR,
+            memory_items=config.SUMMARY_CACHE_MEMORY_ITEMS,
+            ttl_seconds=config.SUMMARY_CACHE_TTL_SECONDS,
+            max_bytes=config.SUMMARY_CACHE_MAX_BYTES,
+        )
+    
+    def _get_summarizer(self):
+        """Lazy-initialize the ChatGPT summarizer."""
+        if self._summarizer is None and (config.SUMMARIZER_MODEL in CHAT_MODEL_FACTORIES or cassette.mode == "replay"):
+            self._summarizer = resolve_chat_model(config.SUMMARIZER_MODEL)
+        if self._summarizer is None:
+            try:
+                from langchain_openai import ChatOpenAI
+                self._summarizer = ChatOpenAI(
+                    model=config.SUMMARIZER_MODEL,
+                    temperature=0,
+                    max_tokens=4096,
+                    api_key=config.OPENAI_API_KEY or os.getenv("OPENAI_API_KEY"),
+                )
+                self._summarizer = cassette.wrap_model(config.SUMMARIZER_MODEL, self._summarizer)
+                print(f"✓ Context summarizer initialized: {config.SUMMARIZER_MODEL}")
+            except Exception as e:
+                print(f"⚠️  Failed to initialize summarizer: {e}")
+                print("   Falling back to truncation-only mode")
+                self._summarizer = None
+        return self._summarizer
+    
+    def estimate_tokens(self, text: str, model: Optional[str] = None) -> int:
+        """Token count for text using the model's tokenizer (or offline fallback)."""
+        return self.token_counter.count_text(text, model)
+    
+    def estimate_messages_tokens(self, messages: list, model: Optional[str] = None,
+                                 conversation_key: Optional[str] = None) -> int:
+        """Total tokens across all messages, memoized per message."""
+        return self.token_counter.count_messages(messages, model, conversation_key)
+    
+    async def summarize_tool_response(self, tool_name: str, result_str: str) -> str:
+        """Summarize a large MCP tool response (traced as a "summarize" span)."""
+        with trace_span("summarize_tool_response", "summarize", tool=tool_name, chars=len(result_str)):
+            return await self._summarize_tool_response(tool_name, result_str)
+    
+    async def _summarize_tool_response(self, tool_name: str, result_str: str) -> str:
+        """Summarize a large MCP tool response using ChatGPT.
+        
+        Preserves all critical data (IDs, names, amounts, dates, statuses)
+        while removing redundant metadata and formatting.
+        
+        Falls back to intelligent truncation if summarizer is unavailable.
+        """
+        summarizer = self._get_summarizer()
+        
+        if summarizer is None:
+            # Fallback: truncate with context
+            TRUNCATION_FALLBACKS_TOTAL.inc(reason="summarizer_unavailable")
+            return self._truncate_with_context(result_str)
+        
+        cache_key = SummaryCache.make_key(
+            tool_name, result_str, config.SUMMARIZER_MODEL, self.TOOL_SUMMARY_PROMPT_VERSION
+        )
+        cached = await self.summary_cache.get(cache_key)
+        if cached is not None:
+            print(f"  ✓ Summary cache hit for {tool_name} ({len(result_str):,} chars)")
+            return cached
+        
+        SUMMARIZATIONS_TOTAL.inc(kind="tool")
+        try:
+            from langchain_core.messages import HumanMessage, SystemMessage
+            
+            if len(result_str) <= config.SUMMARIZER_INPUT_LIMIT:
+                messages = [
+                    SystemMessage(content=self.TOOL_SUMMARY_PROMPT),
+                    HumanMessage(content=f"Summarize this {tool_name} response ({len(result_str):,} chars):\n\n{result_str}")
+                ]
+                
+                response = await self._invoke_summarizer(summarizer, messages, "tool")
+                summary = response.content
+                degraded = False
+            else:
+                # Too large for one call: map-reduce over record-aligned chunks
+                summary, degraded = await self._map_reduce_summarize(summarizer, tool_name, result_str)
+            
+            # Add metadata footer
+            summary += f"\n\n[Summarized from {len(result_str):,} chars. Full data saved to disk.]"
+            
+            print(f"  ✓ Summarized {tool_name} response: {len(result_str):,} → {len(summary):,} chars")
+            if degraded:
+                # Part of it fell back to truncation (e.g. rate limits): retry next time instead of caching
+                print(f"  ⚠️  Not caching degraded summary for {tool_name}")
+            else:
+                await self.summary_cache.set(cache_key, summary)
+            return summary
+            
+        except Exception as e:
+            print(f"  ⚠️  Summarization failed for {tool_name}: {e}")
+            TRUNCATION_FALLBACKS_TOTAL.inc(reason="summarizer_error")
+            return self._truncate_with_context(result_str)
+    
+    async def _invoke_summarizer(self, summarizer, messages: list, kind: str):
+        """Call the summarizer LLM, recording its latency."""
+        started = time.perf_counter()
+        try:
+            return await summarizer.ainvoke(messages)
+        finally:
+            SUMMARIZER_SECONDS.observe(time.perf_counter() - started, kind=kind)
+    
+    async def _map_reduce_summarize(self, summarizer, tool_name: str, result_str: str) -> tuple:
+        """Summarize chunks concurrently, then merge the partial summaries.
+        
+        Returns (summary, degraded); degraded is True if any chunk or merge
+        fell back to truncated text.
+        """
+        from langchain_core.messages import HumanMessage, SystemMessage
+        
+        chunk_size = config.SUMMARIZER_INPUT_LIMIT
+        chunks = await asyncio.to_thread(self._split_for_summary, result_str, chunk_size)
+        semaphore = asyncio.Semaphore(max(1, config.SUMMARIZER_MAX_CONCURRENCY))
+        fallbacks: List[str] = []
+        
+        print(f"  🧩 Map-reduce summarizing {tool_name}: {len(result_str):,} chars in {len(chunks)} chunks")
+        
+        async def summarize_chunk(index: int, chunk: str) -> str:
+            async with semaphore:
+                try:
+                    response = await self._invoke_summarizer(summarizer, [
+                        SystemMessage(content=self.TOOL_SUMMARY_PROMPT),
+                        HumanMessage(content=(
+                            f"Summarize part {index + 1} of {len(chunks)} of this {tool_name} response "
+                            f"({len(result_str):,} chars total). Summarize only this part:\n\n{chunk}"
+                        ))
+                    ], "tool_chunk")
+                    return response.content
+                except Exception as e:
+                    print(f"  ⚠️  Chunk {index + 1}/{len(chunks)} summarization failed: {e}")
+                    TRUNCATION_FALLBACKS_TOTAL.inc(reason="chunk_error")
+                    fallbacks.append("chunk_error")
+                    return self._truncate_with_context(chunk, config.MCP_MAX_STRING_LENGTH // len(chunks) or None)
+        
+        partials = await asyncio.gather(*(summarize_chunk(i, c) for i, c in enumerate(chunks)))
+        summary = await self._reduce_partials(summarizer, tool_name, list(partials), semaphore, fallbacks=fallbacks)
+        return summary, bool(fallbacks)
+    
+    async def _reduce_partials(self, summarizer, tool_name: str, partials: List[str],
+                               semaphore: asyncio.Semaphore, depth: int = 0,
+                               fallbacks: Optional[List[str]] = None) -> str:
+        """Merge partial summaries in groups that fit the summarizer input, until one remains.
+        
+        Partials too large to merge in one call are re-split into input-sized
+        pieces, each condensed separately, and the results reduced recursively.
+        Truncation fallbacks are appended to `fallbacks`.
+        """
+        from langchain_core.messages import HumanMessage, SystemMessage
+        
+        chunk_size = config.SUMMARIZER_INPUT_LIMIT
+        
+        async def merge_call(text: str, parts: int) -> str:
+            async with semaphore:
+                response = await self._invoke_summarizer(summarizer, [
+                    SystemMessage(content=self.TOOL_SUMMARY_MERGE_PROMPT),
+                    HumanMessage(content=f"Merge these {parts} partial summaries of the {tool_name} response:\n\n{text}")
+                ], "tool_merge")
+                return response.content
+        
+        while len(partials) > 1:
+            groups, current, current_size = [], [], 0
+            for partial in partials:
+                size = len(partial) + 16  # "### Part N" header and separator
+                if current and current_size + size > chunk_size:
+                    groups.append(current)
+                    current, current_size = [], 0
+                current.append(partial)
+                current_size += size
+            groups.append(current)
+            
+            if len(groups) == len(partials):
+                # Every partial fills a whole input on its own; merge pairwise to guarantee progress
+                groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+            
+            async def merge(group: List[str]) -> str:
+                if len(group) == 1:
+                    return group[0]
+                joined = "\n\n".join(f"### Part {i + 1}\n{text}" for i, text in enumerate(group))
+                if len(joined) <= chunk_size:
+                    return await merge_call(joined, len(group))
+                if depth >= self.MAX_REDUCE_DEPTH:
+                    TRUNCATION_FALLBACKS_TOTAL.inc(reason="merge_too_large")
+                    if fallbacks is not None:
+                        fallbacks.append("merge_too_large")
+                    return await merge_call(self._truncate_with_context(joined, chunk_size), len(group))
+                pieces = self._split_text(joined, chunk_size)
+                condensed = await asyncio.gather(*(merge_call(piece, len(group)) for piece in pieces))
+                return await self._reduce_partials(summarizer, tool_name, list(condensed), semaphore, depth + 1, fallbacks)
+            
+            partials = list(await asyncio.gather(*(merge(g) for g in groups)))
+        
+        return partials[0]
+    
+    def _split_for_summary(self, text: str, chunk_size: int) -> List[str]:
+        """Split text into chunks of at most ~chunk_size chars on record boundaries."""
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        
+        if isinstance(data, (dict, list)):
+            chunks = self._split_json_records(data, chunk_size)
+            if chunks:
+                return chunks
+        return self._split_text(text, chunk_size)
+    
+    def _split_json_records(self, data, chunk_size: int) -> List[str]:
+        """Split the largest record list in `data` into chunks of at most ~chunk_size chars.
+        
+        A small envelope (the data around the records) is repeated in each
+        chunk; a large one gets chunks of its own and the records are keyed by
+        their path instead. Records larger than a chunk are split on their own
+        structure, or as text.
+        """
+        path, records = find_largest_list(data)
+        if not records or len(records) < 2:
+            return []
+        
+        dumps = ResponseCompactor._dumps
+        envelope = dumps(replace_at_path(data, path, []))
+        chunks = []
+        if len(envelope) > chunk_size // 2:
+            chunks.extend(self._split_text(envelope, chunk_size))
+            label = ".".join(str(key) for key in path) or "records"
+            wrap = lambda batch: dumps({label: batch})
+            records_budget = chunk_size - len(wrap([]))
+        else:
+            wrap = lambda batch: dumps(replace_at_path(data, path, batch))
+            records_budget = chunk_size - len(envelope)
+        
+        current, current_size = [], 0
+        for record in records:
+            text = dumps(record)
+            if len(text) > records_budget:
+                if current:
+                    chunks.append(wrap(current))
+                    current, current_size = [], 0
+                pieces = self._split_json_records(record, chunk_size) if isinstance(record, (dict, list)) else []
+                chunks.extend(pieces or self._split_text(text, chunk_size))
+                continue
+            if current and current_size + len(text) + 1 > records_budget:
+                chunks.append(wrap(current))
+                current, current_size = [], 0
+            current.append(record)
+            current_size += len(text) + 1
+        if current:
+            chunks.append(wrap(current))
+        return chunks
+    
+    @staticmethod
+    def _split_text(text: str, chunk_size: int) -> List[str]:
+        """Split plain text on line boundaries, hard-splitting only oversized lines."""
+        chunks, current, current_size = [], [], 0
+        for line in text.splitlines(keepends=True):
+            while len(line) > chunk_size:
+                if current:
+                    chunks.append("".join(current))
+                    current, current_size = [], 0
+                chunks.append(line[:chunk_size])
+                line = line[chunk_size:]
+            if current and current_size + len(line) > chunk_size:
+                chunks.append("".join(current))
+                current, current_size = [], 0
+            current.append(line)
+            current_size += len(line)
+        if current:
+            chunks.append("".join(current))
+        return chunks
+    
+    async def summarize_conversation_history(self, messages: list, model: Optional[str] = None,
+                                             chat_id: Optional[str] = None) -> list:
+        """Summarize older messages when conversation exceeds token threshold.
+        
+        Strategy:
+        - Keep the most recent N messages verbatim (they contain current context)
+        - Summarize everything before that into a single context message
+        - The agent sees: [summary_of_history] + [recent_messages]
+        
+        With a chat_id, the summary is rolled forward: the stored summary is
+        reused and only messages that newly left the keep-recent window are
+        folded in. If the already-summarized history was edited, the stored
+        summary is invalidated and rebuilt from scratch.
+        
+        Returns the compressed message list.
+        """
+        total_tokens = self.estimate_messages_tokens(messages, model, conversation_key=chat_id)
+        
+        if total_tokens < config.CONVERSATION_SUMMARIZE_TOKEN_THRESHOLD:
+            return messages  # No summarization needed
+        
+        keep_count = config.CONVERSATION_KEEP_RECENT_MESSAGES
+        
+        if len(messages) <= keep_count:
+            return messages  # Not enough messages to summarize
+        
+        # Split: older messages to summarize, recent messages to keep
+        older_messages = messages[:-keep_count]
+        recent_messages = messages[-keep_count:]
+        
+        # Reuse the rolling summary when it still matches the older history
+        previous = await self.conversation_summaries.load(chat_id) if chat_id else None
+        if previous is not None:
+            covered = previous["covered"]
+            if covered > len(older_messages) or self._history_fingerprint(older_messages[:covered]) != previous["fingerprint"]:
+                print(f"  ♻️  Conversation history edited, invalidating rolling summary for {chat_id}")
+                await self.conversation_summaries.invalidate(chat_id)
+                previous = None
+        
+        new_segment = older_messages[previous["covered"]:] if previous else older_messages
+        
+        print(f"  📝 Summarizing conversation: {len(messages)} messages ({total_tokens:,} tokens)")
+        print(f"     Summarizing {len(new_segment)} older messages, keeping {len(recent_messages)} recent"
+              + (f" (folding into rolling summary of {previous['covered']})" if previous else ""))
+        
+        try:
+            if previous and not new_segment:
+                summary_content = previous["summary"]
+            else:
+                summarizer = self._get_summarizer()
+                
+                if summarizer is None:
+                    # Fallback: just keep recent messages
+                    return recent_messages
+                
+                from langchain_core.messages import HumanMessage, SystemMessage
+                
+                # Trim to summarizer input limit
+                history_text = self._history_text(new_segment)[:config.SUMMARIZER_INPUT_LIMIT]
+                
+                if previous:
+                    request_text = (
+                        f"Existing summary of the earlier conversation ({previous['covered']} messages):\n\n"
+                        f"{previous['summary']}\n\n"
+                        f"Fold these {len(new_segment)} newer messages into it and return the updated summary:\n\n"
+                        f"{history_text}"
+                    )
+                else:
+                    request_text = f"Summarize this conversation history ({len(older_messages)} messages):\n\n{history_text}"
+                
+                summary_messages = [
+                    SystemMessage(content=self.CONVERSATION_SUMMARY_PROMPT),
+                    HumanMessage(content=request_text)
+                ]
+                
+                SUMMARIZATIONS_TOTAL.inc(kind="conversation")
+                with trace_span("summarize_conversation", "summarize", messages=len(new_segment)):
+                    response = await self._invoke_summarizer(summarizer, summary_messages, "conversation")
+                summary_content = response.content
+                
+                if chat_id:
+                    await self.conversation_summaries.save(
+                        chat_id,
+                        summary_content,
+                        covered=len(older_messages),
+                        fingerprint=self._history_fingerprint(older_messages),
+                    )
+            
             # Create a summary message to prepend
             summary_msg = {
                 "role": "system",
@@ -295,155 +1979,1605 @@ Keep under 3000 words."""),
                 for msg in recent_messages
             ]
             
-            new_tokens = self.estimate_messages_tokens(compressed)
+            new_tokens = self.estimate_messages_tokens(compressed, model)
             print(f"  ✓ Conversation compressed: {total_tokens:,} → {new_tokens:,} tokens")
             
-            return compressed
+            return compressed
+            
+        except Exception as e:
+            print(f"  ⚠️  Conversation summarization failed: {e}")
+            TRUNCATION_FALLBACKS_TOTAL.inc(reason="conversation_error")
+            # Fallback: keep only recent messages
+            return recent_messages
+    
+    @staticmethod
+    def _message_role_content(msg) -> tuple:
+        if hasattr(msg, 'content'):
+            return getattr(msg, 'type', 'unknown'), str(msg.content)
+        if isinstance(msg, dict):
+            return msg.get('role', 'unknown'), str(msg.get('content', ''))
+        return 'unknown', str(msg)
+    
+    def _history_text(self, messages: list) -> str:
+        """Text representation of messages for the summarizer."""
+        history_text = ""
+        for msg in messages:
+            role, content = self._message_role_content(msg)
+            
+            # Truncate very long individual messages
+            if len(content) > 10000:
+                content = content[:10000] + "...[truncated]"
+            
+            history_text += f"[{role}]: {content}\n\n"
+        return history_text
+    
+    def _history_fingerprint(self, messages: list) -> str:
+        """Hash of the roles and contents of `messages`, used to detect edited history."""
+        digest = hashlib.sha256()
+        for msg in messages:
+            role, content = self._message_role_content(msg)
+            digest.update(role.encode("utf-8", errors="replace"))
+            digest.update(b"\x00")
+            digest.update(content.encode("utf-8", errors="replace"))
+            digest.update(b"\x01")
+        return digest.hexdigest()
+    
+    def _truncate_with_context(self, text: str, max_length: int = None) -> str:
+        """Intelligent truncation fallback: keep beginning and end."""
+        max_len = max_length or config.MCP_MAX_STRING_LENGTH
+        if len(text) <= max_len:
+            return text
+        
+        # Keep 70% from start, 30% from end
+        head_size = int(max_len * 0.7)
+        tail_size = int(max_len * 0.25)
+        
+        return (
+            text[:head_size] +
+            f"\n\n...[TRUNCATED {len(text) - head_size - tail_size:,} chars]...\n\n" +
+            text[-tail_size:]
+        )
+
+# Global context manager
+context_manager = ContextWindowManager()
+
+# ============================================================================
+# SPILL STORE (full MCP responses)
+# ============================================================================
+
+class SpillStore:
+    """Content-addressed, gzip-compressed store for full tool responses.
+    
+    Each response is written once under a stable reference id (a hash of its
+    content) as `<ref>.jsonl.gz`:
+    - line 1: metadata (tool, kind, sizes, path of the record list)
+    - JSON responses: line 2 is the envelope with its largest record list
+      emptied, followed by one record per line
+    - text responses: the raw text
+    The line layout lets readers page through records without loading the
+    whole document. Writes run off the event loop; files older than
+    MCP_SPILL_MAX_AGE_SECONDS or beyond MCP_SPILL_MAX_BYTES are evicted.
+    """
+    
+    REF_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+    EVICT_EVERY_WRITES = 20
+    
+    def __init__(self, directory: str, max_bytes: int, max_age_seconds: int, compression_level: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.compression_level = compression_level
+        self._writes_since_evict = 0
+        self._evict_lock = threading.Lock()
+        self.writes = 0
+        self.dedup_hits = 0
+        self.evictions = 0
+    
+    def is_valid_ref(self, ref: str) -> bool:
+        return bool(ref) and bool(self.REF_PATTERN.match(ref))
+    
+    def path_for(self, ref: str) -> str:
+        if not self.is_valid_ref(ref):
+            raise ValueError(f"Invalid spill reference: {ref!r}")
+        return os.path.join(self.directory, f"{ref}.jsonl.gz")
+    
+    async def put(self, tool_name: str, result) -> str:
+        """Persist a response and return its reference id."""
+        return await asyncio.to_thread(self._put, tool_name, result)
+    
+    def _put(self, tool_name: str, result) -> str:
+        dumps = ResponseCompactor._dumps
+        records_path, records = None, None
+        
+        if isinstance(result, (dict, list)):
+            kind = "json"
+            records_path, records = find_largest_list(result)
+            if records is not None and len(records) >= 2:
+                envelope = replace_at_path(result, records_path, [])
+            else:
+                records_path, records, envelope = None, None, result
+            body = "\n".join([dumps(envelope)] + [dumps(record) for record in records or []])
+        else:
+            kind = "text"
+            body = str(result)
+        
+        ref = hashlib.sha256(f"{kind}\x00{body}".encode("utf-8", errors="replace")).hexdigest()[:32]
+        path = self.path_for(ref)
+        
+        if os.path.exists(path):
+            # Same content already spilled: refresh its age
+            os.utime(path)
+            self.dedup_hits += 1
+            return ref
+        
+        meta = {
+            "ref": ref,
+            "tool": tool_name,
+            "kind": kind,
+            "created_at": datetime.utcnow().isoformat(),
+            "chars": len(body),
+            "records_path": records_path,
+            "record_count": len(records) if records is not None else None,
+        }
+        
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=self.compression_level) as f:
+            f.write(json.dumps(meta, default=str) + "\n")
+            f.write(body)
+        os.replace(tmp_path, path)
+        self.writes += 1
+        
+        with self._evict_lock:
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self.EVICT_EVERY_WRITES:
+                self._writes_since_evict = 0
+                self.evictions += evict_directory(self.directory, self.max_age_seconds, self.max_bytes)
+        return ref
+    
+    def read_meta(self, ref: str) -> Dict[str, Any]:
+        with gzip.open(self.path_for(ref), "rt", encoding="utf-8") as f:
+            return json.loads(f.readline())
+    
+    def iter_lines(self, ref: str):
+        """Yield (meta, line iterator) without decompressing the whole file up front."""
+        f = gzip.open(self.path_for(ref), "rt", encoding="utf-8")
+        try:
+            meta = json.loads(f.readline())
+            yield meta
+            for line in f:
+                yield line
+        finally:
+            f.close()
+    
+    def load(self, ref: str):
+        """Reassemble the full original response."""
+        lines = self.iter_lines(ref)
+        meta = next(lines)
+        if meta["kind"] == "text":
+            return "".join(lines)
+        envelope = json.loads(next(lines))
+        if meta["records_path"] is None:
+            return envelope
+        records = [json.loads(line) for line in lines if line.strip()]
+        return replace_at_path(envelope, meta["records_path"], records)
+    
+    # ------------------------------------------------------------------
+    # Querying
+    # ------------------------------------------------------------------
+    
+    WHERE_PATTERN = re.compile(r"^\s*([\w.\-]+)\s*(!=|>=|<=|=|~|>|<)\s*(.*?)\s*$")
+    
+    @staticmethod
+    def _get_field(record, path: str):
+        value = record
+        for part in path.split("."):
+            if isinstance(value, dict):
+                value = value.get(part)
+            elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                value = value[int(part)]
+            else:
+                return None
+        return value
+    
+    @classmethod
+    def _parse_where(cls, where: Optional[str]) -> list:
+        """Parse "field=value; other>10" into (path, op, value) conditions."""
+        conditions = []
+        for clause in (where or "").split(";"):
+            if not clause.strip():
+                continue
+            match = cls.WHERE_PATTERN.match(clause)
+            if not match:
+                raise ValueError(f"Invalid filter clause: {clause.strip()!r}")
+            conditions.append(match.groups())
+        return conditions
+    
+    @classmethod
+    def _matches(cls, record, conditions: list) -> bool:
+        for path, op, expected in conditions:
+            actual = cls._get_field(record, path)
+            if op == "~":
+                if expected.lower() not in json.dumps(actual, default=str).lower():
+                    return False
+                continue
+            if op in ("=", "!="):
+                text = actual if isinstance(actual, str) else json.dumps(actual, default=str)
+                if (text.lower() == expected.strip("'\"").lower()) != (op == "="):
+                    return False
+                continue
+            try:
+                left, right = float(actual), float(expected)
+            except (TypeError, ValueError):
+                return False
+            if not {">": left > right, "<": left < right, ">=": left >= right, "<=": left <= right}[op]:
+                return False
+        return True
+    
+    @classmethod
+    def _project(cls, record, fields: list):
+        if not fields or not isinstance(record, dict):
+            return record
+        return {path: cls._get_field(record, path) for path in fields}
+    
+    def query(self, ref: str, offset: int = 0, limit: int = 20,
+              where: Optional[str] = None, fields: Optional[str] = None,
+              max_chars: Optional[int] = None) -> Dict[str, Any]:
+        """Page, filter and project one spilled response, streaming its records.
+        
+        JSON responses are queried record by record; text responses line by
+        line (only `~` filters apply to text). `matched` counts all records
+        passing the filter, so callers know how far they can page.
+        """
+        conditions = self._parse_where(where)
+        projection = [f.strip() for f in (fields or "").split(",") if f.strip()]
+        offset, limit = max(0, offset), max(1, limit)
+        
+        lines = self.iter_lines(ref)
+        meta = next(lines)
+        result: Dict[str, Any] = {"ref": ref, "tool": meta["tool"], "kind": meta["kind"]}
+        
+        if meta["kind"] == "json":
+            envelope = json.loads(next(lines))
+            if meta["records_path"] is None:
+                # No record list: treat the whole document as a single record
+                items = iter([envelope])
+            else:
+                result["records_path"] = meta["records_path"]
+                if offset == 0:
+                    result["envelope"] = envelope
+                items = (json.loads(line) for line in lines if line.strip())
+            matches = lambda item: self._matches(item, conditions)
+        else:
+            items = (line.rstrip("\n") for line in lines)
+            needles = [expected.lower() for _, op, expected in conditions if op == "~"]
+            matches = lambda item: all(needle in item.lower() for needle in needles)
+        
+        page, matched = [], 0
+        for item in items:
+            if not matches(item):
+                continue
+            if offset <= matched < offset + limit:
+                page.append(self._project(item, projection) if meta["kind"] == "json" else item)
+            matched += 1
+        
+        result.update({"offset": offset, "matched": matched, "returned": len(page), "records": page})
+        
+        # Keep the answer itself below the summarization threshold
+        if max_chars:
+            while len(page) > 1 and len(json.dumps(result, default=str)) > max_chars:
+                page.pop()
+            result["returned"] = len(page)
+            if result.get("envelope") is not None and len(json.dumps(result, default=str)) > max_chars:
+                result["envelope"] = "(omitted: too large)"
+        if offset + len(page) < matched:
+            result["next_offset"] = offset + len(page)
+        return result
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "writes": self.writes,
+            "dedup_hits": self.dedup_hits,
+            "evictions": self.evictions,
+        }
+
+spill_store = SpillStore(
+    directory=config.MCP_SPILL_DIR,
+    max_bytes=config.MCP_SPILL_MAX_BYTES,
+    max_age_seconds=config.MCP_SPILL_MAX_AGE_SECONDS,
+    compression_level=config.MCP_SPILL_COMPRESSION_LEVEL,
+)
+
+# ============================================================================
+# VECTOR INDEX (large tool responses, per chat)
+# ============================================================================
+
+# Chat the current request belongs to; tools read it to scope per-chat state
+current_chat_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_chat_id", default=None)
+
+
+class HashingEmbedder:
+    """Offline fallback embedder: signed feature hashing of word unigrams and bigrams."""
+    
+    WORD_PATTERN = re.compile(r"[\w@.\-]+")
+    
+    def __init__(self, dims: int = 1024):
+        self.dims = dims
+        self.name = f"hashing-{dims}"
+    
+    def _embed_sync(self, texts: List[str]):
+        import numpy as np
+        
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = self.WORD_PATTERN.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = hashlib.md5(feature.encode("utf-8")).digest()
+                index = int.from_bytes(digest[:4], "little") % self.dims
+                vectors[row, index] += 1.0 if digest[4] & 1 else -1.0
+        return vectors
+    
+    async def embed_documents(self, texts: List[str]):
+        return await asyncio.to_thread(self._embed_sync, texts)
+    
+    async def embed_query(self, text: str):
+        return (await self.embed_documents([text]))[0]
+
+
+class OpenAIEmbedder:
+    """Embeddings via langchain_openai (used when OPENAI_API_KEY is configured)."""
+    
+    def __init__(self, model: str):
+        from langchain_openai import OpenAIEmbeddings
+        
+        self.name = f"openai-{model}"
+        self._client = OpenAIEmbeddings(
+            model=model,
+            api_key=config.OPENAI_API_KEY or os.getenv("OPENAI_API_KEY"),
+        )
+    
+    async def embed_documents(self, texts: List[str]):
+        import numpy as np
+        return np.asarray(await self._client.aembed_documents(texts), dtype=np.float32)
+    
+    async def embed_query(self, text: str):
+        import numpy as np
+        return np.asarray(await self._client.aembed_query(text), dtype=np.float32)
+
+
+class ChatVectorIndex:
+    """Array-backed cosine index of response chunks for one chat."""
+    
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.vectors = None  # (capacity, dims) float32, rows L2-normalized
+        self.size = 0
+        self.chunks: List[str] = []
+        self.refs: List[str] = []
+        self.tools: Dict[str, str] = {}  # ref -> tool name
+        self.last_used = time.time()
+    
+    def add(self, ref: str, tool_name: str, chunks: List[str], vectors):
+        import numpy as np
+        
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        
+        needed = self.size + len(chunks)
+        if self.vectors is None or needed > self.vectors.shape[0]:
+            capacity = max(needed, 2 * (self.vectors.shape[0] if self.vectors is not None else 64))
+            grown = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+            if self.vectors is not None:
+                grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        
+        self.vectors[self.size:needed] = vectors
+        self.size = needed
+        self.chunks.extend(chunks)
+        self.refs.extend([ref] * len(chunks))
+        self.tools[ref] = tool_name
+    
+    def search(self, query_vector, k: int, ref: Optional[str] = None) -> List[Dict[str, Any]]:
+        import numpy as np
+        
+        if not self.size:
+            return []
+        query_vector = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+        scores = self.vectors[:self.size] @ query_vector
+        if ref is not None:
+            scores = np.where(np.asarray(self.refs) == ref, scores, -np.inf)
+        
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"ref": self.refs[i], "tool": self.tools[self.refs[i]], "score": round(float(scores[i]), 4), "text": self.chunks[i]}
+            for i in top if np.isfinite(scores[i])
+        ]
+
+
+class VectorIndexStore:
+    """Per-chat vector indexes over large tool responses, kept in memory.
+    
+    Indexes are LRU-bounded by VECTOR_INDEX_MAX_CHATS, dropped after
+    VECTOR_INDEX_IDLE_SECONDS without use, and removed explicitly when a chat
+    is cleared. Each response (by spill reference id) is indexed at most once
+    per chat.
+    """
+    
+    GLOBAL_SCOPE = "__global__"
+    
+    def __init__(self, max_chats: int, idle_seconds: int):
+        self.max_chats = max_chats
+        self.idle_seconds = idle_seconds
+        self._indexes: "OrderedDict[str, ChatVectorIndex]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._embedder = None
+        self.indexed_chunks = 0
+        self.searches = 0
+    
+    def _get_embedder(self):
+        if self._embedder is None:
+            if config.OPENAI_API_KEY or os.getenv("OPENAI_API_KEY"):
+                try:
+                    self._embedder = OpenAIEmbedder(config.VECTOR_INDEX_EMBEDDING_MODEL)
+                except Exception as e:
+                    print(f"  ⚠️  OpenAI embeddings unavailable, using hashing embedder: {e}")
+            if self._embedder is None:
+                self._embedder = HashingEmbedder()
+        return self._embedder
+    
+    def _scope(self, chat_id: Optional[str]) -> str:
+        return chat_id or self.GLOBAL_SCOPE
+    
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_seconds
+        for scope in [s for s, index in self._indexes.items() if index.last_used < cutoff]:
+            del self._indexes[scope]
+        while len(self._indexes) > self.max_chats:
+            self._indexes.popitem(last=False)
+    
+    async def add(self, chat_id: Optional[str], ref: str, tool_name: str, chunks: List[str]) -> int:
+        """Embed and index chunks of one response; returns the number of chunks indexed.
+        
+        At most VECTOR_INDEX_MAX_CHUNKS leading chunks are indexed; callers
+        compare the result with len(chunks) to tell when coverage is partial.
+        """
+        scope = self._scope(chat_id)
+        index = self._indexes.get(scope)
+        if index is not None and ref in index.tools:
+            index.last_used = time.time()
+            return index.refs.count(ref)
+        
+        chunks = chunks[:config.VECTOR_INDEX_MAX_CHUNKS]
+        embedder = index.embedder if index is not None else self._get_embedder()
+        vectors = await embedder.embed_documents(chunks)
+        
+        async with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                index = self._indexes[scope] = ChatVectorIndex(embedder)
+            if ref not in index.tools:
+                index.add(ref, tool_name, chunks, vectors)
+                self.indexed_chunks += len(chunks)
+            index.last_used = time.time()
+            self._indexes.move_to_end(scope)
+            self._evict_idle()
+        return len(chunks)
+    
+    async def search(self, chat_id: Optional[str], question: str, k: int = 5,
+                     ref: Optional[str] = None) -> List[Dict[str, Any]]:
+        index = self._indexes.get(self._scope(chat_id))
+        if index is None:
+            return []
+        index.last_used = time.time()
+        self.searches += 1
+        query_vector = await index.embedder.embed_query(question)
+        return await asyncio.to_thread(index.search, query_vector, k, ref)
+    
+    def drop(self, chat_id: Optional[str]) -> bool:
+        return self._indexes.pop(self._scope(chat_id), None) is not None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chats": len(self._indexes),
+            "chunks": sum(index.size for index in self._indexes.values()),
+            "indexed_chunks_total": self.indexed_chunks,
+            "searches": self.searches,
+            "embedder": self._embedder.name if self._embedder else None,
+        }
+
+vector_index = VectorIndexStore(
+    max_chats=config.VECTOR_INDEX_MAX_CHATS,
+    idle_seconds=config.VECTOR_INDEX_IDLE_SECONDS,
+)
+
+# ============================================================================
+# BUILT-IN TOOLS
+# ============================================================================
+
+_duckduckgo_search = None
+
+def get_duckduckgo_search():
+    """DuckDuckGo search tool, created on first agent build (langchain_community is slow to import)."""
+    global _duckduckgo_search
+    if _duckduckgo_search is None:
+        from langchain_community.tools import DuckDuckGoSearchRun
+        _duckduckgo_search = DuckDuckGoSearchRun()
+    return _duckduckgo_search
+
+def _import_agent_dependencies():
+    """Import the heavy agent-building modules; run off the event loop on first build."""
+    from deepagents import create_deep_agent
+    return create_deep_agent, get_duckduckgo_search()
+
+@tool
+def get_current_time() -> str:
+    """Get the current date and time."""
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+@tool
+async def query_tool_response(ref_id: str, offset: int = 0, limit: int = 20,
+                              where: Optional[str] = None, fields: Optional[str] = None) -> str:
+    """Look up exact data in a large tool response that was summarized or compacted.
+    
+    Use the ref id from a "[Full data ref: ...]" note instead of calling the
+    original tool again.
+    
+    Args:
+        ref_id: Reference id from the "[Full data ref: ...]" note
+        offset: Index of the first matching record to return
+        limit: Maximum number of records to return
+        where: Optional filters separated by ";", e.g. "status=Open; amount>1000; name~acme".
+            Operators: = != > < >= <= and ~ (contains). Use dotted paths for nested fields.
+            For text responses, filter lines with "line~word".
+        fields: Optional comma-separated fields to return per record, e.g. "id,name,owner.email"
+    """
+    if not spill_store.is_valid_ref(ref_id):
+        return f"Error: invalid ref id {ref_id!r}"
+    if not os.path.exists(spill_store.path_for(ref_id)):
+        return f"Error: no stored response for ref {ref_id} (it may have expired)"
+    try:
+        result = await asyncio.to_thread(
+            spill_store.query, ref_id, offset, min(limit, 200), where, fields,
+            config.TOOL_RESPONSE_SUMMARIZE_THRESHOLD
+        )
+    except ValueError as e:
+        return f"Error: {e}"
+    return json.dumps(result, default=str)
+
+@tool
+async def search_tool_response(question: str, ref_id: Optional[str] = None, k: int = 5) -> str:
+    """Retrieve the parts of large tool responses in this chat most relevant to a question.
+    
+    Large responses noted as "indexed" can be searched here without calling
+    the original tool again.
+    
+    Args:
+        question: What you are looking for, in natural language
+        ref_id: Optional ref id to search a single response (from its "Full data ref" note)
+        k: Number of chunks to return (max 20)
+    """
+    results = await vector_index.search(current_chat_id.get(), question, max(1, min(k, 20)), ref_id)
+    if not results:
+        return "No indexed tool responses match in this chat."
+    return json.dumps(results, default=str)
+
+# ============================================================================
+# CUSTOM TOOLS LOADER
+# ============================================================================
+
+class CustomToolsLoader:
+    """Load custom tools from Python files.
+    
+    Modules are cached by file path and only re-executed when the file's
+    content changes (checked by mtime/size first, then by hash). With
+    CUSTOM_TOOLS_LAZY_IMPORT enabled, tools whose schemas are already in the
+    on-disk manifest are exposed as stubs and the module is imported, in a
+    worker thread, on the tool's first invocation. Modules are registered as
+    `custom_tools.<stem>` so they never shadow a real package of that name.
+    """
+    
+    MANIFEST_FILENAME = ".tools_manifest.json"
+    MODULE_NAMESPACE = "custom_tools"
+    
+    def __init__(self):
+        # filepath -> {"stat": (mtime_ns, size), "hash": str, "tools": [...]}
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._import_locks: Dict[str, asyncio.Lock] = {}
+    
+    def load_tools_from_directory(self, directory: str) -> List[Any]:
+        """Load custom tools from Python files in a directory."""
+        tools = []
+        
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+            example_tool = '''"""Example custom tool"""
+from langchain_core.tools import tool
+
+@tool
+def example_calculator(a: float, b: float, operation: str = "add") -> float:
+    """Perform basic arithmetic operations.
+    
+    Args:
+        a: First number
+        b: Second number
+        operation: Operation to perform (add, subtract, multiply, divide)
+    
+    Returns:
+        Result of the operation
+    """
+    if operation == "add":
+        return a + b
+    elif operation == "subtract":
+        return a - b
+    elif operation == "multiply":
+        return a * b
+    elif operation == "divide":
+        if b == 0:
+            return "Error: Division by zero"
+        return a / b
+    else:
+        return "Error: Unknown operation"
+'''
+            with open(os.path.join(directory, "example_tools.py"), "w") as f:
+                f.write(example_tool)
+        
+        manifest = self._read_manifest(directory)
+        manifest_changed = False
+        
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".py") and not filename.startswith("__"):
+                filepath = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(filepath)
+                    stat_key = (stat.st_mtime_ns, stat.st_size)
+                    cached = self._cache.get(filepath)
+                    
+                    if cached and cached["stat"] == stat_key:
+                        tools.extend(cached["tools"])
+                        continue
+                    
+                    with open(filepath, "rb") as f:
+                        file_hash = hashlib.sha256(f.read()).hexdigest()
+                    
+                    if cached and cached["hash"] == file_hash:
+                        # Touched but unchanged
+                        cached["stat"] = stat_key
+                        tools.extend(cached["tools"])
+                        continue
+                    
+                    manifest_entry = manifest.get(filename)
+                    if (config.CUSTOM_TOOLS_LAZY_IMPORT and manifest_entry
+                            and manifest_entry.get("hash") == file_hash):
+                        file_tools = [
+                            self._make_lazy_tool(filepath, spec)
+                            for spec in manifest_entry.get("tools", [])
+                        ]
+                        for t in file_tools:
+                            print(f"Registered lazy custom tool: {t.name}")
+                    else:
+                        file_tools = self._import_tools(filepath)
+                        manifest[filename] = {
+                            "hash": file_hash,
+                            "tools": [self._describe_tool(t) for t in file_tools],
+                        }
+                        manifest_changed = True
+                    
+                    self._cache[filepath] = {"stat": stat_key, "hash": file_hash, "tools": file_tools}
+                    tools.extend(file_tools)
+                except Exception as e:
+                    print(f"Error loading tools from {filename}: {e}")
+        
+        if manifest_changed:
+            self._write_manifest(directory, manifest)
+        
+        return tools
+    
+    def _import_tools(self, filepath: str) -> List[Any]:
+        """Execute a tool module and collect its tool objects."""
+        import sys
+        import importlib.util
+        
+        module_name = f"{self.MODULE_NAMESPACE}.{os.path.basename(filepath)[:-3]}"
+        spec = importlib.util.spec_from_file_location(module_name, filepath)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        
+        tools = []
+        for attr_name in dir(module):
+            attr = getattr(module, attr_name)
+            if hasattr(attr, "name") and hasattr(attr, "description"):
+                tools.append(attr)
+                print(f"Loaded custom tool: {attr.name}")
+        return tools
+    
+    @staticmethod
+    def _describe_tool(t) -> Dict[str, Any]:
+        """Serializable schema of a tool, used to build lazy stubs later."""
+        args_schema = getattr(t, "args_schema", None)
+        if hasattr(args_schema, "model_json_schema"):
+            args_schema = args_schema.model_json_schema()
+        elif not isinstance(args_schema, dict):
+            args_schema = None
+        return {"name": t.name, "description": t.description, "args_schema": args_schema}
+    
+    def _make_lazy_tool(self, filepath: str, spec: Dict[str, Any]):
+        """Stub tool that imports its module on first call and delegates to it."""
+        from langchain_core.tools import StructuredTool
+        
+        tool_name = spec["name"]
+        
+        async def lazy_func(*args, **kwargs):
+            cached = self._cache.get(filepath)
+            real_tools = cached.get("real_tools") if cached else None
+            if real_tools is None:
+                # One import per module even if several of its tools are called at once
+                async with self._import_locks.setdefault(filepath, asyncio.Lock()):
+                    cached = self._cache.get(filepath)
+                    real_tools = cached.get("real_tools") if cached else None
+                    if real_tools is None:
+                        # A heavy import must not stall the event loop
+                        imported = await asyncio.to_thread(self._import_tools, filepath)
+                        real_tools = {t.name: t for t in imported}
+                        if cached is not None:
+                            cached["real_tools"] = real_tools
+            
+            real = real_tools.get(tool_name)
+            if real is None:
+                raise RuntimeError(f"Custom tool '{tool_name}' no longer exists in {filepath}")
             
+            func = real.coroutine if getattr(real, "coroutine", None) else real.func
+            if asyncio.iscoroutinefunction(func):
+                return await func(*args, **kwargs)
+            return await asyncio.to_thread(func, *args, **kwargs)
+        
+        return StructuredTool(
+            name=tool_name,
+            description=spec["description"],
+            coroutine=lazy_func,
+            args_schema=spec.get("args_schema") or {"type": "object", "properties": {}},
+        )
+    
+    def _read_manifest(self, directory: str) -> Dict[str, Any]:
+        path = os.path.join(directory, self.MANIFEST_FILENAME)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    
+    def _write_manifest(self, directory: str, manifest: Dict[str, Any]):
+        path = os.path.join(directory, self.MANIFEST_FILENAME)
+        try:
+            with open(path, "w") as f:
+                json.dump(manifest, f, indent=2, default=str)
         except Exception as e:
-            print(f"  ⚠️  Conversation summarization failed: {e}")
-            # Fallback: keep only recent messages
-            return recent_messages
+            print(f"⚠️  Failed to write custom tools manifest: {e}")
+
+# ============================================================================
+# WORKER SYNC (multi-worker change notifications)
+# ============================================================================
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    """Exclusive advisory lock shared by every process on this host (no-op without fcntl)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+def process_start_time(pid: int) -> Optional[str]:
+    """Start time of a process in clock ticks since boot (Linux), or None if unknown.
     
-    def _truncate_with_context(self, text: str, max_length: int = None) -> str:
-        """Intelligent truncation fallback: keep beginning and end."""
-        max_len = max_length or config.MCP_MAX_STRING_LENGTH
-        if len(text) <= max_len:
-            return text
+    Paired with the pid it identifies one process: a pid reused after a
+    container restart has a different start time.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    fields = stat.rsplit(")", 1)[-1].split()
+    return fields[19] if len(fields) > 19 else None
+
+class WorkerSync:
+    """Cross-worker change notifications through a shared append-only event log.
+    
+    With `uvicorn --workers N` each worker holds its own agents, MCP sessions
+    and in-memory caches. `publish()` appends an event to a JSONL file under
+    an exclusive file lock; every worker polls the file every
+    WORKER_SYNC_INTERVAL seconds and runs the handlers subscribed to events
+    published by the other workers. The log is rotated past MAX_BYTES.
+    """
+    
+    MAX_BYTES = 1024 * 1024
+    
+    def __init__(self, directory: str, interval: float, enabled: bool):
+        self.path = os.path.join(directory, "events.jsonl")
+        self.interval = max(0.1, interval)
+        self.enabled = enabled
+        # pid-starttime-random: the start time tells a reused pid apart from its previous owner
+        self.worker_id = f"{os.getpid()}-{process_start_time(os.getpid()) or 0}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, List[Any]] = {}
+        self._offset = 0
+        self._inode: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.received = 0
+    
+    def subscribe(self, event: str, handler):
+        """Run `await handler(record)` for `event`s published by other workers."""
+        self._handlers.setdefault(event, []).append(handler)
+    
+    async def publish(self, event: str, **payload):
+        if not self.enabled:
+            return
+        record = {"event": event, "worker": self.worker_id, "at": time.time(), **payload}
+        try:
+            await asyncio.to_thread(self._append, record)
+            self.published += 1
+        except OSError as e:
+            print(f"⚠️  Failed to publish worker event {event}: {e}")
+    
+    def _append(self, record: Dict[str, Any]):
+        with file_lock(self.path + ".lock"):
+            try:
+                if os.path.getsize(self.path) > self.MAX_BYTES:
+                    os.replace(self.path, self.path + ".1")
+            except FileNotFoundError:
+                pass
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+    
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        # Only events published after this worker started are relevant
+        try:
+            stat = os.stat(self.path)
+            self._inode, self._offset = stat.st_ino, stat.st_size
+        except FileNotFoundError:
+            self._inode, self._offset = None, 0
+        self._task = asyncio.create_task(self._poll())
+        print(f"✓ Worker sync started ({self.worker_id}, {self.path})")
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                records = await asyncio.to_thread(self._read_new)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Worker sync read failed: {e}")
+                continue
+            for record in records:
+                if record.get("worker") == self.worker_id:
+                    continue
+                self.received += 1
+                for handler in self._handlers.get(record.get("event"), []):
+                    try:
+                        await handler(record)
+                    except Exception as e:
+                        print(f"⚠️  Worker sync handler for {record.get('event')} failed: {e}")
+    
+    def _read_new(self) -> List[Dict[str, Any]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        records = []
+        if stat.st_ino != self._inode:
+            # Rotated: finish the previous file before starting on the new one
+            rotated = self.path + ".1"
+            if self._inode is not None and os.path.exists(rotated) and os.stat(rotated).st_ino == self._inode:
+                records.extend(self._read_lines(rotated, self._offset)[0])
+            self._inode, self._offset = stat.st_ino, 0
+        new_records, consumed = self._read_lines(self.path, self._offset)
+        self._offset += consumed
+        return records + new_records
+    
+    @staticmethod
+    def _read_lines(path: str, offset: int) -> tuple:
+        """Complete JSON lines after offset, and the bytes they span."""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        return [json.loads(line) for line in data[:end].splitlines() if line.strip()], end
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "worker_id": self.worker_id,
+            "published": self.published,
+            "received": self.received,
+        }
+
+worker_sync = WorkerSync(config.WORKER_SYNC_DIR, config.WORKER_SYNC_INTERVAL, config.MULTI_WORKER)
+
+# ============================================================================
+# MCP CONFIGURATION MANAGER
+# ============================================================================
+
+class MCPConfigManager:
+    """Manage MCP server configurations
+    
+    Writes hold an exclusive lock on `<config_file>.lock` and replace the file
+    atomically, so workers sharing the file never lose each other's changes.
+    update() and reload() do their locking and file I/O in a worker thread,
+    since another worker may hold the lock.
+    """
+    
+    def __init__(self, config_file: str):
+        self.config_file = config_file
+        self.lock_file = f"{config_file}.lock"
+        self.config = self._load_config()
+        tool_result_cache.load_policies(self.config.get("tool_cache", {}))
+    
+    def _load_config(self) -> Dict[str, Any]:
+        if os.path.exists(self.config_file):
+            with open(self.config_file, 'r') as f:
+                return json.load(f)
+        else:
+            default_config = {
+                "mcp_servers": {
+                    "example_filesystem": {
+                        "command": "npx",
+                        "args": ["-y", "@modelcontextprotocol/server-filesystem", "./workspace"],
+                        "transport": "stdio",
+                        "enabled": False
+                    }
+                }
+            }
+            with file_lock(self.lock_file):
+                self._write(default_config)
+            return default_config
+    
+    def save_config(self, config: Dict[str, Any]):
+        with file_lock(self.lock_file):
+            self._write(config)
+        self._apply(config)
+    
+    async def update(self, mutate):
+        """Apply `mutate(config)` to the latest on-disk config under the lock and save it.
         
-        # Keep 70% from start, 30% from end
-        head_size = int(max_len * 0.7)
-        tail_size = int(max_len * 0.25)
+        Returns whatever `mutate` returns.
+        """
+        current, result = await asyncio.to_thread(self._update_locked, mutate)
+        self._apply(current)
+        return result
+    
+    def _update_locked(self, mutate) -> tuple:
+        with file_lock(self.lock_file):
+            if os.path.exists(self.config_file):
+                with open(self.config_file, 'r') as f:
+                    current = json.load(f)
+            else:
+                current = json.loads(json.dumps(self.config))
+            result = mutate(current)
+            self._write(current)
+        return current, result
+    
+    async def reload(self):
+        """Re-read the config file (after another worker changed it)."""
+        self._apply(await asyncio.to_thread(self._load_config))
+    
+    def _apply(self, config: Dict[str, Any]):
+        self.config = config
+        tool_result_cache.load_policies(config.get("tool_cache", {}))
+    
+    def _write(self, config: Dict[str, Any]):
+        tmp_path = f"{self.config_file}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(config, f, indent=2)
+        os.replace(tmp_path, self.config_file)
+    
+    def get_enabled_servers(self) -> Dict[str, Any]:
+        mcp_servers = self.config.get("mcp_servers", {})
+        enabled_servers = {}
+        for name, cfg in mcp_servers.items():
+            if cfg.get("enabled", False):
+                server_config = {k: v for k, v in cfg.items() if k != "enabled"}
+                enabled_servers[name] = server_config
+        return enabled_servers
+
+# ============================================================================
+# MCP TOOL RESULT CACHE
+# ============================================================================
+
+class ToolResultCache:
+    """TTL cache with single-flight coalescing for read-only MCP tool calls.
+    
+    Policies come from the top-level "tool_cache" section of mcp_config.json,
+    keyed by tool name (glob patterns allowed):
         
-        return (
-            text[:head_size] +
-            f"\n\n...[TRUNCATED {len(text) - head_size - tail_size:,} chars]...\n\n" +
-            text[-tail_size:]
-        )
+        "tool_cache": {
+            "describe_object": {"read_only": true, "ttl_seconds": 300, "key_fields": ["object_name"]},
+            "run_soql*": {"read_only": true, "ttl_seconds": 30}
+        }
+    
+    Only read-only tools are cached or coalesced; concurrent identical calls
+    share one in-flight request. key_fields limits which arguments form the
+    cache key (default: all of them).
+    
+    With `shared_dir` set, JSON-serializable results are also written there
+    so other workers on the host can serve them until they expire.
+    """
+    
+    # Run a shared-tier eviction pass every N writes
+    EVICT_EVERY_WRITES = 50
+    
+    def __init__(self, max_entries: int, shared_dir: str = "", shared_max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.shared_dir = shared_dir
+        self.shared_max_bytes = shared_max_bytes
+        self.policies: Dict[str, Dict[str, Any]] = {}
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, result)
+        self._inflight: Dict[str, Dict[str, Any]] = {}  # key -> {"task", "waiters"}
+        self._metrics: Dict[str, Dict[str, int]] = {}
+        self._shared_writes_since_evict = 0
+        self.shared_hits = 0
+    
+    def load_policies(self, policies: Dict[str, Any]):
+        self.policies = {name: dict(policy) for name, policy in (policies or {}).items() if isinstance(policy, dict)}
+        self._entries.clear()
+    
+    def policy_for(self, tool_name: str) -> Optional[Dict[str, Any]]:
+        policy = self.policies.get(tool_name)
+        if policy is None:
+            policy = next((p for pattern, p in self.policies.items() if fnmatch.fnmatchcase(tool_name, pattern)), None)
+        if policy and policy.get("read_only"):
+            return policy
+        return None
+    
+    @staticmethod
+    def make_key(tool_name: str, kwargs: Dict[str, Any], key_fields: Optional[List[str]]) -> str:
+        if key_fields:
+            kwargs = {field: kwargs.get(field) for field in key_fields}
+        payload = json.dumps([tool_name, kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _count(self, tool_name: str, outcome: str):
+        counters = self._metrics.setdefault(tool_name, {"hits": 0, "misses": 0, "coalesced": 0})
+        counters[outcome] += 1
+    
+    async def call(self, tool_name: str, kwargs: Dict[str, Any], invoke):
+        """Return a cached/in-flight result for this call, or run invoke() once."""
+        policy = self.policy_for(tool_name)
+        if policy is None:
+            return await invoke()
+        
+        key = self.make_key(tool_name, kwargs, policy.get("key_fields"))
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self._count(tool_name, "hits")
+                return entry[1]
+            del self._entries[key]
+        
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self._count(tool_name, "coalesced")
+        else:
+            # The call runs in a task owned by the cache, not by whichever caller
+            # started it, so one caller disconnecting doesn't cancel the others
+            flight = {"task": None, "waiters": 0}
+            flight["task"] = asyncio.create_task(self._run(key, tool_name, policy, invoke, flight))
+            self._inflight[key] = flight
+        
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(flight["task"])
+        finally:
+            flight["waiters"] -= 1
+            if flight["waiters"] == 0 and not flight["task"].done():
+                # Last caller gave up: nobody is left to receive the result
+                flight["task"].cancel()
+    
+    async def _run(self, key: str, tool_name: str, policy: Dict[str, Any], invoke, flight: Dict[str, Any]):
+        try:
+            if self.shared_dir:
+                shared = await asyncio.to_thread(self._read_shared, key)
+                if shared is not None:
+                    self._remember(key, shared)
+                    self.shared_hits += 1
+                    self._count(tool_name, "hits")
+                    return shared[1]
+            
+            self._count(tool_name, "misses")
+            result = await invoke()
+            ttl = float(policy.get("ttl_seconds", 0))
+            if ttl > 0:
+                entry = (time.time() + ttl, result)
+                self._remember(key, entry)
+                if self.shared_dir:
+                    await asyncio.to_thread(self._write_shared, key, tool_name, entry)
+            return result
+        finally:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+    
+    def _remember(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def _shared_path(self, key: str) -> str:
+        return os.path.join(self.shared_dir, key[:2], f"{key}.json")
+    
+    def _read_shared(self, key: str) -> Optional[tuple]:
+        path = self._shared_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get("expires_at", 0) <= time.time():
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            return None
+        return record["expires_at"], record["result"]
+    
+    def _write_shared(self, key: str, tool_name: str, entry: tuple):
+        path = self._shared_path(key)
+        try:
+            payload = json.dumps({"tool": tool_name, "expires_at": entry[0], "result": entry[1]})
+        except (TypeError, ValueError):
+            return  # Not JSON-serializable: keep it in this worker's memory only
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  ⚠️  Failed to write shared tool cache entry: {e}")
+            return
+        
+        self._shared_writes_since_evict += 1
+        if self._shared_writes_since_evict >= self.EVICT_EVERY_WRITES:
+            self._shared_writes_since_evict = 0
+            # Entries carry their own expiry; the age bound here only catches abandoned files
+            evict_directory(self.shared_dir, 7 * 24 * 3600, self.shared_max_bytes)
+    
+    def stats(self) -> Dict[str, Any]:
+        tools = {}
+        for name, counters in self._metrics.items():
+            served = counters["hits"] + counters["coalesced"]
+            total = served + counters["misses"]
+            tools[name] = {**counters, "hit_rate": round(served / total, 3) if total else 0.0}
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "shared_dir": self.shared_dir or None,
+            "shared_hits": self.shared_hits,
+            "policies": sorted(self.policies),
+            "tools": tools,
+        }
 
-# Global context manager
-context_manager = ContextWindowManager()
+tool_result_cache = ToolResultCache(
+    config.TOOL_CACHE_MAX_ENTRIES,
+    shared_dir=config.TOOL_CACHE_SHARED_DIR,
+    shared_max_bytes=config.TOOL_CACHE_SHARED_MAX_BYTES,
+)
 
 # ============================================================================
-# BUILT-IN TOOLS
+# MCP SESSION POOL
 # ============================================================================
 
-duckduckgo_search = DuckDuckGoSearchRun()
+class MCPServerSession:
+    """A single long-lived MCP session.
+    
+    The session runs inside its own task so the transport's context managers
+    (stdio process, task groups) are entered and exited in the same task,
+    independent of whichever request happened to open it. A stdio server's
+    stderr goes to its own errlog (discarded), never the process-wide stream.
+    """
+    
+    def __init__(self, name: str, connection: Dict[str, Any]):
+        self.name = name
+        self.connection = connection
+        self.session = None
+        self.tools: List[Any] = []
+        self.connected_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+    
+    async def start(self):
+        """Open the session and load its tool schemas."""
+        self._task = asyncio.create_task(self._run())
+        await self._ready.wait()
+        if self.session is None:
+            raise RuntimeError(self.last_error or f"MCP server '{self.name}' failed to start")
+    
+    @contextlib.asynccontextmanager
+    async def _stdio_session(self):
+        """Like the adapter's stdio session, but with this server's own errlog."""
+        from mcp import ClientSession, StdioServerParameters
+        from mcp.client.stdio import stdio_client
+        
+        env = self.connection.get("env")
+        if env is not None:
+            # Only ${VAR} references are expanded, as the adapter does
+            env = {k: re.sub(r"\$\{(\w+)\}", lambda m: os.environ.get(m.group(1), m.group(0)), str(v)) for k, v in env.items()}
+        params = StdioServerParameters(
+            command=self.connection["command"],
+            args=self.connection.get("args", []),
+            env=env,
+            cwd=self.connection.get("cwd"),
+        )
+        with open(os.devnull, "w") as errlog:
+            async with stdio_client(params, errlog=errlog) as (read, write):
+                async with ClientSession(read, write, **(self.connection.get("session_kwargs") or {})) as session:
+                    await session.initialize()
+                    yield session
+    
+    async def _run(self):
+        from langchain_mcp_adapters.client import MultiServerMCPClient
+        from langchain_mcp_adapters.tools import load_mcp_tools
+        
+        try:
+            if self.connection.get("transport", "stdio") == "stdio":
+                session_context = self._stdio_session()
+            else:
+                session_context = MultiServerMCPClient({self.name: self.connection}).session(self.name)
+            async with session_context as session:
+                self.tools = await load_mcp_tools(session)
+                self.session = session
+                self.connected_at = time.time()
+                self.last_error = None
+                self._ready.set()
+                await self._stop.wait()
+        except Exception as e:
+            self.last_error = str(e)
+        finally:
+            self.session = None
+            self._ready.set()
+    
+    async def ping(self, timeout: float) -> bool:
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=timeout)
+            return True
+        except Exception as e:
+            self.last_error = f"ping failed: {e}"
+            return False
+    
+    async def close(self):
+        self._stop.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=10)
+            except Exception:
+                self._task.cancel()
 
-@tool
-def get_current_time() -> str:
-    """Get the current date and time."""
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+class MCPSessionPool:
+    """Per-server persistent MCP sessions shared by every agent build.
+    
+    Tool schemas are cached when a server connects. The tools handed to agents
+    are thin proxies that resolve the server's *current* session at call time,
+    so a reconnect never invalidates an already-built agent. A background task
+    pings each session and reconnects only the server that stopped answering.
+    """
+    
+    def __init__(self):
+        self._servers: Dict[str, MCPServerSession] = {}
+        self._connections: Dict[str, Dict[str, Any]] = {}
+        self._proxy_tools: Dict[str, List[Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._reconnects: Dict[str, int] = {}
+        self._health_task: Optional[asyncio.Task] = None
+    
+    def get_tools(self, names: List[str]) -> List[Any]:
+        """Cached proxy tools for the given servers, in order."""
+        tools = []
+        for name in names:
+            tools.extend(self._proxy_tools.get(name, []))
+        return tools
+    
+    async def ensure_connected(self, name: str, connection: Dict[str, Any]) -> MCPServerSession:
+        """Connect a server unless a live session with the same config exists."""
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            entry = self._servers.get(name)
+            if entry is not None and entry.alive and entry.connection == connection:
+                return entry
+            
+            if entry is not None:
+                await entry.close()
+                self._reconnects[name] = self._reconnects.get(name, 0) + 1
+            
+            print(f"Connecting MCP server '{name}'...")
+            entry = MCPServerSession(name, connection)
+            self._servers[name] = entry
+            self._connections[name] = connection
+            await entry.start()
+            
+            self._proxy_tools[name] = [self._make_proxy_tool(name, t) for t in entry.tools]
+            print(f"✓ MCP server '{name}' connected ({len(entry.tools)} tools)")
+            return entry
+    
+    async def disconnect(self, name: str):
+        entry = self._servers.pop(name, None)
+        self._connections.pop(name, None)
+        self._proxy_tools.pop(name, None)
+        self._reconnects.pop(name, None)
+        if entry is not None:
+            await entry.close()
+            print(f"✓ MCP server '{name}' disconnected")
+    
+    async def call_tool(self, server_name: str, tool_name: str, arguments: Dict[str, Any]):
+        """Invoke a tool on the server's live session, reconnecting lazily if needed."""
+        entry = self._servers.get(server_name)
+        if entry is None or not entry.alive:
+            connection = self._connections.get(server_name)
+            if connection is None:
+                raise RuntimeError(f"MCP server '{server_name}' is not configured")
+            entry = await self.ensure_connected(server_name, connection)
+        
+        for t in entry.tools:
+            if t.name == tool_name:
+                return await t.coroutine(**arguments)
+        raise RuntimeError(f"Tool '{tool_name}' not found on MCP server '{server_name}'")
+    
+    def _make_proxy_tool(self, server_name: str, original_tool):
+        from langchain_core.tools import StructuredTool
+        
+        tool_name = original_tool.name
+        
+        async def call_via_pool(**kwargs):
+            return await self.call_tool(server_name, tool_name, kwargs)
+        
+        return StructuredTool(
+            name=original_tool.name,
+            description=original_tool.description,
+            coroutine=call_via_pool,
+            args_schema=original_tool.args_schema,
+            response_format=getattr(original_tool, "response_format", "content"),
+        )
+    
+    def start_health_checks(self):
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_loop())
+    
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(config.MCP_HEALTH_CHECK_INTERVAL)
+            for name, entry in list(self._servers.items()):
+                if await entry.ping(config.MCP_HEALTH_CHECK_TIMEOUT):
+                    continue
+                print(f"⚠️  MCP server '{name}' failed health check ({entry.last_error}), reconnecting...")
+                try:
+                    await self.ensure_connected(name, self._connections[name])
+                except Exception as e:
+                    print(f"⚠️  Reconnect of MCP server '{name}' failed: {e}")
+    
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for name in list(self._servers):
+            await self.disconnect(name)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "connected": entry.alive,
+                "tools": len(self._proxy_tools.get(name, [])),
+                "connected_at": datetime.fromtimestamp(entry.connected_at).isoformat() if entry.connected_at else None,
+                "reconnects": self._reconnects.get(name, 0),
+                "last_error": entry.last_error,
+            }
+            for name, entry in self._servers.items()
+        }
 
 # ============================================================================
-# CUSTOM TOOLS LOADER
+# MCP TOOL REGISTRY
 # ============================================================================
 
-class CustomToolsLoader:
-    """Load custom tools from Python files"""
+class MCPToolRegistry:
+    """Tracks which MCP servers are applied and reconciles changes incrementally.
     
-    @staticmethod
-    def load_tools_from_directory(directory: str) -> List[Any]:
-        """Load custom tools from Python files in a directory."""
-        tools = []
-        
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-            example_tool = '''"""Example custom tool"""
-from langchain_core.tools import tool
-
-@tool
-def example_calculator(a: float, b: float, operation: str = "add") -> float:
-    """Perform basic arithmetic operations.
+    `apply()` diffs the enabled servers from MCPConfigManager against the
+    last applied state and only connects, reconnects or disconnects the
+    servers that actually changed. Unchanged servers keep their sessions.
+    """
     
-    Args:
-        a: First number
-        b: Second number
-        operation: Operation to perform (add, subtract, multiply, divide)
+    def __init__(self, session_pool: MCPSessionPool):
+        self.session_pool = session_pool
+        self._applied: Dict[str, Dict[str, Any]] = {}
+        self.version = 0
     
-    Returns:
-        Result of the operation
-    """
-    if operation == "add":
-        return a + b
-    elif operation == "subtract":
-        return a - b
-    elif operation == "multiply":
-        return a * b
-    elif operation == "divide":
-        if b == 0:
-            return "Error: Division by zero"
-        return a / b
-    else:
-        return "Error: Unknown operation"
-'''
-            with open(os.path.join(directory, "example_tools.py"), "w") as f:
-                f.write(example_tool)
+    async def apply(self, enabled_servers: Dict[str, Any]) -> Dict[str, List[str]]:
+        """Reconcile the session pool with `enabled_servers` and return the diff."""
+        added = [name for name in enabled_servers if name not in self._applied]
+        removed = [name for name in self._applied if name not in enabled_servers]
+        changed = [
+            name for name in enabled_servers
+            if name in self._applied and self._applied[name] != enabled_servers[name]
+        ]
         
-        import sys
-        import importlib.util
+        for name in removed:
+            await self.session_pool.disconnect(name)
+            self._applied.pop(name, None)
         
-        for filename in os.listdir(directory):
-            if filename.endswith(".py") and not filename.startswith("__"):
-                filepath = os.path.join(directory, filename)
-                try:
-                    spec = importlib.util.spec_from_file_location(filename[:-3], filepath)
-                    module = importlib.util.module_from_spec(spec)
-                    sys.modules[filename[:-3]] = module
-                    spec.loader.exec_module(module)
-                    
-                    for attr_name in dir(module):
-                        attr = getattr(module, attr_name)
-                        if hasattr(attr, "name") and hasattr(attr, "description"):
-                            tools.append(attr)
-                            print(f"Loaded custom tool: {attr.name}")
-                except Exception as e:
-                    print(f"Error loading tools from {filename}: {e}")
+        to_connect = added + changed
+        results = await asyncio.gather(
+            *(self.session_pool.ensure_connected(name, enabled_servers[name]) for name in to_connect),
+            return_exceptions=True,
+        )
+        for name, result in zip(to_connect, results):
+            # Record the server even if it is down so the lazy reconnect path can retry it
+            self._applied[name] = enabled_servers[name]
+            if isinstance(result, Exception):
+                print(f"⚠️  MCP server '{name}' unavailable: {result}")
         
-        return tools
+        diff = {"added": added, "removed": removed, "changed": changed}
+        if added or removed or changed:
+            self.version += 1
+            print(f"✓ MCP registry v{self.version}: {diff}")
+        return diff
+    
+    def get_tools(self) -> List[Any]:
+        return self.session_pool.get_tools(list(self._applied))
 
 # ============================================================================
-# MCP CONFIGURATION MANAGER
+# AGENT POOL
 # ============================================================================
 
-class MCPConfigManager:
-    """Manage MCP server configurations"""
+class AgentPool:
+    """LRU pool of compiled agents keyed by their build configuration.
     
-    def __init__(self, config_file: str):
-        self.config_file = config_file
-        self.config = self._load_config()
+    Each distinct (instructions, model, headless, enable_research) combination
+    is built once and reused until evicted. Builds for the same key are
+    serialized so concurrent requests share a single build; different keys
+    build independently and never replace each other's agent.
+    """
     
-    def _load_config(self) -> Dict[str, Any]:
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r') as f:
-                return json.load(f)
-        else:
-            default_config = {
-                "mcp_servers": {
-                    "example_filesystem": {
-                        "command": "npx",
-                        "args": ["-y", "@modelcontextprotocol/server-filesystem", "./workspace"],
-                        "transport": "stdio",
-                        "enabled": False
-                    }
-                }
+    def __init__(self, builder, max_size: int):
+        self._builder = builder
+        self.max_size = max(1, max_size)
+        self._agents: "OrderedDict[str, Any]" = OrderedDict()
+        self._build_kwargs: Dict[str, Dict[str, Any]] = {}
+        self._build_locks: Dict[str, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(instructions: Optional[str], model: Optional[str],
+                 headless: bool, enable_research: bool) -> str:
+        """Stable hash of an agent build configuration."""
+        payload = json.dumps(
+            [instructions, model or config.MODEL, bool(headless), bool(enable_research)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    async def get(self,
+                  instructions: Optional[str] = None,
+                  model: Optional[str] = None,
+                  headless: bool = True,
+                  enable_research: bool = True):
+        """Return a compiled agent for this configuration, building it on a miss."""
+        key = self.make_key(instructions, model, headless, enable_research)
+        
+        agent = self._agents.get(key)
+        if agent is not None:
+            self._agents.move_to_end(key)
+            self.hits += 1
+            return agent
+        
+        lock = self._build_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Another request may have finished the build while we waited
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._agents.move_to_end(key)
+                self.hits += 1
+                return agent
+            
+            self.misses += 1
+            print(f"  🏗️  Agent pool miss ({key[:12]}), building agent...")
+            build_kwargs = {
+                "instructions": instructions,
+                "enable_research": enable_research,
+                "model": model,
+                "headless": headless,
             }
-            self.save_config(default_config)
-            return default_config
+            agent = await self._builder(**build_kwargs)
+            self._agents[key] = agent
+            self._build_kwargs[key] = build_kwargs
+            self._agents.move_to_end(key)
+            
+            while len(self._agents) > self.max_size:
+                evicted_key, _ = self._agents.popitem(last=False)
+                self._build_kwargs.pop(evicted_key, None)
+                self._build_locks.pop(evicted_key, None)
+                self.evictions += 1
+                print(f"  ♻️  Agent pool evicted {evicted_key[:12]}")
+        
+        return agent
     
-    def save_config(self, config: Dict[str, Any]):
-        with open(self.config_file, 'w') as f:
-            json.dump(config, f, indent=2)
-        self.config = config
+    async def prewarm(self, models: List[str]):
+        """Build default-instruction agents for popular models ahead of traffic."""
+        for model in models:
+            for enable_research in (True, False):
+                try:
+                    await self.get(model=model, enable_research=enable_research)
+                except Exception as e:
+                    print(f"⚠️  Failed to pre-warm agent for {model}: {e}")
+        if models:
+            print(f"✓ Agent pool pre-warmed: {models}")
     
-    def get_enabled_servers(self) -> Dict[str, Any]:
-        mcp_servers = self.config.get("mcp_servers", {})
-        enabled_servers = {}
-        for name, cfg in mcp_servers.items():
-            if cfg.get("enabled", False):
-                server_config = {k: v for k, v in cfg.items() if k != "enabled"}
-                enabled_servers[name] = server_config
-        return enabled_servers
+    async def rebuild_all(self):
+        """Rebuild every pooled agent against the current tool set.
+        
+        Old agents keep serving requests until their replacement is ready,
+        then they are swapped in place without touching LRU order.
+        """
+        for key, build_kwargs in list(self._build_kwargs.items()):
+            lock = self._build_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                if key not in self._agents:
+                    continue  # evicted meanwhile
+                try:
+                    self._agents[key] = await self._builder(**build_kwargs)
+                except Exception as e:
+                    print(f"⚠️  Failed to rebuild pooled agent {key[:12]}: {e}")
+    
+    def clear(self):
+        """Drop every pooled agent (e.g. after the tool set changes)."""
+        self._agents.clear()
+        self._build_kwargs.clear()
+        self._build_locks.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._agents),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
 
 # ============================================================================
 # AGENT MANAGER
@@ -456,19 +3590,49 @@ class AgentManager:
         self.mcp_config_manager = MCPConfigManager(config.MCP_CONFIG_FILE)
         self.custom_tools_loader = CustomToolsLoader()
         self.agent = None
-        self.mcp_client = None
+        self.mcp_session_pool = MCPSessionPool()
+        self.mcp_tool_registry = MCPToolRegistry(self.mcp_session_pool)
+        self.agent_pool = AgentPool(self.build_agent, config.AGENT_POOL_SIZE)
+        self._default_build_kwargs: Dict[str, Any] = {}
+        self._rebind_lock = asyncio.Lock()
+        self._rebind_task: Optional[asyncio.Task] = None
+        self._initial_build: Optional[asyncio.Task] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        self.warmup_state = "pending"
+        self.warmup_error: Optional[str] = None
+        self.warmup_seconds: Optional[float] = None
     
     async def initialize_agent(self, 
                               instructions: Optional[str] = None,
                               enable_research: bool = True,
                               model: Optional[str] = None,
                               headless: bool = True):
-        """Initialize the DeepAgent with all tools and context management"""
+        """Initialize the default DeepAgent used by endpoints without per-request config"""
+        self._default_build_kwargs = {
+            "instructions": instructions,
+            "enable_research": enable_research,
+            "model": model,
+            "headless": headless,
+        }
+        self.agent = await self.build_agent(**self._default_build_kwargs)
+        return self.agent
+    
+    async def build_agent(self,
+                          instructions: Optional[str] = None,
+                          enable_research: bool = True,
+                          model: Optional[str] = None,
+                          headless: bool = True):
+        """Build a DeepAgent with all tools and context management"""
+        build_started = time.perf_counter()
+        create_deep_agent, duckduckgo_search = await asyncio.to_thread(_import_agent_dependencies)
         
-        # Built-in tools
+        # Built-in tools (search goes through the record/replay cassette when active)
+        web_search = cassette.wrap_tool("search", duckduckgo_search)
         tools = [
-            duckduckgo_search,
-            get_current_time
+            web_search,
+            get_current_time,
+            query_tool_response,
+            search_tool_response
         ]
         
         # Load custom tools
@@ -480,16 +3644,17 @@ class AgentManager:
             if t.name in ['browser_research', 'browser_research_multiple', 'browser_interactive_research']:
                 original_func = t.coroutine if hasattr(t, 'coroutine') else t.func
                 
-                def create_wrapped_browser_tool(original, headless_val):
+                def create_wrapped_browser_tool(original, headless_val, tool_name):
                     async def wrapped_func(*args, **kwargs):
                         kwargs['headless'] = headless_val
-                        if asyncio.iscoroutinefunction(original):
-                            return await original(*args, **kwargs)
-                        else:
-                            return original(*args, **kwargs)
+                        with trace_span(f"browser.{tool_name}", "tool"):
+                            if asyncio.iscoroutinefunction(original):
+                                return await original(*args, **kwargs)
+                            else:
+                                return original(*args, **kwargs)
                     return wrapped_func
                 
-                wrapped_func = create_wrapped_browser_tool(original_func, headless)
+                wrapped_func = create_wrapped_browser_tool(original_func, headless, t.name)
                 
                 from langchain_core.tools import StructuredTool
                 wrapped_tool = StructuredTool(
@@ -509,24 +3674,23 @@ class AgentManager:
         enabled_mcp_servers = self.mcp_config_manager.get_enabled_servers()
         print(f"Enabled MCP servers: {list(enabled_mcp_servers.keys())}")
         
-        if enabled_mcp_servers:
+        # Cassette replay serves recorded MCP tools without spawning any servers
+        replay_tools = cassette.replay_tools()
+        
+        if enabled_mcp_servers or replay_tools:
             try:
-                from langchain_mcp_adapters.client import MultiServerMCPClient
                 from langchain_core.tools import StructuredTool
-                import sys
-                import io
-                
-                print("Creating MCP client...")
-                
-                old_stderr = sys.stderr
-                sys.stderr = io.StringIO()
                 
-                try:
-                    self.mcp_client = MultiServerMCPClient(enabled_mcp_servers)
-                    print("Getting MCP tools...")
-                    mcp_tools = await self.mcp_client.get_tools()
-                finally:
-                    sys.stderr = old_stderr
+                if replay_tools:
+                    mcp_tools = replay_tools
+                    print(f"📼 Replaying {len(mcp_tools)} MCP tools from cassette")
+                else:
+                    import langchain_mcp_adapters  # noqa: F401 - fail fast if not installed
+                    
+                    # Sessions are persistent; this only connects servers that changed
+                    await self.mcp_tool_registry.apply(enabled_mcp_servers)
+                    mcp_tools = self.mcp_tool_registry.get_tools()
+                    await cassette.record_tools(mcp_tools)
                 
                 def wrap_mcp_tool(original_tool):
                     """Wrap MCP tool with ChatGPT-based summarization for large responses.
@@ -539,18 +3703,33 @@ class AgentManager:
                     original_func = original_tool.coroutine if hasattr(original_tool, 'coroutine') else original_tool.func
                     
                     async def wrapped_func(*args, **kwargs):
-                        # Call original tool
-                        if asyncio.iscoroutinefunction(original_func):
-                            result = await original_func(*args, **kwargs)
-                        else:
-                            result = original_func(*args, **kwargs)
+                        async def call_original():
+                            if asyncio.iscoroutinefunction(original_func):
+                                result = await original_func(*args, **kwargs)
+                            else:
+                                result = original_func(*args, **kwargs)
+                            
+                            if asyncio.iscoroutine(result):
+                                result = await result
+                            
+                            # Handle tuple results from MCP tools
+                            if isinstance(result, tuple):
+                                result = result[0] if len(result) > 0 else result
+                            return result
                         
-                        if asyncio.iscoroutine(result):
-                            result = await result
+                        async def timed_call():
+                            call_started = time.perf_counter()
+                            try:
+                                return await cassette.call("mcp", original_tool.name, kwargs, call_original)
+                            except Exception:
+                                TOOL_ERRORS_TOTAL.inc(tool=original_tool.name)
+                                raise
+                            finally:
+                                TOOL_CALL_SECONDS.observe(time.perf_counter() - call_started, tool=original_tool.name)
                         
-                        # Handle tuple results from MCP tools
-                        if isinstance(result, tuple):
-                            result = result[0] if len(result) > 0 else result
+                        # Call original tool (cached / coalesced for read-only tools)
+                        with trace_span(f"mcp.{original_tool.name}", "tool"):
+                            result = await tool_result_cache.call(original_tool.name, kwargs, timed_call)
                         
                         # Try to parse JSON strings
                         if isinstance(result, str):
@@ -561,11 +3740,10 @@ class AgentManager:
                         
                         # Convert to string for size check
                         result_str = json.dumps(result, default=str) if isinstance(result, (dict, list)) else str(result)
+                        TOOL_RESPONSE_CHARS.observe(len(result_str), tool=original_tool.name)
                         
                         SUMMARIZE_THRESHOLD = config.TOOL_RESPONSE_SUMMARIZE_THRESHOLD
-                        MAX_RESPONSE_SIZE = config.MCP_MAX_RESPONSE_SIZE
                         MAX_STRING_LENGTH = config.MCP_MAX_STRING_LENGTH
-                        MAX_LIST_ITEMS = config.MCP_MAX_LIST_ITEMS
                         
                         # =====================================================
                         # SMALL RESPONSE: Return as-is
@@ -576,79 +3754,69 @@ class AgentManager:
                         # =====================================================
                         # LARGE RESPONSE: Save to disk first (always)
                         # =====================================================
-                        os.makedirs("mcp_output", exist_ok=True)
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"mcp_output/{original_tool.name}_{timestamp}.json"
+                        ref_id = await spill_store.put(original_tool.name, result)
                         
-                        with open(filename, 'w') as f:
-                            try:
-                                if isinstance(result, (dict, list)):
-                                    json.dump(result, f, indent=2, default=str)
-                                else:
-                                    f.write(result_str)
-                            except:
-                                f.write(result_str)
+                        print(f"  💾 Saved full response as {ref_id} ({len(result_str):,} chars)")
                         
-                        print(f"  💾 Saved full response to {filename} ({len(result_str):,} chars)")
+                        # =====================================================
+                        # COMPACTION: Strip noise + tabulate records (no LLM)
+                        # =====================================================
+                        compactor = context_manager.compactor
+                        structured = compactor.prepare(result)
+                        
+                        # Upper bound on what map-reduce summarization will cover
+                        summary_budget = config.SUMMARIZER_INPUT_LIMIT * config.SUMMARIZER_MAX_CHUNKS
+                        
+                        if structured is not None:
+                            compacted = compactor.render(structured)
+                            if len(compacted) <= SUMMARIZE_THRESHOLD:
+                                print(f"  🗜️  Compacted {original_tool.name} response: {len(result_str):,} → {len(compacted):,} chars (no summarization)")
+                                return compacted + f"\n\n[Compacted from {len(result_str):,} chars. Full data ref: {ref_id}; use query_tool_response for exact records]"
+                            
+                            # Still too large: summarize the compacted form (map-reduce beyond one input)
+                            summarizer_input = compactor.render(structured, budget=summary_budget)
+                            print(f"  🗜️  Compacted {original_tool.name} response for summarizer: {len(result_str):,} → {len(summarizer_input):,} chars")
+                        else:
+                            summarizer_input = context_manager._truncate_with_context(result_str, summary_budget)
                         
                         # =====================================================
-                        # MEDIUM RESPONSE (50K-500K): Summarize via ChatGPT
+                        # RETRIEVE: Index chunks per chat instead of summarizing
                         # =====================================================
-                        if len(result_str) <= MAX_RESPONSE_SIZE:
+                        if config.LARGE_RESPONSE_STRATEGY == "retrieve":
                             try:
-                                summarized = await context_manager.summarize_tool_response(
-                                    original_tool.name, result_str
+                                chunks = await asyncio.to_thread(
+                                    context_manager._split_for_summary, result_str, config.VECTOR_INDEX_CHUNK_CHARS
                                 )
-                                return summarized
+                                indexed = await vector_index.add(current_chat_id.get(), ref_id, original_tool.name, chunks)
+                                print(f"  🧭 Indexed {original_tool.name} response as {indexed}/{len(chunks)} chunks (no summarization)")
+                                overview = summarizer_input[:SUMMARIZE_THRESHOLD // 4]
+                                if indexed < len(chunks):
+                                    coverage = (
+                                        f"only the first {indexed} of {len(chunks)} chunks were indexed, so "
+                                        f"search_tool_response does NOT cover the rest. Full data ref: {ref_id}; "
+                                        f"use query_tool_response (offset/where) for records beyond the indexed part"
+                                    )
+                                else:
+                                    coverage = (
+                                        f"indexed as {indexed} chunks. Full data ref: {ref_id}; use "
+                                        f"search_tool_response for relevant parts or query_tool_response for exact records"
+                                    )
+                                return overview + f"\n\n[Large response ({len(result_str):,} chars) {coverage}]"
                             except Exception as e:
-                                print(f"  ⚠️  Summarization failed, falling back to truncation: {e}")
-                                # Fall through to truncation
+                                print(f"  ⚠️  Indexing failed, falling back to summarization: {e}")
                         
                         # =====================================================
-                        # VERY LARGE RESPONSE (>500K): Truncate then summarize
+                        # SUMMARIZE: Single call, or map-reduce when very large
                         # =====================================================
-                        # First do structural truncation to get it under 500K
-                        if isinstance(result, dict):
-                            truncated_result = {}
-                            for key, value in result.items():
-                                if isinstance(value, str) and len(value) > MAX_STRING_LENGTH:
-                                    truncated_result[key] = value[:MAX_STRING_LENGTH] + "...[truncated]"
-                                elif isinstance(value, list) and len(value) > MAX_LIST_ITEMS:
-                                    truncated_result[key] = value[:MAX_LIST_ITEMS]
-                                    truncated_result[key].append(f"... and {len(value) - MAX_LIST_ITEMS} more items")
-                                else:
-                                    truncated_result[key] = value
-                            truncated_str = json.dumps(truncated_result, default=str)
-                            
-                        elif isinstance(result, list):
-                            truncated_list = []
-                            for item in result[:MAX_LIST_ITEMS]:
-                                if isinstance(item, dict):
-                                    truncated_item = {}
-                                    for key, value in item.items():
-                                        if isinstance(value, str) and len(value) > MAX_STRING_LENGTH:
-                                            truncated_item[key] = value[:MAX_STRING_LENGTH] + "...[truncated]"
-                                        else:
-                                            truncated_item[key] = value
-                                    truncated_list.append(truncated_item)
-                                else:
-                                    truncated_list.append(item)
-                            
-                            if len(result) > MAX_LIST_ITEMS:
-                                truncated_list.append(f"... and {len(result) - MAX_LIST_ITEMS} more items")
-                            truncated_str = json.dumps(truncated_list, default=str)
-                        else:
-                            truncated_str = result_str[:MAX_STRING_LENGTH]
-                        
-                        # Now summarize the truncated version
                         try:
                             summarized = await context_manager.summarize_tool_response(
-                                original_tool.name, truncated_str
+                                original_tool.name, summarizer_input
                             )
-                            return summarized
+                            return summarized + f"\n[Full data ref: {ref_id}; use query_tool_response for exact records]"
                         except Exception as e:
-                            print(f"  ⚠️  Summarization failed on truncated data: {e}")
-                            return truncated_str[:MAX_STRING_LENGTH] + f"\n\n[Response truncated. Full data: {filename}]"
+                            print(f"  ⚠️  Summarization failed, falling back to truncation: {e}")
+                            TRUNCATION_FALLBACKS_TOTAL.inc(reason="wrapper_error")
+                            return summarizer_input[:MAX_STRING_LENGTH] + f"\n\n[Response truncated. Full data ref: {ref_id}; use query_tool_response for exact records]"
                     
                     return StructuredTool(
                         name=original_tool.name,
@@ -687,7 +3855,7 @@ Your job is to conduct thorough research based on the assigned topic.
 Use duckduckgo_search to find relevant information.
 Save your findings to files for reference.
 Only your FINAL answer will be passed back to the main agent.""",
-                "tools": [duckduckgo_search]
+                "tools": [web_search]
             }
             
             critique_sub_agent = {
@@ -761,26 +3929,117 @@ REMEMBER: Users want insights, not data dumps. Be conversational and helpful!"""
         print(f"Browser mode: {'headless' if headless else 'visible'}")
         print(f"Context management: ChatGPT ({config.SUMMARIZER_MODEL})")
         
-        self.agent = create_deep_agent(
+        agent = create_deep_agent(
             tools=tools,
             system_prompt=instructions,
             subagents=subagents,
-            model=selected_model,
+            model=resolve_chat_model(selected_model),
             debug=False
         )
         
         print(f"✓ Agent initialized with {len(tools)} tools and {len(subagents)} subagents")
-        return self.agent
+        AGENT_BUILD_SECONDS.observe(time.perf_counter() - build_started, model=selected_model)
+        return agent
+    
+    def start_warmup(self):
+        """Build the default agent and pre-warm the pool in a background task.
+        
+        The process accepts traffic immediately; /api/health/ready reports
+        when the default agent (tools and MCP sessions) is built.
+        """
+        self.warmup_state = "running"
+        self._initial_build = asyncio.create_task(self.initialize_agent())
+        self._warmup_task = asyncio.create_task(self._warmup())
+    
+    async def _warmup(self):
+        started = time.perf_counter()
+        # Optional subsystems load in worker threads while the agent builds
+        optional = asyncio.gather(
+            event_sink.start(),
+            asyncio.to_thread(get_sheets_auth),
+            asyncio.to_thread(
+                context_manager.token_counter.load_encodings,
+                [config.MODEL, config.SUMMARIZER_MODEL, *config.AGENT_POOL_PREWARM_MODELS],
+            ),
+        )
+        try:
+            await asyncio.shield(self._initial_build)
+        except Exception as e:
+            self.warmup_state = "failed"
+            self.warmup_error = str(e)
+            print(f"⚠️  Agent warm-up failed: {e}")
+            await optional
+            return
+        self.warmup_state = "ready"
+        self.warmup_seconds = round(time.perf_counter() - started, 2)
+        print(f"✓ Default agent ready after {self.warmup_seconds}s")
+        await optional
+        await self.agent_pool.prewarm(config.AGENT_POOL_PREWARM_MODELS)
+    
+    async def wait_ready(self):
+        """Wait for the background warm-up's default agent build (no-op once it finished)."""
+        if self._initial_build is not None and not self._initial_build.done():
+            with contextlib.suppress(Exception):
+                await asyncio.shield(self._initial_build)
+    
+    @property
+    def ready(self) -> bool:
+        return self.warmup_state == "ready" or self.agent is not None
+    
+    def warmup_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.warmup_state,
+            "seconds": self.warmup_seconds,
+            "error": self.warmup_error,
+        }
     
     async def get_agent(self):
+        # Requests that arrive during warm-up share its build instead of starting another
+        await self.wait_ready()
         if self.agent is None:
             await self.initialize_agent()
         return self.agent
     
+    async def get_pooled_agent(self,
+                               instructions: Optional[str] = None,
+                               model: Optional[str] = None,
+                               headless: bool = True,
+                               enable_research: bool = True):
+        """Get a compiled agent for a per-request configuration from the LRU pool."""
+        # Let the warm-up connect MCP servers first so builds don't race on the registry
+        await self.wait_ready()
+        return await self.agent_pool.get(
+            instructions=instructions,
+            model=model,
+            headless=headless,
+            enable_research=enable_research,
+        )
+    
+    async def refresh_mcp_tools(self) -> Dict[str, List[str]]:
+        """Apply MCP config changes incrementally and rebind agents in the background.
+        
+        Only the servers that changed are (dis)connected here; the default and
+        pooled agents are rebuilt off the request path and swapped in when ready.
+        """
+        diff = await self.mcp_tool_registry.apply(self.mcp_config_manager.get_enabled_servers())
+        if any(diff.values()):
+            self._rebind_task = asyncio.create_task(self._rebind_agents())
+        return diff
+    
+    async def _rebind_agents(self):
+        async with self._rebind_lock:
+            if self.agent is not None:
+                try:
+                    self.agent = await self.build_agent(**self._default_build_kwargs)
+                except Exception as e:
+                    print(f"⚠️  Failed to rebuild default agent: {e}")
+            await self.agent_pool.rebuild_all()
+            print(f"✓ Agents rebound to MCP registry v{self.mcp_tool_registry.version}")
+    
     async def reinitialize_agent(self, instructions: Optional[str] = None, model: Optional[str] = None, headless: bool = True):
         self.agent = None
-        if self.mcp_client:
-            self.mcp_client = None
+        # Pooled agents were built against the old tool set
+        self.agent_pool.clear()
         return await self.initialize_agent(instructions, model=model, headless=headless)
 
 # ============================================================================
@@ -832,6 +4091,35 @@ class StructuredChatRequest(BaseModel):
     enable_research: bool = False
     headless: bool = True
     google_sheets: Optional[List[GoogleSheetConfig]] = None
+    chat_id: Optional[str] = None  # Keys the rolling conversation summary
+    use_tools: bool = True  # False: the call needs no tools (eligible for the direct fast path)
+    mode: Literal["auto", "direct", "agent"] = "auto"  # auto: direct when no tools are requested
+    cache: bool = False  # Opt in to the structured response cache
+    cache_ttl_seconds: Optional[int] = None  # How long to keep this response (default STRUCTURED_CACHE_TTL_SECONDS)
+    cache_max_age_seconds: Optional[int] = None  # Only accept cached responses younger than this
+    cache_bypass: bool = False  # Skip the lookup and refresh the cached response
+
+class StructuredBatchItem(BaseModel):
+    id: Optional[str] = None  # Echoed back to match results to inputs (e.g. a CSV row id)
+    messages: List[ChatMessage]
+    chat_id: Optional[str] = None
+
+class StructuredBatchRequest(BaseModel):
+    items: List[StructuredBatchItem]
+    structured_output_format: Dict[str, Any]
+    system_prompt: Optional[str] = None
+    model: Optional[str] = None
+    enable_research: bool = False
+    headless: bool = True
+    google_sheets: Optional[List[GoogleSheetConfig]] = None
+    use_tools: bool = True
+    mode: Literal["auto", "direct", "agent"] = "auto"
+    cache: bool = False
+    cache_ttl_seconds: Optional[int] = None
+    cache_max_age_seconds: Optional[int] = None
+    cache_bypass: bool = False
+    concurrency: Optional[int] = None  # Defaults to STRUCTURED_BATCH_CONCURRENCY
+    item_timeout_seconds: Optional[float] = None  # Defaults to STRUCTURED_BATCH_ITEM_TIMEOUT
 
 class ConfigRequest(BaseModel):
     instructions: Optional[str] = None
@@ -848,31 +4136,462 @@ class MCPServerConfig(BaseModel):
 # API ENDPOINTS
 # ============================================================================
 
-# Add imports
-try:
-    from supabase import create_client, Client
-except ImportError:
-    print("Warning: supabase package not found. Install with: pip install supabase")
-    Client = None
+# Supabase client, created on first use (the SDK is slow to import)
+_supabase = None
+_supabase_loaded = False
+_supabase_lock = threading.Lock()
 
-# ... (Config updates) ...
+def get_supabase():
+    """Supabase client, or None when not configured or not installed."""
+    global _supabase, _supabase_loaded
+    with _supabase_lock:
+        if not _supabase_loaded:
+            _supabase_loaded = True
+            if config.SUPABASE_URL and config.SUPABASE_SERVICE_KEY:
+                try:
+                    from supabase import create_client
+                    _supabase = create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY)
+                    print(f"✓ Supabase client initialized: {config.SUPABASE_URL}")
+                except ImportError:
+                    print("Warning: supabase package not found. Install with: pip install supabase")
+                except Exception as e:
+                    print(f"⚠️  Failed to initialize Supabase: {e}")
+        return _supabase
 
-class Config:
-    """Server configuration"""
-    HOST = os.getenv("HOST", "0.0.0.0")
-    PORT = int(os.getenv("PORT", "8000"))
-    # ... (existing config) ...
-    SUPABASE_URL = os.getenv("SUPABASE_URL", "") or os.getenv("NEXT_PUBLIC_SUPABASE_URL", "")
-    SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "") or os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+# ============================================================================
+# SUPABASE EVENT SINK
+# ============================================================================
 
-# ... (Initialize client) ...
-supabase: Optional[Client] = None
-if config.SUPABASE_URL and config.SUPABASE_SERVICE_KEY and Client:
-    try:
-        supabase = create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY)
-        print(f"✓ Supabase client initialized: {config.SUPABASE_URL}")
-    except Exception as e:
-        print(f"⚠️  Failed to initialize Supabase: {e}")
+class SupabaseEventSink:
+    """Non-blocking, batched writer for chat events.
+    
+    Producers enqueue rows and return immediately; a single background task
+    coalesces queued rows into bulk inserts every DB_EVENT_FLUSH_INTERVAL
+    seconds (or once DB_EVENT_BATCH_SIZE rows are waiting) and runs the
+    synchronous Supabase client in a worker thread so the event loop never
+    blocks on an HTTP round trip. Rows are stamped with `created_at` at
+    enqueue time so ordering survives batching.
+    
+    emit() returns a future for the row; a request that must know its rows
+    are saved awaits wait() on its own futures instead of flush(), which
+    waits for every other request's pending rows too.
+    
+    The client is resolved once, in a worker thread, by start() (called
+    during warm-up) or by the background task before its first insert.
+    """
+    
+    def __init__(self, client_factory):
+        self._client_factory = client_factory
+        self._client = None
+        self._resolved = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.inserted = 0
+        self.failed = 0
+    
+    async def start(self):
+        """Resolve the Supabase client off the event loop (no-op once resolved)."""
+        if not self._resolved:
+            self._client = await asyncio.to_thread(self._client_factory)
+            self._resolved = True
+    
+    @property
+    def enabled(self) -> bool:
+        if self._resolved:
+            return self._client is not None
+        # Configured but still resolving: queue rows, the writer waits for the client
+        return bool(config.SUPABASE_URL and config.SUPABASE_SERVICE_KEY)
+    
+    def _ensure_worker(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=config.DB_EVENT_QUEUE_SIZE)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+    
+    async def emit(self, table: str, row: Dict[str, Any]) -> Optional[asyncio.Future]:
+        """Queue a row for insertion. Waits only if the queue is full.
+        
+        Returns a future that resolves to True once the row is written (False
+        if it was dropped), or None when the sink is disabled.
+        """
+        if not self.enabled:
+            return None
+        self._ensure_worker()
+        row = dict(row)
+        row.setdefault("created_at", datetime.utcnow().isoformat())
+        written = asyncio.get_running_loop().create_future()
+        with trace_span("db.emit", "db", table=table):
+            await self._queue.put((table, row, written))
+        return written
+    
+    async def wait(self, *written: Optional[asyncio.Future]) -> bool:
+        """Wait for just these rows (futures from emit()); True if all were written."""
+        pending = [future for future in written if future is not None]
+        if not pending:
+            return True
+        with trace_span("db.wait", "db", rows=len(pending)):
+            results = await asyncio.gather(*(asyncio.shield(future) for future in pending))
+        return all(results)
+    
+    async def flush(self):
+        """Wait until every queued row has been written (or given up on)."""
+        if self._queue is not None:
+            with trace_span("db.flush", "db", pending=self._queue.qsize()):
+                await self._queue.join()
+    
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + config.DB_EVENT_FLUSH_INTERVAL
+            while len(batch) < config.DB_EVENT_BATCH_SIZE:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                await self.start()
+                # Bulk insert per table and column set, preserving enqueue order; PostgREST
+                # needs uniform columns, and padding with NULLs would override column defaults
+                groups: Dict[tuple, List[tuple]] = {}
+                for table, row, written in batch:
+                    groups.setdefault((table, tuple(sorted(row))), []).append((row, written))
+                for (table, _), items in groups.items():
+                    ok = await self._insert_with_retry(table, [row for row, _ in items])
+                    for _, written in items:
+                        if not written.done():
+                            written.set_result(ok)
+            finally:
+                for _, _, written in batch:
+                    if not written.done():
+                        written.set_result(False)
+                    self._queue.task_done()
+    
+    async def _insert_with_retry(self, table: str, rows: List[Dict[str, Any]]) -> bool:
+        if self._client is None:
+            return False  # Client failed to initialize; enabled is now False
+        for attempt in range(config.DB_EVENT_MAX_RETRIES):
+            try:
+                await asyncio.to_thread(lambda: self._client.table(table).insert(rows).execute())
+                self.inserted += len(rows)
+                return True
+            except Exception as e:
+                if attempt == config.DB_EVENT_MAX_RETRIES - 1:
+                    self.failed += len(rows)
+                    print(f"  ⚠️ DB Error: dropped {len(rows)} {table} rows after {attempt + 1} attempts: {e}")
+                    return False
+                await asyncio.sleep(0.5 * (2 ** attempt))
+        return False
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "inserted": self.inserted,
+            "failed": self.failed,
+        }
+
+event_sink = SupabaseEventSink(get_supabase)
+DB_EVENT_QUEUE_DEPTH.set_function(lambda: event_sink.stats()["queued"])
+
+# ============================================================================
+# ASYNC CHAT JOB QUEUE
+# ============================================================================
+
+class JobQueueFull(Exception):
+    """Raised when the async job queue has reached JOB_QUEUE_MAX_PENDING."""
+
+
+class JobStore:
+    """SQLite-backed persistence for async chat jobs.
+    
+    All queries run in a worker thread so disk I/O never blocks the event loop.
+    """
+    
+    ACTIVE_STATUSES = ("queued", "running")
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                chat_id TEXT,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_chat_status ON jobs (chat_id, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+            # Worker that claimed the job (older databases predate the column)
+            if "owner" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            conn = self._connect()
+            cur = conn.execute(sql, params)
+            rows = [dict(row) for row in cur.fetchall()]
+            conn.commit()
+            return rows
+    
+    async def _run(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._query, sql, params)
+    
+    def _modify(self, sql: str, params: tuple = ()) -> int:
+        with self._lock:
+            conn = self._connect()
+            cur = conn.execute(sql, params)
+            conn.commit()
+            return cur.rowcount
+    
+    async def create(self, chat_id: Optional[str], payload: str) -> Optional[Dict[str, Any]]:
+        """Insert a queued job; None if the chat already has an active job (checked atomically)."""
+        job_id = uuid.uuid4().hex
+        inserted = await asyncio.to_thread(
+            self._modify,
+            "INSERT INTO jobs (id, chat_id, status, payload, created_at) SELECT ?, ?, 'queued', ?, ? "
+            "WHERE ? IS NULL OR NOT EXISTS "
+            "(SELECT 1 FROM jobs WHERE chat_id = ? AND status IN ('queued', 'running'))",
+            (job_id, chat_id, payload, datetime.utcnow().isoformat(), chat_id, chat_id),
+        )
+        return await self.get(job_id) if inserted else None
+    
+    async def claim(self, job_id: str, owner: str) -> bool:
+        """Move a queued job to running for `owner`; False if another worker claimed it first."""
+        claimed = await asyncio.to_thread(
+            self._modify,
+            "UPDATE jobs SET status = 'running', started_at = ?, owner = ? WHERE id = ? AND status = 'queued'",
+            (datetime.utcnow().isoformat(), owner, job_id),
+        )
+        return claimed > 0
+    
+    async def get(self, job_id: str, include_payload: bool = False) -> Optional[Dict[str, Any]]:
+        rows = await self._run("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = rows[0]
+        if not include_payload:
+            job.pop("payload", None)
+        return job
+    
+    async def find_active(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._run(
+            "SELECT id, chat_id, status, error, created_at, started_at, finished_at FROM jobs "
+            "WHERE chat_id = ? AND status IN ('queued', 'running') ORDER BY created_at DESC LIMIT 1",
+            (chat_id,),
+        )
+        return rows[0] if rows else None
+    
+    async def update_status(self, job_id: str, status: str, error: Optional[str] = None):
+        now = datetime.utcnow().isoformat()
+        if status == "running":
+            await self._run("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (status, now, job_id))
+        elif status == "queued":
+            await self._run("UPDATE jobs SET status = ?, started_at = NULL WHERE id = ?", (status, job_id))
+        else:
+            await self._run(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, error, now, job_id),
+            )
+    
+    async def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        columns = "id, chat_id, status, error, created_at, started_at, finished_at"
+        if status:
+            return await self._run(
+                f"SELECT {columns} FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+                (status, limit),
+            )
+        return await self._run(f"SELECT {columns} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+    
+    async def unfinished(self) -> List[Dict[str, Any]]:
+        """Jobs that were queued or running when the process last stopped."""
+        return await self._run(
+            "SELECT id, status, owner FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        )
+
+
+class ChatJobQueue:
+    """Bounded worker pool for /api/chat/async runs.
+    
+    Jobs are persisted in a JobStore before they are acknowledged, executed by
+    JOB_WORKERS concurrent workers, deduplicated per chat_id while active, and
+    re-queued on startup if the previous process died mid-run.
+    
+    Several server processes can share one JobStore: each job is claimed
+    atomically by one of them, running jobs are only re-queued once their
+    owner process has exited, and cancels for jobs running in another
+    process are forwarded through worker sync.
+    """
+    
+    def __init__(self, runner, store: JobStore):
+        self._runner = runner
+        self.store = store
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancel_requested: set = set()
+        self._submit_lock = asyncio.Lock()
+    
+    async def start(self):
+        self._queue = asyncio.Queue()
+        
+        resumed = []
+        for job in await self.store.unfinished():
+            if job["status"] == "running":
+                if self._owner_alive(job.get("owner")):
+                    continue  # still running in another worker
+                await self.store.update_status(job["id"], "queued")
+            self._queue.put_nowait(job["id"])
+            resumed.append(job)
+        if resumed:
+            print(f"✓ Resumed {len(resumed)} async chat jobs from {self.store.path}")
+        
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(max(1, config.JOB_WORKERS))
+        ]
+        print(f"✓ Async job queue started with {len(self._workers)} workers")
+    
+    @staticmethod
+    def _owner_alive(owner: Optional[str]) -> bool:
+        """True if the worker that claimed a job (a worker_sync id) is still running."""
+        if not owner or owner == worker_sync.worker_id:
+            return False
+        parts = owner.split("-")
+        if not parts[0].isdigit():
+            return False
+        pid = int(parts[0])
+        # Our own pid under another id: a previous process whose pid we reused (e.g. after a restart)
+        if pid == os.getpid() or not pid_alive(pid):
+            return False
+        started = parts[1] if len(parts) == 3 else None
+        if started and started != "0":
+            current = process_start_time(pid)
+            if current is not None and current != started:
+                return False
+        return True
+    
+    async def stop(self):
+        # Running jobs stay 'running' in the store and are resumed on next start
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+    
+    async def submit(self, request) -> tuple:
+        """Persist and enqueue a request. Returns (job, deduplicated)."""
+        async with self._submit_lock:
+            if request.chat_id:
+                existing = await self.store.find_active(request.chat_id)
+                if existing is not None:
+                    return existing, True
+            
+            if self._queue.qsize() >= config.JOB_QUEUE_MAX_PENDING:
+                raise JobQueueFull(f"Job queue is full ({config.JOB_QUEUE_MAX_PENDING} pending)")
+            
+            job = await self.store.create(request.chat_id, request.model_dump_json())
+            if job is None:
+                # Another worker queued a job for this chat since the check above
+                return await self.store.find_active(request.chat_id), True
+            self._queue.put_nowait(job["id"])
+            return job, False
+    
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self.store.get(job_id)
+        if job is None or job["status"] not in JobStore.ACTIVE_STATUSES:
+            return job
+        
+        task = self._running.get(job_id)
+        if task is not None:
+            await self.cancel_local(job_id)
+        elif job["status"] == "running":
+            # Running in another worker; it cancels the task and records the status
+            await worker_sync.publish("job_cancel", job_id=job_id)
+        else:
+            # Still queued; the worker skips it when dequeued
+            await self.store.update_status(job_id, "cancelled")
+        
+        if job["chat_id"]:
+            await event_sink.emit("chat_messages", {
+                "chat_id": job["chat_id"],
+                "role": "assistant",
+                "content": "cancelled",
+                "type": "status"
+            })
+        return await self.store.get(job_id)
+    
+    async def cancel_local(self, job_id: str) -> bool:
+        """Cancel a job running in this process; False if it isn't running here."""
+        task = self._running.get(job_id)
+        if task is None:
+            return False
+        self._cancel_requested.add(job_id)
+        task.cancel()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=10)
+        except BaseException:
+            pass
+        return True
+    
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._execute(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[JOB QUEUE] Worker error on job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+    
+    async def _execute(self, job_id: str):
+        job = await self.store.get(job_id, include_payload=True)
+        if job is None or job["status"] != "queued":
+            return
+        
+        request = ChatRequest.model_validate_json(job["payload"])
+        if not await self.store.claim(job_id, worker_sync.worker_id):
+            return  # claimed by another worker
+        print(f"[JOB QUEUE] Running job {job_id} (chat {job['chat_id']})")
+        
+        task = asyncio.create_task(self._runner(request))
+        self._running[job_id] = task
+        try:
+            await task
+            await self.store.update_status(job_id, "completed")
+        except asyncio.CancelledError:
+            if job_id not in self._cancel_requested:
+                raise  # worker shutdown: leave 'running' so it resumes on restart
+            await self.store.update_status(job_id, "cancelled")
+            print(f"[JOB QUEUE] Cancelled job {job_id}")
+        except Exception as e:
+            await self.store.update_status(job_id, "failed", str(e))
+        finally:
+            self._running.pop(job_id, None)
+            self._cancel_requested.discard(job_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running),
+        }
 
 # ... (ChatRequest update) ...
 class ChatRequest(BaseModel):
@@ -884,6 +4603,352 @@ class ChatRequest(BaseModel):
     headless: bool = True
     google_sheets: Optional[List[GoogleSheetConfig]] = None
     chat_id: Optional[str] = None  # Added for DB logging
+    timing: bool = False  # Stream `timing` events with the run's spans
+
+def build_system_prompt(system_prompt: Optional[str],
+                        google_sheets: Optional[List[GoogleSheetConfig]]) -> Optional[str]:
+    """Append the available Google Sheets context to a request's system prompt."""
+    if not google_sheets:
+        return system_prompt
+    
+    sheets_context = "\n\n## AVAILABLE GOOGLE SHEETS\n\nYou have access to the following Google Sheets. Use the find_in_google_sheet tool to search them:\n\n"
+    for idx, sheet in enumerate(google_sheets, 1):
+        sheets_context += f"{idx}. Spreadsheet ID: `{sheet.spreadsheet_id}`"
+        if sheet.sheet_name:
+            sheets_context += f" (Sheet: {sheet.sheet_name})"
+        sheets_context += "\n"
+    sheets_context += "\n**IMPORTANT**: When searching, use ONLY these spreadsheet IDs.\n"
+    
+    if system_prompt:
+        return system_prompt + sheets_context
+    return sheets_context
+
+# ============================================================================
+# STRUCTURED OUTPUT
+# ============================================================================
+
+class StructuredOutputEngine:
+    """Direct model calls with native structured output, plus schema validation.
+    
+    Used by /api/chat/structured for utility calls that need no tools (memory
+    extraction, titles, instruction drafting): the model is called once with
+    the provider's structured-output support instead of running the deep
+    agent. JSON Schema validators are compiled once per schema hash, and an
+    invalid answer gets a single repair retry.
+    """
+    
+    REPAIR_PROMPT = """Your previous response did not match the required JSON schema.
+
+Problems:
+{errors}
+
+Respond again with only the corrected JSON object."""
+    
+    def __init__(self, validator_cache_size: int):
+        self.validator_cache_size = validator_cache_size
+        self._validators: "OrderedDict[str, Any]" = OrderedDict()
+        self._models: Dict[str, Any] = {}
+        self.direct_calls = 0
+        self.repairs = 0
+        self.validation_failures = 0
+    
+    @staticmethod
+    def schema_hash(schema: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(schema, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    
+    def _validator_for(self, schema: Dict[str, Any]):
+        """Compiled validator for a schema, or None when jsonschema isn't installed."""
+        key = self.schema_hash(schema)
+        validator = self._validators.get(key)
+        if validator is None:
+            try:
+                import jsonschema
+            except ImportError:
+                return None
+            validator_cls = jsonschema.validators.validator_for(schema)
+            validator_cls.check_schema(schema)
+            validator = validator_cls(schema)
+            self._validators[key] = validator
+            while len(self._validators) > self.validator_cache_size:
+                self._validators.popitem(last=False)
+        else:
+            self._validators.move_to_end(key)
+        return validator
+    
+    def validate(self, schema: Dict[str, Any], data) -> List[str]:
+        """Schema violations as readable strings (empty when valid)."""
+        validator = self._validator_for(schema)
+        if validator is None:
+            return [] if isinstance(data, dict) else ["Response is not a JSON object"]
+        errors = []
+        for error in sorted(validator.iter_errors(data), key=lambda e: list(e.path)):
+            location = "/".join(str(p) for p in error.path) or "(root)"
+            errors.append(f"{location}: {error.message}")
+        return errors[:20]
+    
+    @staticmethod
+    def parse_json(text: str):
+        """Parse a JSON value from a model reply, tolerating code fences and surrounding prose."""
+        text = (text or "").strip()
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+        fence = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+        if fence:
+            try:
+                return json.loads(fence.group(1))
+            except ValueError:
+                pass
+        decoder = json.JSONDecoder()
+        for start in (i for i, ch in enumerate(text) if ch in "{["):
+            try:
+                return decoder.raw_decode(text, start)[0]
+            except ValueError:
+                continue
+        raise ValueError("No JSON value found in response")
+    
+    def _get_model(self, model: Optional[str]):
+        model = model or config.MODEL
+        llm = self._models.get(model)
+        if llm is None:
+            llm = resolve_chat_model(model, temperature=0)
+            if isinstance(llm, str):
+                from langchain.chat_models import init_chat_model
+                llm = init_chat_model(model, temperature=0)
+            self._models[model] = llm
+        return llm
+    
+    def _structured_model(self, model: Optional[str], schema: Dict[str, Any]):
+        llm = self._get_model(model)
+        # Tool/JSON-schema APIs need a name for the schema
+        named = {"title": "structured_output", "description": "Structured response", **schema}
+        return llm.with_structured_output(named, include_raw=True)
+    
+    async def complete(self, messages: list, schema: Dict[str, Any], model: Optional[str] = None) -> Dict[str, Any]:
+        """One direct structured call, validated, with a single repair retry."""
+        self.direct_calls += 1
+        runnable = self._structured_model(model, schema)
+        output = await runnable.ainvoke(messages)
+        data, raw_text, errors = self._read_output(output, schema)
+        
+        repaired = False
+        if errors:
+            self.repairs += 1
+            repaired = True
+            retry_messages = list(messages) + [
+                {"role": "assistant", "content": raw_text or json.dumps(data, default=str)},
+                {"role": "user", "content": self.REPAIR_PROMPT.format(errors="\n".join(f"- {e}" for e in errors))},
+            ]
+            output = await runnable.ainvoke(retry_messages)
+            data, raw_text, errors = self._read_output(output, schema)
+        
+        if errors:
+            self.validation_failures += 1
+        return {"data": data, "raw_response": raw_text, "errors": errors, "repaired": repaired}
+    
+    def _read_output(self, output: Dict[str, Any], schema: Dict[str, Any]) -> tuple:
+        raw = output.get("raw")
+        raw_text = message_text(raw.content) if raw is not None else ""
+        data = output.get("parsed")
+        if data is None:
+            try:
+                data = self.parse_json(raw_text)
+            except ValueError as e:
+                return None, raw_text, [f"(root): {output.get('parsing_error') or e}"]
+        if not raw_text:
+            raw_text = json.dumps(data, default=str)
+        return data, raw_text, self.validate(schema, data)
+    
+    async def repair(self, raw_text: str, errors: List[str], schema: Dict[str, Any],
+                     model: Optional[str] = None) -> Dict[str, Any]:
+        """Fix an invalid agent answer with one direct structured call (no agent re-run)."""
+        self.repairs += 1
+        messages = [
+            {"role": "system", "content": "Convert the given answer into JSON that matches the required schema. Keep its content."},
+            {"role": "user", "content": f"Answer:\n{raw_text}\n\n" + self.REPAIR_PROMPT.format(errors="\n".join(f"- {e}" for e in errors))},
+        ]
+        output = await self._structured_model(model, schema).ainvoke(messages)
+        data, _, errors = self._read_output(output, schema)
+        if errors:
+            self.validation_failures += 1
+        return {"data": data, "errors": errors}
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "direct_calls": self.direct_calls,
+            "repairs": self.repairs,
+            "validation_failures": self.validation_failures,
+            "cached_validators": len(self._validators),
+        }
+
+structured_output = StructuredOutputEngine(config.STRUCTURED_VALIDATOR_CACHE_SIZE)
+
+
+class StructuredResponseCache:
+    """In-memory TTL cache of successful structured chat responses.
+    
+    Keys are a canonical hash of (messages, schema, model, system prompt);
+    callers opt in per request and can bound the age they accept or bypass
+    the lookup to force a refresh.
+    """
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, expires_at, response)
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(messages: list, schema: Dict[str, Any], model: Optional[str], system_prompt: Optional[str]) -> str:
+        payload = json.dumps(
+            {"messages": messages, "schema": schema, "model": model or config.MODEL, "system_prompt": system_prompt or ""},
+            sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str, max_age_seconds: Optional[float] = None) -> Optional[tuple]:
+        """(response, age_seconds) for a fresh entry, else None."""
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is None or entry[1] <= now:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        age = now - entry[0]
+        if max_age_seconds is not None and age > max_age_seconds:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2], age
+    
+    def set(self, key: str, response: Dict[str, Any], ttl_seconds: float):
+        now = time.time()
+        self._entries[key] = (now, now + ttl_seconds, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+structured_response_cache = StructuredResponseCache(config.STRUCTURED_CACHE_MAX_ENTRIES)
+
+# ============================================================================
+# AGENT STREAMING
+# ============================================================================
+
+def message_text(content) -> str:
+    """Plain text of a message's content (string or list of content blocks)."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text", ""))
+        return "".join(parts)
+    return str(content) if content else ""
+
+def _is_main_agent_chunk(metadata: Dict[str, Any]) -> bool:
+    """True for model tokens from the top-level agent, not from subagents run inside tools."""
+    namespace = metadata.get("langgraph_checkpoint_ns", "") or metadata.get("checkpoint_ns", "")
+    return "|" not in namespace and metadata.get("langgraph_node") != "tools"
+
+async def stream_agent_events(agent, messages: list):
+    """Stream an agent run as normalized events.
+    
+    Uses LangGraph's "messages" mode for incremental token deltas and
+    "updates" mode for completed messages, so each token is sent once and
+    tool calls/results are reported as soon as their node finishes.
+    
+    Text deltas are sent as tokens as soon as they arrive. Providers can emit
+    preamble text before a tool call in the same message; when a message
+    turns out to call tools, a token_reset event carries the text already
+    sent for it so clients can retract it (it was not part of the answer).
+    
+    Yields dicts with `type` in: token, token_reset, tool_call, tool_result,
+    ai_message.
+    Each model step (from run start or the last tool result to the next AI
+    message) is recorded as an "llm" span on the current trace.
+    """
+    trace = current_trace.get()
+    step_started = time.perf_counter()
+    with trace_span("agent.astream", "agent"):
+        async for event in _stream_agent_updates(agent, messages):
+            if trace is not None:
+                if event["type"] == "ai_message":
+                    trace.add_span("llm.step", "llm", step_started, time.perf_counter(),
+                                   {"tool_calls": event["has_tool_calls"]})
+                    step_started = time.perf_counter()
+                elif event["type"] == "tool_result":
+                    step_started = time.perf_counter()
+            yield event
+
+async def _stream_agent_updates(agent, messages: list):
+    sent: Dict[str, List[str]] = {}  # AI message id -> text deltas already streamed
+    with_tool_calls: set = set()
+    async for mode, chunk in agent.astream({"messages": messages}, stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            message_chunk, metadata = chunk
+            if type(message_chunk).__name__ != "AIMessageChunk" or not _is_main_agent_chunk(metadata or {}):
+                continue
+            chunk_id = message_chunk.id or ""
+            if getattr(message_chunk, "tool_call_chunks", None) and chunk_id not in with_tool_calls:
+                # Intermediate step: its text is preamble, not part of the answer
+                with_tool_calls.add(chunk_id)
+                retracted = "".join(sent.pop(chunk_id, []))
+                if retracted:
+                    yield {"type": "token_reset", "content": retracted}
+            if chunk_id in with_tool_calls:
+                continue
+            text = message_text(message_chunk.content)
+            if text:
+                sent.setdefault(chunk_id, []).append(text)
+                yield {"type": "token", "content": text}
+        
+        elif mode == "updates" and isinstance(chunk, dict):
+            for update in chunk.values():
+                new_messages = update.get("messages") if isinstance(update, dict) else None
+                if not isinstance(new_messages, list):
+                    continue
+                for msg in new_messages:
+                    msg_type = type(msg).__name__
+                    if msg_type == "AIMessage":
+                        tool_calls = getattr(msg, "tool_calls", None) or []
+                        retracted = "".join(sent.get(getattr(msg, "id", None) or "", []))
+                        if retracted and tool_calls:
+                            # Tool calls that were not streamed as chunks
+                            yield {"type": "token_reset", "content": retracted}
+                        for tool_call in tool_calls:
+                            yield {
+                                "type": "tool_call",
+                                "id": tool_call.get("id", ""),
+                                "tool": tool_call.get("name", "unknown"),
+                                "args": tool_call.get("args", {}),
+                            }
+                        # The main agent's model steps are sequential: no earlier message is still open
+                        sent.clear()
+                        with_tool_calls.clear()
+                        text = message_text(msg.content).strip()
+                        yield {"type": "ai_message", "content": text, "has_tool_calls": bool(tool_calls)}
+                    elif msg_type == "ToolMessage":
+                        yield {
+                            "type": "tool_result",
+                            "id": getattr(msg, "tool_call_id", "unknown"),
+                            "tool": getattr(msg, "name", "unknown"),
+                            "result": str(msg.content),
+                        }
 
 # ... (Chat logic update) ...
 @app.post("/api/chat")
@@ -895,11 +4960,33 @@ async def chat(request: ChatRequest):
         print(f"Model: {request.model}")
         print(f"Stream: {request.stream}")
         print(f"Chat ID: {request.chat_id}")
+        current_chat_id.set(request.chat_id)
+        await cassette.record_request("/api/chat", request.model_dump())
+        
+        agent = await agent_manager.get_pooled_agent(
+            instructions=build_system_prompt(request.system_prompt, request.google_sheets),
+            model=request.model,
+            headless=request.headless,
+            enable_research=request.enable_research
+        )
+        
+        messages = [
+            {"role": msg.role, "content": msg.content}
+            for msg in request.messages
+        ]
         
-        # ... (rest of setup) ...
+        # Context window management (rolling summary per chat)
+        messages = await context_manager.summarize_conversation_history(
+            messages, request.model, chat_id=request.chat_id
+        )
         
         if request.stream:
             async def generate():
+                current_chat_id.set(request.chat_id)
+                trace = start_trace("chat", request.chat_id)
+                run_started = time.perf_counter()
+                ttft_ms = None
+                AGENT_RUNS_IN_FLIGHT.inc(endpoint="chat")
                 try:
                     final_response = ""
                     step_count = 0
@@ -912,44 +4999,61 @@ async def chat(request: ChatRequest):
                     print(f"\n{'🚀'*30}")
                     print(f"[AGENT STREAM STARTED]")
                     
-                    async for chunk in agent.astream({"messages": messages}, stream_mode="values"):
-                        if "messages" not in chunk or not chunk["messages"]:
-                            continue
+                    stream_started = time.perf_counter()
+                    streamed_chars = 0  # token chars sent for the current AI message
+                    
+                    async for event in stream_agent_events(agent, messages):
+                        event_type = event["type"]
                         
-                        last_message = chunk["messages"][-1]
-                        msg_type = type(last_message).__name__
+                        if request.timing:
+                            for span in trace.drain():
+                                yield f"data: {json.dumps({'type': 'timing', 'span': span})}\n\n"
+                        
+                        # Text deltas from the main agent's model
+                        if event_type == "token":
+                            if ttft_ms is None:
+                                ttft_ms = round((time.perf_counter() - stream_started) * 1000)
+                                print(f"  ⚡ Time to first token: {ttft_ms} ms")
+                            streamed_chars += len(event["content"])
+                            yield f"data: {json.dumps({'type': 'token', 'content': event['content']})}\n\n"
+                        
+                        # Streamed text turned out to be a tool-calling step's preamble
+                        elif event_type == "token_reset":
+                            streamed_chars = 0
+                            thinking_logs.append(event["content"])
+                            yield f"data: {json.dumps({'type': 'token_reset', 'content': event['content']})}\n\n"
+                            yield f"data: {json.dumps({'type': 'thinking', 'content': event['content']})}\n\n"
                         
                         # Handle AIMessage with tool calls
-                        if msg_type == "AIMessage" and hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-                            for tool_call in last_message.tool_calls:
-                                tool_call_id = f"{tool_call.get('name', 'unknown')}_{tool_call.get('id', '')}"
-                                if tool_call_id in seen_tool_calls:
-                                    continue
-                                seen_tool_calls.add(tool_call_id)
-                                
-                                step_count += 1
-                                tool_name = tool_call.get('name', 'unknown')
-                                tool_args = tool_call.get('args', {})
-                                tool_args_str = json.dumps(tool_args, indent=2)
-                                
-                                log_entry = f"Calling **{tool_name}** with args: `{tool_args_str}`"
-                                thinking_logs.append(log_entry)
-                                
-                                print(f"\n{'🔧'*30}")
-                                print(f"[TOOL CALL] Step {step_count}: {tool_name}")
-                                print(f"Args: {tool_args_str[:500]}")
-                                print(f"{'🔧'*30}\n")
-                                
-                                yield f"data: {json.dumps({'type': 'tool_call', 'tool': tool_name, 'args': tool_args})}\n\n"
-                                yield f"data: {json.dumps({'type': 'thinking', 'content': f'Calling {tool_name}...'})}\n\n"
+                        elif event_type == "tool_call":
+                            tool_call_id = f"{event['tool']}_{event['id']}"
+                            if tool_call_id in seen_tool_calls:
+                                continue
+                            seen_tool_calls.add(tool_call_id)
+                            
+                            step_count += 1
+                            tool_name = event["tool"]
+                            tool_args = event["args"]
+                            tool_args_str = json.dumps(tool_args, indent=2)
+                            
+                            log_entry = f"Calling **{tool_name}** with args: `{tool_args_str}`"
+                            thinking_logs.append(log_entry)
+                            
+                            print(f"\n{'🔧'*30}")
+                            print(f"[TOOL CALL] Step {step_count}: {tool_name}")
+                            print(f"Args: {tool_args_str[:500]}")
+                            print(f"{'🔧'*30}\n")
+                            
+                            yield f"data: {json.dumps({'type': 'tool_call', 'tool': tool_name, 'args': tool_args})}\n\n"
+                            yield f"data: {json.dumps({'type': 'thinking', 'content': f'Calling {tool_name}...'})}\n\n"
                         
                         # Handle ToolMessage
-                        elif msg_type == "ToolMessage":
-                            tool_result_id = getattr(last_message, 'tool_call_id', 'unknown')
+                        elif event_type == "tool_result":
+                            tool_result_id = event["id"]
                             if tool_result_id not in seen_tool_results:
                                 seen_tool_results.add(tool_result_id)
-                                tool_content = str(last_message.content)
-                                tool_name = getattr(last_message, 'name', 'unknown')
+                                tool_content = event["result"]
+                                tool_name = event["tool"]
                                 
                                 # Truncate for log/UI
                                 display_content = tool_content[:500] + ("..." if len(tool_content) > 500 else "")
@@ -962,21 +5066,30 @@ async def chat(request: ChatRequest):
                                 
                                 yield f"data: {json.dumps({'type': 'tool_result', 'tool': tool_name, 'result': tool_content})}\n\n"
                         
-                        # Handle AIMessage with content
-                        elif msg_type == "AIMessage" and hasattr(last_message, 'content') and last_message.content:
-                            content = str(last_message.content).strip()
-                            if content and content != final_response:
-                                final_response = content
-                                yield f"data: {json.dumps({'type': 'token', 'content': content})}\n\n"
+                        # Completed AIMessage: the last one without tool calls is the answer
+                        elif event_type == "ai_message":
+                            if event["content"] and not event["has_tool_calls"]:
+                                final_response = event["content"]
+                                # Models that don't stream tokens still deliver the text once
+                                if streamed_chars == 0:
+                                    if ttft_ms is None:
+                                        ttft_ms = round((time.perf_counter() - stream_started) * 1000)
+                                    yield f"data: {json.dumps({'type': 'token', 'content': final_response})}\n\n"
+                            streamed_chars = 0
+                    
+                    if request.timing:
+                        for span in trace.drain():
+                            yield f"data: {json.dumps({'type': 'timing', 'span': span})}\n\n"
+                        yield f"data: {json.dumps({'type': 'timing', 'summary': trace.summary()})}\n\n"
                     
                     if final_response:
                         print(f"\n{'🎯'*30}")
                         print(f"[FINAL RESPONSE] Tool calls: {step_count}, Length: {len(final_response)} chars")
                         print(f"{'🎯'*30}\n")
-                        yield f"data: {json.dumps({'type': 'final', 'content': final_response})}\n\n"
+                        yield f"data: {json.dumps({'type': 'final', 'content': final_response, 'ttft_ms': ttft_ms})}\n\n"
                         
                         # --- SAVE TO SUPABASE ---
-                        if request.chat_id and supabase:
+                        if request.chat_id and event_sink.enabled:
                             try:
                                 # Combine thinking logs and final response
                                 # Format: Thinking steps followed by response
@@ -1021,12 +5134,14 @@ async def chat(request: ChatRequest):
                                 if thinking_logs:
                                    full_content_with_logs = f"### Thinking Process\n\n" + "\n\n".join(thinking_logs) + f"\n\n### Answer\n\n{final_response}"
 
-                                supabase.table("chat_messages").insert({
+                                written = await event_sink.emit("chat_messages", {
                                     "chat_id": request.chat_id,
                                     "role": "assistant",
                                     "content": full_content_with_logs
-                                }).execute()
-                                print(f"  💾 Saved assistant message to DB for Chat {request.chat_id}")
+                                })
+                                # Only this response's row, not other chats' pending rows
+                                if await event_sink.wait(written):
+                                    print(f"  💾 Saved assistant message to DB for Chat {request.chat_id}")
                             except Exception as db_err:
                                 print(f"  ⚠️ Failed to save to Supabase: {db_err}")
                                 yield f"data: {json.dumps({'type': 'error', 'content': f'DB Save Error: {str(db_err)}'})}\n\n"
@@ -1038,6 +5153,12 @@ async def chat(request: ChatRequest):
                 except Exception as e:
                     # ... error handling ...
                     pass
+                finally:
+                    AGENT_RUNS_IN_FLIGHT.dec(endpoint="chat")
+                    AGENT_RUN_SECONDS.observe(time.perf_counter() - run_started, endpoint="chat")
+                    if ttft_ms is not None:
+                        AGENT_TTFT_SECONDS.observe(ttft_ms / 1000, endpoint="chat")
+                    await finish_trace(trace)
 
             return StreamingResponse(generate(), media_type="text/event-stream")
         
@@ -1045,7 +5166,16 @@ async def chat(request: ChatRequest):
         else:
             print(f"\n[NON-STREAMING REQUEST] Messages: {len(messages)}\n")
             
-            result = await agent.ainvoke({"messages": messages})
+            trace = start_trace("chat", request.chat_id)
+            run_started = time.perf_counter()
+            AGENT_RUNS_IN_FLIGHT.inc(endpoint="chat")
+            try:
+                with trace_span("agent.ainvoke", "agent"):
+                    result = await agent.ainvoke({"messages": messages})
+            finally:
+                AGENT_RUNS_IN_FLIGHT.dec(endpoint="chat")
+                AGENT_RUN_SECONDS.observe(time.perf_counter() - run_started, endpoint="chat")
+                await finish_trace(trace)
             
             tool_call_count = 0
             for msg in result.get("messages", []):
@@ -1063,238 +5193,420 @@ async def chat(request: ChatRequest):
         import traceback
         error_detail = f"{str(e)}\n{traceback.format_exc()}"
         print(f"\n[ERROR] /api/chat failed:\n{error_detail}\n")
-from fastapi import BackgroundTasks
+async def run_chat_job(request: ChatRequest):
+    """Run one /api/chat/async request to completion, logging events via the DB sink."""
+    trace = start_trace("async", request.chat_id)
+    run_started = time.perf_counter()
+    AGENT_RUNS_IN_FLIGHT.inc(endpoint="async")
+    try:
+        print(f"[ASYNC] Starting background task for chat {request.chat_id}")
+        current_chat_id.set(request.chat_id)
+        # Same agent lookup as /api/chat, so a payload behaves the same on both endpoints
+        agent = await agent_manager.get_pooled_agent(
+            instructions=build_system_prompt(request.system_prompt, request.google_sheets),
+            model=request.model,
+            headless=request.headless,
+            enable_research=request.enable_research
+        )
+
+        messages = [
+            {"role": msg.role, "content": msg.content}
+            for msg in request.messages
+        ]
+        
+        # Context window management (rolling summary per chat)
+        messages = await context_manager.summarize_conversation_history(
+            messages, request.model, chat_id=request.chat_id
+        )
+
+        final_response = ""
+        thinking_logs = []
+        seen_tool_calls = set()
+        written = []  # this job's DB rows, awaited before the job completes
+
+        # DB LOGGING HELPERS
+        async def log_to_db(type_name, content, metadata=None):
+            if request.chat_id:
+                try:
+                    payload = {
+                        "chat_id": request.chat_id,
+                        "role": "assistant", # All agent events are assistant
+                        "content": content,
+                        "type": type_name
+                    }
+                    if metadata:
+                        payload["metadata"] = metadata
+                    written.append(await event_sink.emit("chat_messages", payload))
+                except Exception as e:
+                    print(f"DB Error: {e}")
+
+        # Log "started" status
+        await log_to_db("status", "started")
+
+        async for chunk in agent.astream({"messages": messages}, stream_mode="values"):
+            if "messages" not in chunk or not chunk["messages"]:
+                continue
+
+            last_message = chunk["messages"][-1]
+            msg_type = type(last_message).__name__
+
+            # 1. TOOL CALLS
+            if msg_type == "AIMessage" and hasattr(last_message, 'tool_calls') and last_message.tool_calls:
+                for tool_call in last_message.tool_calls:
+                    tool_call_id = f"{tool_call.get('name', 'unknown')}_{tool_call.get('id', '')}"
+                    if tool_call_id in seen_tool_calls:
+                        continue
+                    seen_tool_calls.add(tool_call_id)
+
+                    tool_name = tool_call.get('name', 'unknown')
+                    tool_args = tool_call.get('args', {})
+
+                    print(f"[ASYNC] Tool Call: {tool_name}")
+                    await log_to_db("tool_call", "", {"tool": tool_name, "args": tool_args})
+                    await log_to_db("status", "processing") # Keep UI spinning
+
+            # 2. TOOL RESULTS
+            elif msg_type == "ToolMessage":
+                # We might want to dedup results too if needed, but usually they come once.
+                # We can use the tool_call_id to dedup if necessary.
+                # For now just log.
+                tool_name = getattr(last_message, 'name', 'unknown')
+                content = str(last_message.content)
+                print(f"[ASYNC] Tool Result: {tool_name}")
+                await log_to_db("tool_result", content, {"tool": tool_name})
+
+            # 3. TEXT CONTENT (Streaming tokens vs Final)
+            # LangGraph 'values' stream gives full messages, not tokens.
+            # So we see the message grow. We don't want to log every token update to DB (too spammy).
+            # We only want to log the FINAL response.
+            elif msg_type == "AIMessage" and hasattr(last_message, 'content') and last_message.content:
+                 # Just track it locally. We log final at the end.
+                 final_response = str(last_message.content).strip()
+
+        # FINISHED - Log final response
+        if final_response:
+            print(f"[ASYNC] Final Response: {len(final_response)} chars")
+            await log_to_db("final", final_response)
+
+            # Mark status done
+            await log_to_db("status", "done")
+
+        await event_sink.wait(*written)
+
+    except Exception as e:
+        print(f"[ASYNC ERROR] {e}")
+        import traceback
+        traceback.print_exc()
+        if request.chat_id:
+            await event_sink.wait(await event_sink.emit("chat_messages", {
+                "chat_id": request.chat_id,
+                "role": "assistant",
+                "content": str(e),
+                "type": "error"
+            }))
+        raise
+    finally:
+        AGENT_RUNS_IN_FLIGHT.dec(endpoint="async")
+        AGENT_RUN_SECONDS.observe(time.perf_counter() - run_started, endpoint="async")
+        await finish_trace(trace)
+
+job_queue = ChatJobQueue(run_chat_job, JobStore(config.JOB_QUEUE_DB))
+JOB_QUEUE_DEPTH.set_function(lambda: {
+    ("queued",): job_queue.stats()["queued"],
+    ("running",): job_queue.stats()["running"],
+})
 
 @app.post("/api/chat/async")
-async def chat_async(request: ChatRequest, background_tasks: BackgroundTasks):
+async def chat_async(request: ChatRequest):
     """
     Async chat endpoint that returns immediately and processes in background.
     Events are logged to Supabase for the client to consume via Realtime.
+    
+    Runs are persisted in the job queue, executed by a bounded worker pool,
+    and deduplicated per chat_id.
     """
-    import asyncio
+    await cassette.record_request("/api/chat/async", request.model_dump())
+    try:
+        job, deduplicated = await job_queue.submit(request)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
     
-    async def run_chat_background():
-        # Create a mock generator to consume the stream and trigger side effects (DB logs)
-        # We re-use the existing 'chat' logic but just iterate over it.
-        # Note: The 'chat' function is an async generator endpoint. 
-        # We need to call the underlying generator logic directly or wrapped.
-        
-        # Let's extract the core logic of 'chat' into a helper if possible, 
-        # or just invoke it and consume the stream.
-        
-        # ACTUALLY: The `chat` function above is an endpoint that returns a StreamingResponse.
-        # We can't easily call it directly from here and just "consume" it without overhead.
-        # Better to copy the core logic or refactor.
-        # FOR NOW: Let's inline the logic or use a helper. 
-        # Since I can't refactor the whole file easily in one go, I will implement the logic here 
-        # targeting the DB writing specifically.
-        
-        try:
-            print(f"[ASYNC] Starting background task for chat {request.chat_id}")
-            agent = await agent_manager.get_agent()
-            
-            messages = [
-                {"role": msg.role, "content": msg.content}
-                for msg in request.messages
-            ]
-            
-            # System prompt handling
-            if request.system_prompt:
-                 # Check if system prompt is already the first message, if not prepend
-                 if not messages or messages[0].get("role") != "system":
-                     messages.insert(0, {"role": "system", "content": request.system_prompt})
-                 else:
-                     messages[0]["content"] = request.system_prompt + "\n\n" + messages[0]["content"]
-            
-            final_response = ""
-            thinking_logs = []
-            seen_tool_calls = set()
-            
-            # Log "started" status
-            if supabase and request.chat_id:
-                supabase.table("chat_messages").insert({
-                    "chat_id": request.chat_id,
-                    "role": "assistant", # or system
-                    "content": "started",
-                    "type": "status",
-                    # "metadata": {"status": "started"} 
-                }).execute()
+    return {
+        "status": "started",
+        "chat_id": request.chat_id,
+        "job_id": job["id"],
+        "job_status": job["status"],
+        "deduplicated": deduplicated,
+    }
 
-            async for chunk in agent.astream({"messages": messages}, stream_mode="values"):
-                if "messages" not in chunk or not chunk["messages"]:
-                    continue
-                
-                last_message = chunk["messages"][-1]
-                msg_type = type(last_message).__name__
-                
-                # DB LOGGING HELPERS
-                def log_to_db(type_name, content, metadata=None):
-                    if supabase and request.chat_id:
-                        try:
-                            payload = {
-                                "chat_id": request.chat_id,
-                                "role": "assistant", # All agent events are assistant
-                                "content": content,
-                                "type": type_name
-                            }
-                            if metadata:
-                                payload["metadata"] = metadata
-                            supabase.table("chat_messages").insert(payload).execute()
-                        except Exception as e:
-                            print(f"DB Error: {e}")
-
-                # 1. TOOL CALLS
-                if msg_type == "AIMessage" and hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-                    for tool_call in last_message.tool_calls:
-                        tool_call_id = f"{tool_call.get('name', 'unknown')}_{tool_call.get('id', '')}"
-                        if tool_call_id in seen_tool_calls:
-                            continue
-                        seen_tool_calls.add(tool_call_id)
-                        
-                        tool_name = tool_call.get('name', 'unknown')
-                        tool_args = tool_call.get('args', {})
-                        
-                        print(f"[ASYNC] Tool Call: {tool_name}")
-                        log_to_db("tool_call", "", {"tool": tool_name, "args": tool_args})
-                        log_to_db("status", "processing") # Keep UI spinning
-
-                # 2. TOOL RESULTS
-                elif msg_type == "ToolMessage":
-                    # We might want to dedup results too if needed, but usually they come once.
-                    # We can use the tool_call_id to dedup if necessary.
-                    # For now just log.
-                    tool_name = getattr(last_message, 'name', 'unknown')
-                    content = str(last_message.content)
-                    print(f"[ASYNC] Tool Result: {tool_name}")
-                    log_to_db("tool_result", content, {"tool": tool_name})
-
-                # 3. TEXT CONTENT (Streaming tokens vs Final)
-                # LangGraph 'values' stream gives full messages, not tokens.
-                # So we see the message grow. We don't want to log every token update to DB (too spammy).
-                # We only want to log the FINAL response.
-                elif msg_type == "AIMessage" and hasattr(last_message, 'content') and last_message.content:
-                     # Just track it locally. We log final at the end.
-                     final_response = str(last_message.content).strip()
-
-            # FINISHED - Log final response
-            if final_response:
-                print(f"[ASYNC] Final Response: {len(final_response)} chars")
-                if supabase and request.chat_id:
-                    supabase.table("chat_messages").insert({
-                        "chat_id": request.chat_id,
-                        "role": "assistant",
-                        "content": final_response,
-                        "type": "final" 
-                    }).execute()
-                    
-                    # Mark status done
-                    supabase.table("chat_messages").insert({
-                        "chat_id": request.chat_id,
-                        "role": "assistant",
-                        "content": "done",
-                        "type": "status"
-                    }).execute()
-            
-        except Exception as e:
-            print(f"[ASYNC ERROR] {e}")
-            import traceback
-            traceback.print_exc()
-            if supabase and request.chat_id:
-                 supabase.table("chat_messages").insert({
-                    "chat_id": request.chat_id,
-                    "role": "assistant",
-                    "content": str(e),
-                    "type": "error"
-                }).execute()
-
-    # Start independent task
-    background_tasks.add_task(run_chat_background)
-    
-    return {"status": "started", "chat_id": request.chat_id}
+@app.get("/api/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    return {"jobs": await job_queue.store.list(status=status, limit=limit), **job_queue.stats()}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/chat/stop")
+async def stop_chat(chat_id: str):
+    """Cancel the active async run for a chat (used by the Next.js stop route)."""
+    job = await job_queue.store.find_active(chat_id)
+    if job is None:
+        return {"status": "not_running", "chat_id": chat_id}
+    job = await job_queue.cancel(job["id"])
+    return {"status": job["status"], "chat_id": chat_id, "job_id": job["id"]}
+
+def is_direct_structured(request) -> bool:
+    """Whether a structured request takes the direct (no agent, no tools) path."""
+    return request.mode == "direct" or (
+        request.mode == "auto"
+        and not request.use_tools
+        and not request.enable_research
+        and not request.google_sheets
+    )
+
+async def run_structured_chat(request: StructuredChatRequest, agent=None) -> Dict[str, Any]:
+    """Run one structured chat request, through the response cache when opted in."""
+    if not request.cache:
+        return await _compute_structured_chat(request, agent)
+    
+    key = structured_response_cache.make_key(
+        [msg.model_dump() for msg in request.messages],
+        request.structured_output_format,
+        request.model,
+        build_system_prompt(request.system_prompt, request.google_sheets),
+    )
+    if not request.cache_bypass:
+        hit = structured_response_cache.get(key, request.cache_max_age_seconds)
+        if hit is not None:
+            response, age = hit
+            print(f"  ⚡ Structured response cache hit ({age:.0f}s old)")
+            return {**response, "cached": True, "cache_age_seconds": round(age, 1)}
+    
+    response = await _compute_structured_chat(request, agent)
+    # An explicit cache_ttl_seconds of 0 means "don't store this response"
+    ttl = request.cache_ttl_seconds if request.cache_ttl_seconds is not None else config.STRUCTURED_CACHE_TTL_SECONDS
+    if response.get("success") and ttl > 0:
+        structured_response_cache.set(key, response, ttl)
+    return {**response, "cached": False}
+
+async def _compute_structured_chat(request: StructuredChatRequest, agent=None) -> Dict[str, Any]:
+    """Run one structured chat request and return its response body.
+    
+    Calls that need no tools (use_tools=false, no research or sheets) or set
+    mode="direct" skip the deep agent and call the model directly with native
+    structured output. Agent answers are validated against the same schema.
+    A pre-built agent can be passed in (batch requests share one).
+    """
+    schema = request.structured_output_format
+    direct = is_direct_structured(request)
+    current_chat_id.set(request.chat_id)
+    
+    messages = [
+        {"role": msg.role, "content": msg.content}
+        for msg in request.messages
+    ]
+    
+    # Context window management
+    estimated_tokens = context_manager.estimate_messages_tokens(messages, request.model)
+    
+    if estimated_tokens > config.CONVERSATION_SUMMARIZE_TOKEN_THRESHOLD:
+        messages = await context_manager.summarize_conversation_history(
+            messages, request.model, chat_id=request.chat_id
+        )
+    elif len(messages) > 10:
+        messages = messages[-10:]
+    
+    print(f"\n[STRUCTURED OUTPUT REQUEST] Mode: {'direct' if direct else 'agent'} Schema: {json.dumps(schema)[:200]}\n")
+    
+    # =====================================================
+    # DIRECT: single model call with native structured output
+    # =====================================================
+    if direct:
+        # No tools here, so the sheets context build_system_prompt adds doesn't apply
+        system_prompt = request.system_prompt
+        if system_prompt and messages and messages[0]["role"] == "system":
+            # Merge into the leading system message (e.g. a conversation summary) to keep just one
+            messages[0] = {"role": "system", "content": f"{system_prompt}\n\n{messages[0]['content']}"}
+        elif system_prompt:
+            messages.insert(0, {"role": "system", "content": system_prompt})
+        run_started = time.perf_counter()
+        AGENT_RUNS_IN_FLIGHT.inc(endpoint="structured_direct")
+        try:
+            result = await structured_output.complete(messages, schema, request.model)
+        finally:
+            AGENT_RUNS_IN_FLIGHT.dec(endpoint="structured_direct")
+            AGENT_RUN_SECONDS.observe(time.perf_counter() - run_started, endpoint="structured_direct")
+        response = {
+            "data": result["data"],
+            "raw_response": result["raw_response"],
+            "success": not result["errors"],
+            "mode": "direct",
+            "repaired": result["repaired"],
+        }
+        if result["errors"]:
+            response["error"] = "Response did not match schema: " + "; ".join(result["errors"])
+        return response
+    
+    # =====================================================
+    # AGENT: full deep agent with tools
+    # =====================================================
+    if agent is None:
+        agent = await agent_manager.get_pooled_agent(
+            instructions=build_system_prompt(request.system_prompt, request.google_sheets),
+            model=request.model,
+            headless=request.headless,
+            enable_research=request.enable_research
+        )
+    
+    # Add structured output instruction
+    schema_str = json.dumps(schema, indent=2)
+    structured_instruction = f"\n\nIMPORTANT: You MUST respond with valid JSON matching this exact schema:\n{schema_str}\n\nDo not include any text outside the JSON object."
+    
+    if messages and messages[-1]["role"] == "user":
+        messages[-1]["content"] += structured_instruction
+    
+    trace = start_trace("structured", request.chat_id)
+    run_started = time.perf_counter()
+    AGENT_RUNS_IN_FLIGHT.inc(endpoint="structured")
+    try:
+        with trace_span("agent.ainvoke", "agent"):
+            result = await agent.ainvoke({"messages": messages})
+    finally:
+        AGENT_RUNS_IN_FLIGHT.dec(endpoint="structured")
+        AGENT_RUN_SECONDS.observe(time.perf_counter() - run_started, endpoint="structured")
+        await finish_trace(trace)
+    response_content = message_text(result["messages"][-1].content)
+    
+    try:
+        structured_data = structured_output.parse_json(response_content)
+        errors = structured_output.validate(schema, structured_data)
+    except ValueError as e:
+        structured_data, errors = None, [f"(root): {e}"]
+    
+    repaired = False
+    if errors:
+        # One cheap repair call instead of re-running the agent
+        print(f"  🔧 Structured response invalid, repairing: {errors[:3]}")
+        fixed = await structured_output.repair(response_content, errors, schema, request.model)
+        structured_data, errors, repaired = fixed["data"], fixed["errors"], True
+    
+    response = {
+        "data": structured_data,
+        "raw_response": response_content,
+        "success": not errors,
+        "mode": "agent",
+        "repaired": repaired,
+    }
+    if errors:
+        response["error"] = "Response did not match schema: " + "; ".join(errors)
+    return response
 
 @app.post("/api/chat/structured")
 async def structured_chat(request: StructuredChatRequest):
     """Chat endpoint with structured output support and context management"""
     try:
-        from langchain_core.output_parsers import JsonOutputParser
-        from langchain_core.prompts import ChatPromptTemplate
-        
-        system_prompt = request.system_prompt
-        if request.google_sheets:
-            sheets_context = "\n\n## AVAILABLE GOOGLE SHEETS\n\nYou have access to the following Google Sheets. Use the find_in_google_sheet tool to search them:\n\n"
-            for idx, sheet in enumerate(request.google_sheets, 1):
-                sheets_context += f"{idx}. Spreadsheet ID: `{sheet.spreadsheet_id}`"
-                if sheet.sheet_name:
-                    sheets_context += f" (Sheet: {sheet.sheet_name})"
-                sheets_context += "\n"
-            sheets_context += "\n**IMPORTANT**: When searching, use ONLY these spreadsheet IDs.\n"
-            
-            if system_prompt:
-                system_prompt = system_prompt + sheets_context
-            else:
-                system_prompt = sheets_context
-        
-        if system_prompt or request.model or request.headless != True:
-            await agent_manager.reinitialize_agent(
-                instructions=system_prompt,
-                model=request.model,
-                headless=request.headless
-            )
-        
-        agent = await agent_manager.get_agent()
-        
-        messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in request.messages
-        ]
-        
-        # Context window management
-        total_chars = sum(len(m.get("content", "")) for m in messages)
-        estimated_tokens = total_chars // 4
-        
-        if estimated_tokens > config.CONVERSATION_SUMMARIZE_TOKEN_THRESHOLD:
-            messages = await context_manager.summarize_conversation_history(messages)
-        elif len(messages) > 10:
-            messages = messages[-10:]
-        
-        # Add structured output instruction
-        schema_str = json.dumps(request.structured_output_format, indent=2)
-        structured_instruction = f"\n\nIMPORTANT: You MUST respond with valid JSON matching this exact schema:\n{schema_str}\n\nDo not include any text outside the JSON object."
-        
-        if messages and messages[-1]["role"] == "user":
-            messages[-1]["content"] += structured_instruction
-        
-        print(f"\n[STRUCTURED OUTPUT REQUEST] Schema: {json.dumps(request.structured_output_format)[:200]}\n")
-        
-        result = await agent.ainvoke({"messages": messages})
-        response_content = result["messages"][-1].content
-        
-        try:
-            import re
-            json_match = re.search(r'\{.*\}', response_content, re.DOTALL)
-            if json_match:
-                structured_data = json.loads(json_match.group(0))
-            else:
-                structured_data = json.loads(response_content)
-            
-            return {
-                "data": structured_data,
-                "raw_response": response_content,
-                "success": True
-            }
-        except json.JSONDecodeError as e:
-            return {
-                "data": None,
-                "raw_response": response_content,
-                "success": False,
-                "error": f"Failed to parse JSON: {str(e)}"
-            }
-    
+        await cassette.record_request("/api/chat/structured", request.model_dump())
+        return await run_structured_chat(request)
     except Exception as e:
         import traceback
         print(f"Error in structured_chat: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/structured/batch")
+async def structured_chat_batch(request: StructuredBatchRequest):
+    """Run many structured prompts sharing schema, model and system prompt.
+    
+    Items run on one pooled agent (or the direct path) with at most
+    `concurrency` in flight, each bounded by `item_timeout_seconds`. Results
+    stream back as NDJSON lines in completion order, tagged with the item's
+    index and id, followed by a final summary line.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items")
+    if len(request.items) > config.STRUCTURED_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {config.STRUCTURED_BATCH_MAX_ITEMS} items per batch")
+    
+    concurrency = max(1, min(request.concurrency or config.STRUCTURED_BATCH_CONCURRENCY,
+                             config.STRUCTURED_BATCH_MAX_CONCURRENCY))
+    item_timeout = request.item_timeout_seconds or config.STRUCTURED_BATCH_ITEM_TIMEOUT
+    
+    shared = request.model_dump(exclude={"items", "concurrency", "item_timeout_seconds"})
+    item_requests = [
+        StructuredChatRequest(**shared, messages=item.messages, chat_id=item.chat_id)
+        for item in request.items
+    ]
+    
+    agent = None
+    if not is_direct_structured(item_requests[0]):
+        agent = await agent_manager.get_pooled_agent(
+            instructions=build_system_prompt(request.system_prompt, request.google_sheets),
+            model=request.model,
+            headless=request.headless,
+            enable_research=request.enable_research
+        )
+    
+    print(f"\n[STRUCTURED BATCH] {len(item_requests)} items, concurrency {concurrency}, timeout {item_timeout}s")
+    
+    async def generate():
+        semaphore = asyncio.Semaphore(concurrency)
+        started = time.perf_counter()
+        
+        async def run_item(index: int, item_request: StructuredChatRequest) -> Dict[str, Any]:
+            async with semaphore:
+                item_started = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(run_structured_chat(item_request, agent=agent), item_timeout)
+                except asyncio.TimeoutError:
+                    result = {"data": None, "success": False, "error": f"Timed out after {item_timeout}s"}
+                except Exception as e:
+                    result = {"data": None, "success": False, "error": str(e)}
+                result["elapsed_ms"] = round((time.perf_counter() - item_started) * 1000)
+                return {"index": index, "id": request.items[index].id, **result}
+        
+        tasks = [asyncio.create_task(run_item(i, r)) for i, r in enumerate(item_requests)]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                succeeded += bool(line.get("success"))
+                yield json.dumps(line, default=str) + "\n"
+            yield json.dumps({
+                "type": "done",
+                "total": len(tasks),
+                "succeeded": succeeded,
+                "failed": len(tasks) - succeeded,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000),
+            }) + "\n"
+        finally:
+            # Client went away: don't keep running the remaining items
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+    
+@app.delete("/api/chat/{chat_id}/summary")
+async def invalidate_conversation_summary(chat_id: str):
+    """Drop the rolling conversation summary for a chat (e.g. after history edits)."""
+    await context_manager.conversation_summaries.invalidate(chat_id)
+    return {"status": "success", "chat_id": chat_id}
+
+@app.delete("/api/chat/{chat_id}/index")
+async def drop_chat_index(chat_id: str):
+    """Drop the vector index of large tool responses for a chat."""
+    await worker_sync.publish("chat_index_dropped", chat_id=chat_id)
+    return {"status": "success", "chat_id": chat_id, "dropped": vector_index.drop(chat_id)}
+
 @app.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
     """WebSocket endpoint for real-time chat"""
@@ -1358,6 +5670,7 @@ async def update_config(request: ConfigRequest):
             instructions=request.instructions,
             headless=request.headless
         )
+        await worker_sync.publish("agent_config", instructions=request.instructions, headless=request.headless)
         return {"status": "success", "message": "Agent reinitialized"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1369,35 +5682,34 @@ async def get_mcp_servers():
 @app.post("/api/mcp/servers/{server_name}")
 async def add_mcp_server(server_name: str, server_config: MCPServerConfig):
     try:
-        current_config = agent_manager.mcp_config_manager.config
-        if "mcp_servers" not in current_config:
-            current_config["mcp_servers"] = {}
-        
-        current_config["mcp_servers"][server_name] = {
-            "command": server_config.command,
-            "args": server_config.args,
-            "env": server_config.env or {},
-            "enabled": server_config.enabled
-        }
+        def add_server(current_config: Dict[str, Any]):
+            current_config.setdefault("mcp_servers", {})[server_name] = {
+                "command": server_config.command,
+                "args": server_config.args,
+                "env": server_config.env or {},
+                "enabled": server_config.enabled
+            }
         
-        agent_manager.mcp_config_manager.save_config(current_config)
+        # Read-modify-write under the config lock so concurrent workers don't drop changes
+        await agent_manager.mcp_config_manager.update(add_server)
         
-        if server_config.enabled:
-            await agent_manager.reinitialize_agent()
+        diff = await agent_manager.refresh_mcp_tools()
+        await worker_sync.publish("mcp_config")
         
-        return {"status": "success", "message": f"MCP server '{server_name}' configured"}
+        return {"status": "success", "message": f"MCP server '{server_name}' configured", "changes": diff}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/mcp/servers/{server_name}")
 async def delete_mcp_server(server_name: str):
     try:
-        current_config = agent_manager.mcp_config_manager.config
-        if "mcp_servers" in current_config and server_name in current_config["mcp_servers"]:
-            del current_config["mcp_servers"][server_name]
-            agent_manager.mcp_config_manager.save_config(current_config)
-            await agent_manager.reinitialize_agent()
-            return {"status": "success", "message": f"MCP server '{server_name}' deleted"}
+        removed = await agent_manager.mcp_config_manager.update(
+            lambda current_config: current_config.get("mcp_servers", {}).pop(server_name, None) is not None
+        )
+        if removed:
+            diff = await agent_manager.refresh_mcp_tools()
+            await worker_sync.publish("mcp_config")
+            return {"status": "success", "message": f"MCP server '{server_name}' deleted", "changes": diff}
         else:
             raise HTTPException(status_code=404, detail="Server not found")
     except Exception as e:
@@ -1414,16 +5726,35 @@ async def list_tools():
         })
     return {"tools": tools_info}
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint (agent, tool, summarizer and queue metrics)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/health")
 async def health_check():
     return {
         "status": "healthy",
         "agent_initialized": agent_manager.agent is not None,
+        "warmup": agent_manager.warmup_stats(),
         "model": config.MODEL,
+        "agent_pool": agent_manager.agent_pool.stats(),
+        "mcp_sessions": agent_manager.mcp_session_pool.stats(),
+        "mcp_registry_version": agent_manager.mcp_tool_registry.version,
+        "db_event_sink": event_sink.stats(),
+        "spill_store": spill_store.stats(),
+        "tool_cache": tool_result_cache.stats(),
+        "structured_output": structured_output.stats(),
+        "structured_response_cache": structured_response_cache.stats(),
+        "vector_index": vector_index.stats(),
+        "job_queue": job_queue.stats(),
+        "worker_sync": worker_sync.stats(),
+        "cassette": cassette.stats(),
         "context_management": {
             "summarizer_model": config.SUMMARIZER_MODEL,
             "tool_response_summarize_threshold": config.TOOL_RESPONSE_SUMMARIZE_THRESHOLD,
             "conversation_summarize_token_threshold": config.CONVERSATION_SUMMARIZE_TOKEN_THRESHOLD,
+            "summary_cache": context_manager.summary_cache.stats(),
         },
         "mcp_truncation_limits": {
             "max_response_size": config.MCP_MAX_RESPONSE_SIZE,
@@ -1432,31 +5763,71 @@ async def health_check():
         }
     }
 
-# Google Sheets OAuth endpoints (conditional)
-if GOOGLE_SHEETS_ENABLED and sheets_auth:
-    @app.get("/oauth2callback")
-    async def oauth2callback(code: str):
-        try:
-            sheets_auth.handle_callback(code)
-            return RedirectResponse(url="http://13.203.61.74:7860")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
+@app.get("/api/health/live")
+async def liveness_check():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "alive"}
 
-    @app.get("/api/sheets/status")
-    async def sheets_auth_status():
-        return {
-            "enabled": GOOGLE_SHEETS_ENABLED,
-            "authenticated": sheets_auth.is_authenticated() if sheets_auth else False
-        }
+@app.get("/api/health/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the default agent (tools and MCP sessions) is built, else 503."""
+    ready = agent_manager.ready
+    body = {"status": "ready" if ready else agent_manager.warmup_state, "warmup": agent_manager.warmup_stats()}
+    return JSONResponse(status_code=200 if ready else 503, content=body)
 
-    @app.get("/api/sheets/auth-url")
-    async def get_sheets_auth_url():
-        if not sheets_auth:
-            raise HTTPException(status_code=503, detail="Google Sheets not configured")
-        auth_url = sheets_auth.get_auth_url()
-        if not auth_url:
-            raise HTTPException(status_code=503, detail="Cannot generate auth URL")
-        return {"auth_url": auth_url}
+# Google Sheets OAuth endpoints (503 when the integration is not configured)
+@app.get("/oauth2callback")
+async def oauth2callback(code: str):
+    sheets_auth = await asyncio.to_thread(get_sheets_auth)
+    if not sheets_auth:
+        raise HTTPException(status_code=503, detail="Google Sheets not configured")
+    try:
+        sheets_auth.handle_callback(code)
+        return RedirectResponse(url="http://13.203.61.74:7860")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/sheets/status")
+async def sheets_auth_status():
+    sheets_auth = await asyncio.to_thread(get_sheets_auth)
+    return {
+        "enabled": sheets_auth is not None,
+        "authenticated": sheets_auth.is_authenticated() if sheets_auth else False
+    }
+
+@app.get("/api/sheets/auth-url")
+async def get_sheets_auth_url():
+    sheets_auth = await asyncio.to_thread(get_sheets_auth)
+    if not sheets_auth:
+        raise HTTPException(status_code=503, detail="Google Sheets not configured")
+    auth_url = sheets_auth.get_auth_url()
+    if not auth_url:
+        raise HTTPException(status_code=503, detail="Cannot generate auth URL")
+    return {"auth_url": auth_url}
+
+# ============================================================================
+# CROSS-WORKER INVALIDATION
+# ============================================================================
+
+async def _on_mcp_config_changed(event: Dict[str, Any]):
+    await agent_manager.mcp_config_manager.reload()
+    diff = await agent_manager.refresh_mcp_tools()
+    print(f"🔄 MCP config changed by worker {event['worker']}: {diff}")
+
+async def _on_agent_config_changed(event: Dict[str, Any]):
+    await agent_manager.reinitialize_agent(instructions=event.get("instructions"), headless=event.get("headless", True))
+    print(f"🔄 Default agent reinitialized by worker {event['worker']}")
+
+async def _on_chat_index_dropped(event: Dict[str, Any]):
+    vector_index.drop(event.get("chat_id"))
+
+async def _on_job_cancel(event: Dict[str, Any]):
+    await job_queue.cancel_local(event["job_id"])
+
+worker_sync.subscribe("mcp_config", _on_mcp_config_changed)
+worker_sync.subscribe("agent_config", _on_agent_config_changed)
+worker_sync.subscribe("chat_index_dropped", _on_chat_index_dropped)
+worker_sync.subscribe("job_cancel", _on_job_cancel)
 
 # ============================================================================
 # STARTUP
@@ -1474,8 +5845,27 @@ async def startup_event():
     print(f"  - MAX_RESPONSE_SIZE: {config.MCP_MAX_RESPONSE_SIZE:,} chars")
     print(f"  - MAX_STRING_LENGTH: {config.MCP_MAX_STRING_LENGTH:,} chars")
     print(f"  - MAX_LIST_ITEMS: {config.MCP_MAX_LIST_ITEMS} items")
-    await agent_manager.initialize_agent()
-    print("Server ready!")
+    if cassette.enabled:
+        print(f"Cassette: {cassette.mode} {cassette.path} (time scale {cassette.time_scale})")
+        if cassette.mode == "replay":
+            await asyncio.to_thread(cassette.load)
+    agent_manager.mcp_session_pool.start_health_checks()
+    worker_sync.start()
+    # Warm-up first: resumed jobs then wait for its build instead of racing it
+    agent_manager.start_warmup()
+    await job_queue.start()
+    if config.AGENT_WARMUP_BLOCKING:
+        await agent_manager.wait_ready()
+        print("Server ready!")
+    else:
+        print("Server accepting traffic; agent warm-up running in the background (see /api/health/ready)")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await worker_sync.stop()
+    await job_queue.stop()
+    await event_sink.flush()
+    await agent_manager.mcp_session_pool.close()
 
 if __name__ == "__main__":
     import uvicorn
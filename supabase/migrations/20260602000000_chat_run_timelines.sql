@@ -0,0 +1,30 @@
+-- Per-run span timelines from the agent server
+-- =============================================================================
+-- server.py records a timeline for every agent run. It covers model steps,
+-- MCP and browser tool calls, summarization, and DB writes. The timeline is
+-- written here through the batched event sink, so a slow run can be broken
+-- down after the fact.
+--
+-- Shape: timeline = [
+--   { name, kind, start_ms, duration_ms, attrs?, error? },
+--   ...
+-- ]
+-- summary = { <kind>: { count, total_ms }, ... }
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS public.chat_run_timelines (
+    id          uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    run_id      text NOT NULL,
+    chat_id     uuid NOT NULL REFERENCES public.chats(id) ON DELETE CASCADE,
+    endpoint    text NOT NULL,
+    total_ms    double precision NOT NULL,
+    summary     jsonb NOT NULL DEFAULT '{}'::jsonb,
+    timeline    jsonb NOT NULL DEFAULT '[]'::jsonb,
+    created_at  timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_run_timelines_chat_created
+    ON public.chat_run_timelines (chat_id, created_at DESC);
+
+-- Written with the service key only; no client access.
+ALTER TABLE public.chat_run_timelines ENABLE ROW LEVEL SECURITY;
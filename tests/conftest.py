@@ -0,0 +1,58 @@
+"""
+Shared fixtures for the server unit tests.
+
+server.py reads its configuration and creates its singletons at import time,
+so every on-disk path is pointed at a temp workspace before it is imported.
+No provider API keys, MCP servers or network access are needed.
+
+    pip install -r requirements.txt pytest
+    python -m pytest -q tests
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKSPACE = tempfile.mkdtemp(prefix="deepagent-tests-")
+
+os.environ.update({
+    "MODEL": "openai:gpt-4o-mini",
+    "SUMMARIZER_MODEL": "openai:gpt-4o-mini",
+    "MCP_CONFIG_FILE": os.path.join(WORKSPACE, "mcp_config.json"),
+    "CUSTOM_TOOLS_DIR": os.path.join(WORKSPACE, "custom_tools"),
+    "JOB_QUEUE_DB": os.path.join(WORKSPACE, "jobs.sqlite3"),
+    "SUMMARY_CACHE_DIR": os.path.join(WORKSPACE, "cache", "summaries"),
+    "CONVERSATION_SUMMARY_DIR": os.path.join(WORKSPACE, "cache", "conversation_summaries"),
+    "WORKER_SYNC_DIR": os.path.join(WORKSPACE, "cache", "worker_sync"),
+    "MCP_SPILL_DIR": os.path.join(WORKSPACE, "mcp_output"),
+    "RUN_TRACE_SLOW_LOG": os.path.join(WORKSPACE, "logs", "slow_runs.jsonl"),
+    "RUN_TRACE_PERSIST": "false",
+    "CASSETTE_MODE": "off",
+    "SUPABASE_URL": "",
+    "SUPABASE_SERVICE_KEY": "",
+    "NEXT_PUBLIC_SUPABASE_URL": "",
+    "SUPABASE_SERVICE_ROLE_KEY": "",
+    "OPENAI_API_KEY": "",
+    "ANTHROPIC_API_KEY": "",
+})
+# Import from the workspace so no local .env / .env.local leaks real keys in
+_cwd = os.getcwd()
+os.chdir(WORKSPACE)
+sys.path.insert(0, REPO_ROOT)
+import server  # noqa: E402
+os.chdir(_cwd)
+
+
+@pytest.fixture
+def srv():
+    return server
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine to completion on a fresh event loop."""
+    return asyncio.run
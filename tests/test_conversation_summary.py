@@ -0,0 +1,92 @@
+"""Rolling conversation summaries keyed by chat_id."""
+
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+
+class MarkerSummarizer:
+    """Fake summarizer whose summary lists every message marker it was shown."""
+    
+    def __init__(self):
+        self.requests = []
+    
+    async def ainvoke(self, messages):
+        text = messages[-1].content
+        self.requests.append(text)
+        markers = sorted(set(int(m) for m in re.findall(r"\bm(\d+)\b", text)))
+        return SimpleNamespace(content="seen " + " ".join(f"m{m}" for m in markers))
+
+
+@pytest.fixture
+def manager(srv, monkeypatch, tmp_path):
+    monkeypatch.setattr(srv.config, "CONVERSATION_SUMMARIZE_TOKEN_THRESHOLD", 0)
+    monkeypatch.setattr(srv.config, "CONVERSATION_KEEP_RECENT_MESSAGES", 2)
+    monkeypatch.setattr(srv.config, "CONVERSATION_SUMMARY_DIR", str(tmp_path / "summaries"))
+    manager = srv.ContextWindowManager()
+    summarizer = MarkerSummarizer()
+    monkeypatch.setattr(manager, "_get_summarizer", lambda: summarizer)
+    manager.fake = summarizer
+    return manager
+
+
+def conversation(count):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message m{i}"} for i in range(count)]
+
+
+def test_summary_replaces_older_messages_and_keeps_recent(manager):
+    compressed = asyncio.run(manager.summarize_conversation_history(conversation(6)))
+    
+    assert len(compressed) == 3
+    assert compressed[0]["role"] == "system"
+    assert "seen m0 m1 m2 m3" in compressed[0]["content"]
+    assert [m["content"] for m in compressed[1:]] == ["message m4", "message m5"]
+
+
+def test_roll_forward_folds_only_new_messages(manager):
+    asyncio.run(manager.summarize_conversation_history(conversation(6), chat_id="chat-1"))
+    compressed = asyncio.run(manager.summarize_conversation_history(conversation(8), chat_id="chat-1"))
+    
+    folded = manager.fake.requests[-1]
+    assert folded.startswith("Existing summary of the earlier conversation (4 messages)")
+    history = folded.split("newer messages into it and return the updated summary:")[1]
+    assert re.findall(r"\bm(\d+)\b", history) == ["4", "5"]
+    assert "seen m0 m1 m2 m3 m4 m5" in compressed[0]["content"]
+
+
+def test_unchanged_history_reuses_summary_without_a_call(manager):
+    asyncio.run(manager.summarize_conversation_history(conversation(6), chat_id="chat-1"))
+    compressed = asyncio.run(manager.summarize_conversation_history(conversation(6), chat_id="chat-1"))
+    
+    assert len(manager.fake.requests) == 1
+    assert "seen m0 m1 m2 m3" in compressed[0]["content"]
+
+
+def test_edited_history_invalidates_the_summary(manager):
+    asyncio.run(manager.summarize_conversation_history(conversation(6), chat_id="chat-1"))
+    edited = conversation(8)
+    edited[1]["content"] = "message m99"
+    compressed = asyncio.run(manager.summarize_conversation_history(edited, chat_id="chat-1"))
+    
+    rebuilt = manager.fake.requests[-1]
+    assert rebuilt.startswith("Summarize this conversation history (6 messages)")
+    assert "seen m0 m2 m3 m4 m5 m99" in compressed[0]["content"]
+
+
+def test_summary_store_round_trips_through_disk(srv, tmp_path):
+    directory = str(tmp_path / "store")
+    
+    async def scenario():
+        store = srv.ConversationSummaryStore(directory)
+        await store.save("chat-1", "summary text", covered=4, fingerprint="abc")
+        # A fresh store (another worker) reads the same record from disk
+        record = await srv.ConversationSummaryStore(directory, memory_items=0).load("chat-1")
+        await store.invalidate("chat-1")
+        gone = await srv.ConversationSummaryStore(directory).load("chat-1")
+        return record, gone
+    
+    record, gone = asyncio.run(scenario())
+    assert (record["summary"], record["covered"], record["fingerprint"]) == ("summary text", 4, "abc")
+    assert gone is None
@@ -0,0 +1,52 @@
+"""CustomToolsLoader: lazy stubs import off the event loop under a namespaced module name."""
+
+import asyncio
+import sys
+import textwrap
+
+TOOL_MODULE = textwrap.dedent('''
+    import threading
+    import time
+
+    from langchain_core.tools import tool
+
+    time.sleep(0.3)  # a heavy import
+    IMPORT_THREAD = threading.current_thread().name
+
+    @tool
+    def import_thread() -> str:
+        """Name of the thread that imported this module."""
+        return IMPORT_THREAD
+''')
+
+
+def test_lazy_tool_imports_in_a_worker_thread_under_a_namespace(srv, tmp_path, monkeypatch):
+    monkeypatch.setattr(srv.config, "CUSTOM_TOOLS_LAZY_IMPORT", True)
+    # Named like a stdlib module on purpose
+    (tmp_path / "statistics.py").write_text(TOOL_MODULE)
+    stdlib_statistics = sys.modules.get("statistics")
+    
+    # The first load imports eagerly and writes the manifest; a fresh loader then uses stubs
+    srv.CustomToolsLoader().load_tools_from_directory(str(tmp_path))
+    tools = srv.CustomToolsLoader().load_tools_from_directory(str(tmp_path))
+    assert [t.name for t in tools] == ["import_thread"]
+    
+    async def main():
+        ticks = 0
+        
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+        
+        task = asyncio.create_task(ticker())
+        thread_name = await tools[0].ainvoke({})
+        task.cancel()
+        return thread_name, ticks
+    
+    thread_name, ticks = asyncio.run(main())
+    assert thread_name != "MainThread"
+    assert ticks >= 5  # the loop kept running during the import
+    assert sys.modules.get("statistics") is stdlib_statistics
+    assert "custom_tools.statistics" in sys.modules
@@ -0,0 +1,124 @@
+"""SupabaseEventSink: batching, column-set grouping, per-row waits and client resolution."""
+
+import asyncio
+import threading
+import time
+
+
+class FakeClient:
+    def __init__(self):
+        self.inserts = []
+    
+    def table(self, name):
+        client = self
+        
+        class Query:
+            def insert(self, rows):
+                self.rows = rows
+                return self
+            
+            def execute(self):
+                if name == "slow":
+                    time.sleep(0.5)
+                client.inserts.append((name, [dict(row) for row in self.rows]))
+        
+        return Query()
+
+
+def test_rows_are_grouped_by_column_set_without_null_padding(srv, monkeypatch):
+    monkeypatch.setattr(srv.config, "DB_EVENT_FLUSH_INTERVAL", 0.05)
+    client = FakeClient()
+    sink = srv.SupabaseEventSink(lambda: client)
+    
+    async def main():
+        await sink.start()
+        await sink.emit("chat_messages", {"chat_id": "c", "role": "user", "content": "a"})
+        await sink.emit("chat_messages", {"chat_id": "c", "role": "assistant", "content": "b", "metadata": {"x": 1}})
+        await sink.emit("chat_messages", {"chat_id": "c", "role": "user", "content": "c"})
+        await sink.emit("chat_run_timelines", {"chat_id": "c", "spans": []})
+        await sink.flush()
+    
+    asyncio.run(main())
+    assert sink.inserted == 4
+    assert [(table, len(rows)) for table, rows in client.inserts] == [
+        ("chat_messages", 2), ("chat_messages", 1), ("chat_run_timelines", 1)
+    ]
+    for _, rows in client.inserts:
+        assert all(None not in row.values() for row in rows)
+    assert [row["content"] for row in client.inserts[0][1]] == ["a", "c"]
+
+
+def test_wait_covers_only_the_callers_rows(srv, monkeypatch):
+    monkeypatch.setattr(srv.config, "DB_EVENT_FLUSH_INTERVAL", 0.01)
+    client = FakeClient()
+    sink = srv.SupabaseEventSink(lambda: client)
+    
+    async def main():
+        await sink.start()
+        mine = await sink.emit("chat_messages", {"chat_id": "mine", "content": "answer"})
+        await asyncio.sleep(0.05)
+        # Another chat's row lands in a later, slow batch
+        other = await sink.emit("slow", {"chat_id": "other", "content": "x"})
+        saved = await sink.wait(mine)
+        tables_when_saved = [table for table, _ in client.inserts]
+        await sink.wait(other)
+        return saved, tables_when_saved
+    
+    saved, tables_when_saved = asyncio.run(main())
+    assert saved and tables_when_saved == ["chat_messages"]
+    assert [table for table, _ in client.inserts] == ["chat_messages", "slow"]
+
+
+def test_wait_reports_dropped_rows(srv, monkeypatch):
+    monkeypatch.setattr(srv.config, "DB_EVENT_FLUSH_INTERVAL", 0.01)
+    monkeypatch.setattr(srv.config, "DB_EVENT_MAX_RETRIES", 1)
+    
+    class FailingClient:
+        def table(self, name):
+            raise RuntimeError("connection refused")
+    
+    sink = srv.SupabaseEventSink(FailingClient)
+    
+    async def main():
+        await sink.start()
+        return await sink.wait(await sink.emit("chat_messages", {"content": "a"}))
+    
+    assert asyncio.run(main()) is False
+    assert sink.failed == 1
+
+
+def test_client_is_resolved_once_off_the_event_loop(srv, monkeypatch):
+    monkeypatch.setattr(srv.config, "SUPABASE_URL", "https://example.supabase.co")
+    monkeypatch.setattr(srv.config, "SUPABASE_SERVICE_KEY", "key")
+    monkeypatch.setattr(srv.config, "DB_EVENT_FLUSH_INTERVAL", 0.01)
+    client = FakeClient()
+    threads = []
+    
+    def factory():
+        threads.append(threading.current_thread())
+        return client
+    
+    sink = srv.SupabaseEventSink(factory)
+    
+    async def main():
+        assert sink.enabled  # Configured: rows queue while the client resolves
+        await sink.emit("chat_messages", {"content": "a"})
+        await sink.flush()
+        await sink.emit("chat_messages", {"content": "b"})
+        await sink.flush()
+    
+    asyncio.run(main())
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    assert sink.inserted == 2
+
+
+def test_unconfigured_sink_drops_rows(srv):
+    sink = srv.SupabaseEventSink(lambda: None)
+    
+    async def main():
+        await sink.start()
+        assert await sink.emit("chat_messages", {"content": "a"}) is None
+        assert await sink.wait(None)
+    
+    asyncio.run(main())
+    assert not sink.enabled and sink.stats()["queued"] == 0
@@ -0,0 +1,139 @@
+"""SQLite job store and the async chat job queue."""
+
+import asyncio
+import os
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def store(srv, tmp_path):
+    return srv.JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def chat_request(srv, chat_id="chat-1", **kwargs):
+    return srv.ChatRequest(messages=[srv.ChatMessage(role="user", content="hi")], chat_id=chat_id, **kwargs)
+
+
+def test_create_deduplicates_active_jobs_per_chat(store):
+    async def main():
+        first = await store.create("chat-1", "{}")
+        duplicate = await store.create("chat-1", "{}")
+        other_chat = await store.create("chat-2", "{}")
+        anonymous = [await store.create(None, "{}") for _ in range(2)]
+        await store.update_status(first["id"], "completed")
+        after_finish = await store.create("chat-1", "{}")
+        return first, duplicate, other_chat, anonymous, after_finish
+    
+    first, duplicate, other_chat, anonymous, after_finish = asyncio.run(main())
+    assert first["status"] == "queued" and duplicate is None
+    assert other_chat is not None and all(anonymous)
+    assert after_finish is not None
+
+
+def test_claim_is_atomic_across_connections(srv, store):
+    job = asyncio.run(store.create("chat-1", "{}"))
+    stores = [srv.JobStore(store.path) for _ in range(8)]
+    results = []
+    barrier = threading.Barrier(len(stores))
+    
+    def claim(index, other):
+        barrier.wait()
+        results.append(asyncio.run(other.claim(job["id"], f"worker-{index}")))
+    
+    threads = [threading.Thread(target=claim, args=(i, other)) for i, other in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert results.count(True) == 1
+    claimed = asyncio.run(store.get(job["id"]))
+    assert claimed["status"] == "running" and claimed["owner"].startswith("worker-")
+
+
+def test_queue_runs_jobs_and_resumes_orphans(srv, store, monkeypatch):
+    monkeypatch.setattr(srv.config, "JOB_WORKERS", 2)
+    ran = []
+    
+    async def runner(request):
+        ran.append(request.chat_id)
+    
+    async def main():
+        # A job left 'running' by a process that has exited, and one by a live process
+        orphan = await store.create("orphan", chat_request(srv, "orphan").model_dump_json())
+        await store.claim(orphan["id"], "999999999-dead")
+        alive = await store.create("alive", chat_request(srv, "alive").model_dump_json())
+        parent = os.getppid()
+        await store.claim(alive["id"], f"{parent}-{srv.process_start_time(parent) or 0}-other")
+        
+        queue = srv.ChatJobQueue(runner, store)
+        await queue.start()
+        job, deduplicated = await queue.submit(chat_request(srv, "fresh"))
+        again, deduplicated_again = await queue.submit(chat_request(srv, "fresh"))
+        await queue._queue.join()
+        await queue.stop()
+        return job, deduplicated, again, deduplicated_again, orphan, alive
+    
+    job, deduplicated, again, deduplicated_again, orphan, alive = asyncio.run(main())
+    assert not deduplicated and deduplicated_again and again["id"] == job["id"]
+    assert sorted(ran) == ["fresh", "orphan"]
+    assert asyncio.run(store.get(orphan["id"]))["status"] == "completed"
+    assert asyncio.run(store.get(alive["id"]))["status"] == "running"
+
+
+def test_cancel_running_job(srv, store):
+    started = None
+    
+    async def runner(request):
+        started.set()
+        await asyncio.sleep(10)
+    
+    async def main():
+        nonlocal started
+        started = asyncio.Event()
+        queue = srv.ChatJobQueue(runner, store)
+        await queue.start()
+        job, _ = await queue.submit(chat_request(srv, None))
+        await started.wait()
+        cancelled = await queue.cancel(job["id"])
+        await queue.stop()
+        return cancelled
+    
+    assert asyncio.run(main())["status"] == "cancelled"
+
+
+def test_async_jobs_use_the_pooled_agent_for_the_request(srv, monkeypatch):
+    calls = []
+    
+    class EmptyAgent:
+        async def astream(self, state, stream_mode):
+            return
+            yield
+    
+    async def get_pooled_agent(**kwargs):
+        calls.append(kwargs)
+        return EmptyAgent()
+    
+    monkeypatch.setattr(srv.agent_manager, "get_pooled_agent", get_pooled_agent)
+    request = chat_request(srv, None, model="openai:gpt-4o", system_prompt="Be terse.", enable_research=False)
+    asyncio.run(srv.run_chat_job(request))
+    
+    assert calls == [{"instructions": "Be terse.", "model": "openai:gpt-4o", "headless": True, "enable_research": False}]
+
+
+def test_reused_pid_does_not_keep_the_previous_owner_alive(srv, monkeypatch):
+    parent = os.getppid()
+    started = srv.process_start_time(parent)
+    monkeypatch.setattr(srv.worker_sync, "worker_id", f"{os.getpid()}-1-current")
+    
+    # Same pid as this process under another id: the process before a restart
+    assert not srv.ChatJobQueue._owner_alive(f"{os.getpid()}-1-previous")
+    assert not srv.ChatJobQueue._owner_alive(f"{os.getpid()}-previous")
+    # A live pid whose start time no longer matches was reused by another process
+    if started is not None:
+        assert srv.ChatJobQueue._owner_alive(f"{parent}-{started}-other")
+        assert not srv.ChatJobQueue._owner_alive(f"{parent}-{int(started) + 1}-other")
+    assert srv.ChatJobQueue._owner_alive(f"{parent}-other")
+    assert not srv.ChatJobQueue._owner_alive("999999999-1-dead")
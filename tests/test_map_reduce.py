@@ -0,0 +1,122 @@
+"""Map-reduce summarization of tool responses beyond SUMMARIZER_INPUT_LIMIT."""
+
+import asyncio
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+
+
+class RecordingSummarizer:
+    """Fake summarizer that keeps every record id as compact ranges, like a real summary.
+    
+    Chunk summaries are padded by `pad` chars to make them as large as needed.
+    """
+    
+    def __init__(self, pad: int = 0):
+        self.pad = pad
+        self.inputs = []
+    
+    async def ainvoke(self, messages):
+        text = messages[-1].content
+        self.inputs.append(text)
+        ids = set(int(i) for i in re.findall(r'"Id":(\d+)', text))
+        for start, end in re.findall(r"(\d+)-(\d+)", text):
+            ids.update(range(int(start), int(end) + 1))
+        summary = "ids " + ",".join(f"{a}-{b}" for a, b in ranges(sorted(ids)))
+        if not text.startswith("Merge these"):
+            summary += "\n" + "." * self.pad
+        return SimpleNamespace(content=summary)
+
+
+def ranges(ids):
+    start = previous = None
+    for i in ids:
+        if start is None:
+            start = previous = i
+        elif i == previous + 1:
+            previous = i
+        else:
+            yield start, previous
+            start = previous = i
+    if start is not None:
+        yield start, previous
+
+
+@pytest.fixture
+def manager(srv, monkeypatch):
+    monkeypatch.setattr(srv.config, "SUMMARIZER_INPUT_LIMIT", 2000)
+    monkeypatch.setattr(srv.config, "SUMMARIZER_MAX_CONCURRENCY", 3)
+    return srv.ContextWindowManager()
+
+
+def response(count):
+    return json.dumps({"records": [{"Id": i, "Name": f"Account {i}"} for i in range(count)]})
+
+
+def ids_in(text):
+    ids = set()
+    for start, end in re.findall(r"(\d+)-(\d+)", text):
+        ids.update(range(int(start), int(end) + 1))
+    return sorted(ids)
+
+
+def test_every_chunk_reaches_the_final_summary(manager):
+    summarizer = RecordingSummarizer()
+    summary, degraded = asyncio.run(manager._map_reduce_summarize(summarizer, "get_records", response(300)))
+    
+    assert ids_in(summary) == list(range(300)) and not degraded
+    assert all(len(text) <= 2000 + 200 for text in summarizer.inputs)
+    assert any(text.startswith("Merge these") for text in summarizer.inputs)
+
+
+def test_oversized_partials_are_reduced_recursively_not_cut(manager):
+    # Each partial summary is larger than one summarizer input
+    summarizer = RecordingSummarizer(pad=2500)
+    summary, degraded = asyncio.run(manager._map_reduce_summarize(summarizer, "get_records", response(120)))
+    
+    assert ids_in(summary) == list(range(120)) and not degraded
+    assert all(len(text) <= 2000 + 200 for text in summarizer.inputs)
+
+
+def test_reduce_stops_at_max_depth(srv, manager):
+    class NonShrinking:
+        async def ainvoke(self, messages):
+            return SimpleNamespace(content="x" * 5000)
+    
+    fallbacks = []
+    
+    async def main():
+        return await manager._reduce_partials(NonShrinking(), "t", ["a" * 5000] * 4, asyncio.Semaphore(2),
+                                              fallbacks=fallbacks)
+    
+    assert asyncio.run(main()) == "x" * 5000
+    assert fallbacks and set(fallbacks) == {"merge_too_large"}
+
+
+def test_summary_with_a_failed_chunk_is_not_cached(manager, monkeypatch):
+    class RateLimited(RecordingSummarizer):
+        async def ainvoke(self, messages):
+            if "Summarize part 2 of" in messages[-1].content:
+                raise RuntimeError("429 Too Many Requests")
+            return await super().ainvoke(messages)
+    
+    summarizer = RateLimited()
+    monkeypatch.setattr(manager, "_get_summarizer", lambda: summarizer)
+    stored = []
+    
+    async def record_set(key, value):
+        stored.append(key)
+    
+    monkeypatch.setattr(manager.summary_cache, "set", record_set)
+    
+    async def main():
+        degraded = await manager.summarize_tool_response("get_records", response(300))
+        summarizer.ainvoke = RecordingSummarizer().ainvoke
+        complete = await manager.summarize_tool_response("get_records", response(301))
+        return degraded, complete
+    
+    degraded, complete = asyncio.run(main())
+    assert "Summarized from" in degraded and len(stored) == 1
+    assert ids_in(complete) == list(range(301))
@@ -0,0 +1,46 @@
+"""MCPSessionPool: concurrent stdio connects keep the process-wide stderr."""
+
+import asyncio
+import sys
+import textwrap
+
+STUB_SERVER = textwrap.dedent('''
+    import sys
+    from mcp.server.fastmcp import FastMCP
+
+    print("stub server noise on stderr", file=sys.stderr, flush=True)
+    mcp = FastMCP("stub")
+
+    @mcp.tool()
+    def echo(text: str) -> str:
+        return text
+
+    mcp.run()
+''')
+
+
+def test_overlapping_connects_leave_sys_stderr_alone(srv, tmp_path, capfd):
+    script = tmp_path / "stub_server.py"
+    script.write_text(STUB_SERVER)
+    connection = {"command": sys.executable, "args": [str(script)], "transport": "stdio"}
+    stderr_before = sys.stderr
+    
+    async def scenario():
+        pool = srv.MCPSessionPool()
+        try:
+            entries = await asyncio.gather(
+                pool.ensure_connected("one", dict(connection)),
+                pool.ensure_connected("two", dict(connection)),
+            )
+            result = await pool.call_tool("two", "echo", {"text": "hi"})
+            return [len(entry.tools) for entry in entries], result
+        finally:
+            await pool.disconnect("one")
+            await pool.disconnect("two")
+    
+    tool_counts, result = asyncio.run(scenario())
+    
+    assert tool_counts == [1, 1]
+    assert "hi" in str(result)
+    assert sys.stderr is stderr_before
+    assert "stub server noise" not in capfd.readouterr().err
@@ -0,0 +1,71 @@
+"""Prometheus text rendering of the in-process metrics registry."""
+
+from fastapi.testclient import TestClient
+
+
+def test_counter_sums_per_label_set(srv):
+    registry = srv.MetricsRegistry()
+    counter = registry.counter("summaries_total", "Summaries", ["kind"])
+    counter.inc(kind="tool")
+    counter.inc(2, kind="tool")
+    counter.inc(kind="conversation")
+    
+    assert registry.render().splitlines() == [
+        "# HELP summaries_total Summaries",
+        "# TYPE summaries_total counter",
+        'summaries_total{kind="tool"} 3',
+        'summaries_total{kind="conversation"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative(srv):
+    registry = srv.MetricsRegistry()
+    histogram = registry.histogram("run_seconds", "Runs", ["endpoint"], buckets=[1, 5])
+    for value in (0.5, 3, 3, 60):
+        histogram.observe(value, endpoint="/api/chat")
+    
+    samples = [line for line in registry.render().splitlines() if not line.startswith("#")]
+    assert samples == [
+        'run_seconds_bucket{endpoint="/api/chat",le="1"} 1',
+        'run_seconds_bucket{endpoint="/api/chat",le="5"} 3',
+        'run_seconds_bucket{endpoint="/api/chat",le="+Inf"} 4',
+        'run_seconds_sum{endpoint="/api/chat"} 66.5',
+        'run_seconds_count{endpoint="/api/chat"} 4',
+    ]
+
+
+def test_gauge_tracks_in_flight_and_scrape_time_values(srv):
+    registry = srv.MetricsRegistry()
+    in_flight = registry.gauge("runs_in_flight", "Runs", ["endpoint"])
+    in_flight.inc(endpoint="ws")
+    in_flight.inc(endpoint="ws")
+    in_flight.dec(endpoint="ws")
+    depth = registry.gauge("queue_depth", "Queued jobs")
+    depth.set_function(lambda: 7)
+    broken = registry.gauge("broken", "Raises at scrape time")
+    broken.set_function(lambda: 1 / 0)
+    
+    lines = registry.render().splitlines()
+    assert 'runs_in_flight{endpoint="ws"} 1' in lines
+    assert "queue_depth 7" in lines
+    assert "# TYPE broken gauge" in lines and not any(line.startswith("broken ") for line in lines)
+
+
+def test_label_values_are_escaped(srv):
+    registry = srv.MetricsRegistry()
+    registry.counter("calls_total", "Calls", ["tool"]).inc(tool='say "hi"\\now')
+    
+    assert 'calls_total{tool="say \\"hi\\"\\\\now"} 1' in registry.render()
+
+
+def test_metrics_endpoint_serves_the_global_registry(srv):
+    srv.TOOL_CALL_SECONDS.observe(0.2, tool="get_records")
+    
+    response = TestClient(srv.app).get("/metrics")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for name in ("agent_build_seconds", "agent_time_to_first_token_seconds", "agent_runs_in_flight",
+                 "mcp_tool_call_seconds", "mcp_tool_response_chars"):
+        assert f"# TYPE {name} " in response.text
+    assert 'mcp_tool_call_seconds_count{tool="get_records"}' in response.text
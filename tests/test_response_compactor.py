@@ -0,0 +1,81 @@
+"""ResponseCompactor: noise stripping, tabulation and budget-driven rendering."""
+
+import json
+
+import pytest
+
+
+@pytest.fixture
+def compactor(srv):
+    return srv.ResponseCompactor()
+
+
+def records(count, note_chars=20):
+    return [
+        {
+            "attributes": {"type": "Account", "url": f"/sobjects/Account/{i}"},
+            "Id": f"001{i:012d}",
+            "Name": f"Account {i}",
+            "Owner": {"attributes": {"type": "User"}, "Name": f"Owner {i % 7}"},
+            "Description": None,
+            "Notes": "n" * note_chars,
+        }
+        for i in range(count)
+    ]
+
+
+def test_prepare_strips_noise_and_tabulates(compactor):
+    table = compactor.prepare({"totalSize": 3, "records": records(3)})["records"]
+    assert table["count"] == 3
+    assert table["columns"] == ["Id", "Name", "Owner.Name", "Notes"]
+    assert table["rows"][0][:3] == ["001000000000000", "Account 0", "Owner 0"]
+
+
+def test_prepare_parses_embedded_json(compactor):
+    embedded = json.dumps({"records": records(20)})
+    prepared = compactor.prepare({"result": embedded})
+    assert prepared["result"]["records"]["count"] == 20
+
+
+def test_render_without_budget_is_lossless(compactor):
+    prepared = compactor.prepare({"records": records(500)})
+    assert json.loads(compactor.render(prepared))["records"]["rows"] == prepared["records"]["rows"]
+
+
+def test_render_uses_most_of_the_budget(compactor):
+    prepared = compactor.prepare({"totalSize": 12000, "records": records(12000)})
+    budget = 200_000
+    rendered = compactor.render(prepared, budget=budget)
+    table = json.loads(rendered)["records"]
+    
+    assert len(rendered) <= budget
+    assert len(rendered) > 0.95 * budget
+    assert len(table["rows"]) + table["omitted_rows"] == 12000
+    assert table["rows"][0][0] == "001000000000000"
+
+
+def test_render_shortens_strings_when_one_row_is_too_big(compactor):
+    prepared = compactor.prepare({"records": records(5, note_chars=40_000)})
+    rendered = compactor.render(prepared, budget=10_000)
+    table = json.loads(rendered)["records"]
+    
+    assert len(rendered) <= 10_000
+    assert len(table["rows"]) == 1
+    assert "truncated" in table["rows"][0][3]
+
+
+def test_render_keeps_nested_lists_proportionally(compactor):
+    value = {"groups": [{"name": f"g{i}", "members": list(range(200))} for i in range(50)]}
+    rendered = compactor.render(value, budget=5_000)
+    groups = json.loads(rendered)["groups"]
+    
+    assert len(rendered) <= 5_000
+    assert len(rendered) > 0.9 * 5_000
+    # Outer list kept whole; the deeper member lists absorb the cut
+    assert len(groups) == 50
+    assert groups[0]["members"][-1].startswith("... and ")
+
+
+def test_render_falls_back_to_hard_cut(compactor):
+    rendered = compactor.render({"k" * 500: "v"}, budget=100)
+    assert len(rendered) == 100
@@ -0,0 +1,85 @@
+"""stream_agent_events: tokens stream immediately; tool-call preambles are retracted."""
+
+import asyncio
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+MAIN = {"langgraph_node": "model", "langgraph_checkpoint_ns": "model:1"}
+
+
+class ScriptedAgent:
+    def __init__(self, script):
+        self.script = script
+    
+    async def astream(self, state, stream_mode):
+        for item in self.script:
+            yield item
+
+
+def collect(srv, script):
+    async def main():
+        return [event async for event in srv.stream_agent_events(ScriptedAgent(script), [])]
+    return asyncio.run(main())
+
+
+def test_preamble_of_tool_calling_step_is_retracted(srv):
+    tool_call = {"name": "get_records", "args": {"q": "x"}, "id": "call_1"}
+    script = [
+        ("messages", (AIMessageChunk(content="Let me look ", id="run-1"), MAIN)),
+        ("messages", (AIMessageChunk(content="that up.", id="run-1"), MAIN)),
+        ("messages", (AIMessageChunk(content="", id="run-1", tool_call_chunks=[
+            {"name": "get_records", "args": '{"q": "x"}', "id": "call_1", "index": 0}]), MAIN)),
+        ("updates", {"model": {"messages": [AIMessage(content="Let me look that up.", id="run-1", tool_calls=[tool_call])]}}),
+        ("updates", {"tools": {"messages": [ToolMessage(content="[1, 2]", tool_call_id="call_1", name="get_records")]}}),
+        ("messages", (AIMessageChunk(content="There are ", id="run-2"), MAIN)),
+        ("messages", (AIMessageChunk(content="2 records.", id="run-2"), MAIN)),
+        ("messages", (AIMessageChunk(content="subagent text", id="run-3"), {"langgraph_node": "tools"})),
+        ("updates", {"model": {"messages": [AIMessage(content="There are 2 records.", id="run-2")]}}),
+    ]
+    events = collect(srv, script)
+    
+    assert [e["type"] for e in events] == [
+        "token", "token", "token_reset", "tool_call", "ai_message", "tool_result", "token", "token", "ai_message",
+    ]
+    assert events[2]["content"] == "Let me look that up."
+    text = ""
+    for event in events:
+        if event["type"] == "token":
+            text += event["content"]
+        elif event["type"] == "token_reset":
+            assert text.endswith(event["content"])
+            text = text[:-len(event["content"])]
+    final = [e for e in events if e["type"] == "ai_message" and not e["has_tool_calls"]][-1]
+    assert text == final["content"] == "There are 2 records."
+
+
+def test_tokens_are_sent_before_the_step_completes(srv):
+    sent = []
+    
+    class TrackingAgent:
+        async def astream(self, state, stream_mode):
+            for word in ("one ", "two ", "three"):
+                sent.append(word)
+                yield ("messages", (AIMessageChunk(content=word, id="run-1"), MAIN))
+            yield ("updates", {"model": {"messages": [AIMessage(content="one two three", id="run-1")]}})
+    
+    async def main():
+        seen = []
+        async for event in srv.stream_agent_events(TrackingAgent(), []):
+            if event["type"] == "token":
+                # Each delta is yielded before the model produces the next one
+                seen.append((event["content"], len(sent)))
+        return seen
+    
+    assert asyncio.run(main()) == [("one ", 1), ("two ", 2), ("three", 3)]
+
+
+def test_tool_calls_only_in_the_final_message_still_retract(srv):
+    tool_call = {"name": "get_records", "args": {}, "id": "call_1"}
+    script = [
+        ("messages", (AIMessageChunk(content="Checking.", id="run-1"), MAIN)),
+        ("updates", {"model": {"messages": [AIMessage(content="Checking.", id="run-1", tool_calls=[tool_call])]}}),
+    ]
+    events = collect(srv, script)
+    
+    assert [(e["type"], e.get("content")) for e in events[:2]] == [("token", "Checking."), ("token_reset", "Checking.")]
@@ -0,0 +1,54 @@
+"""Structured chat: direct fast path prompt assembly and response cache TTLs."""
+
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def captured(srv, monkeypatch):
+    calls = []
+    
+    async def complete(messages, schema, model=None):
+        calls.append(messages)
+        return {"data": {"title": "t"}, "raw_response": '{"title": "t"}', "errors": [], "repaired": False}
+    
+    monkeypatch.setattr(srv.structured_output, "complete", complete)
+    return calls
+
+
+def request(srv, messages, **kwargs):
+    return srv.StructuredChatRequest(
+        messages=[srv.ChatMessage(role=role, content=content) for role, content in messages],
+        structured_output_format={"type": "object", "properties": {"title": {"type": "string"}}},
+        use_tools=False,
+        **kwargs,
+    )
+
+
+def test_direct_path_prepends_system_prompt(srv, captured):
+    response = asyncio.run(srv._compute_structured_chat(request(srv, [("user", "hi")], system_prompt="Be terse.")))
+    assert response["mode"] == "direct" and response["success"]
+    assert captured[0] == [{"role": "system", "content": "Be terse."}, {"role": "user", "content": "hi"}]
+
+
+def test_direct_path_keeps_system_prompt_with_leading_system_message(srv, captured):
+    messages = [("system", "Summary of earlier conversation: ..."), ("user", "hi")]
+    asyncio.run(srv._compute_structured_chat(request(srv, messages, system_prompt="Be terse.")))
+    assert captured[0][0] == {"role": "system", "content": "Be terse.\n\nSummary of earlier conversation: ..."}
+    assert [m["role"] for m in captured[0]] == ["system", "user"]
+
+
+def test_cache_ttl_zero_does_not_store(srv, captured, monkeypatch):
+    monkeypatch.setattr(srv, "structured_response_cache", srv.StructuredResponseCache(16))
+    
+    async def main():
+        first = await srv.run_structured_chat(request(srv, [("user", "a")], cache=True, cache_ttl_seconds=0))
+        second = await srv.run_structured_chat(request(srv, [("user", "a")], cache=True, cache_ttl_seconds=0))
+        third = await srv.run_structured_chat(request(srv, [("user", "b")], cache=True))
+        fourth = await srv.run_structured_chat(request(srv, [("user", "b")], cache=True))
+        return first, second, third, fourth
+    
+    first, second, third, fourth = asyncio.run(main())
+    assert (first["cached"], second["cached"], third["cached"], fourth["cached"]) == (False, False, False, True)
+    assert len(captured) == 3
@@ -0,0 +1,95 @@
+"""TokenCounter: encoding loading, per-message memo and running totals."""
+
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+@pytest.fixture
+def counter(srv):
+    counter = srv.TokenCounter(cache_size=100)
+    counter.register_tokenizer("test:", lambda text: len(text.split()))
+    return counter
+
+
+def test_registered_tokenizer_wins(counter):
+    assert counter.count_text("one two three", "test:model") == 3
+
+
+def test_heuristic_counts_words_and_punctuation(srv):
+    assert srv.TokenCounter.heuristic_count('{"a": 1}') == 7
+
+
+def test_running_total_counts_only_appended_messages(counter):
+    calls = []
+    counter.register_tokenizer("counted:", lambda text: calls.append(text) or len(text.split()))
+    history = [HumanMessage(content="hello there"), AIMessage(content="hi")]
+    
+    assert counter.count_messages(history, "counted:m", "chat-1") == 3
+    history.append(HumanMessage(content="how are you"))
+    assert counter.count_messages(history, "counted:m", "chat-1") == 6
+    assert calls == ["hello there", "hi", "how are you"]
+
+
+def test_running_total_detects_edits_anywhere_in_the_prefix(counter):
+    history = [HumanMessage(content="one"), AIMessage(content="two words"), HumanMessage(content="three")]
+    assert counter.count_messages(history, "test:m", "chat-2") == 4
+    
+    # Same length and same last message, but an earlier message changed
+    history[0] = HumanMessage(content="one was edited into five words")
+    assert counter.count_messages(history, "test:m", "chat-2") == 9
+    
+    history.append(AIMessage(content="more"))
+    assert counter.count_messages(history, "test:m", "chat-2") == 10
+
+
+def test_unloaded_encoding_loads_off_the_event_loop(srv, monkeypatch):
+    counter = srv.TokenCounter(cache_size=100)
+    loads = []
+    
+    def fake_load(name):
+        loads.append(name)
+        counter._encodings[name] = None
+        counter._loading.discard(name)
+    
+    monkeypatch.setattr(counter, "encoding_name", lambda model: "fake_base")
+    monkeypatch.setattr(counter, "load_encoding", fake_load)
+    
+    async def main():
+        first = counter.count_text("a b c", "openai:gpt-x")
+        second = counter.count_text("a b c", "openai:other")
+        await asyncio.sleep(0.05)
+        return first, second
+    
+    assert asyncio.run(main()) == (3, 3)
+    assert loads == ["fake_base"]
+
+
+def test_failed_encoding_is_cached_per_encoding(srv, monkeypatch):
+    counter = srv.TokenCounter(cache_size=100)
+    attempts = []
+    
+    class FailingTiktoken:
+        @staticmethod
+        def get_encoding(name):
+            attempts.append(name)
+            raise OSError("offline")
+    
+    monkeypatch.setitem(__import__("sys").modules, "tiktoken", FailingTiktoken)
+    monkeypatch.setattr(counter, "encoding_name", lambda model: "o200k_base")
+    
+    assert counter.load_encodings(["openai:a", "anthropic:b"]) == {"o200k_base": False}
+    assert counter.count_text("a b", "openai:a") == 2
+    assert counter.count_text("a b", "anthropic:c") == 2
+    assert attempts == ["o200k_base"]
+
+
+def test_message_rewritten_under_the_same_id_is_recounted(counter):
+    original = AIMessage(content="a long tool result with many words in it", id="msg-1")
+    assert counter.count_message(original, "test:m") == 9
+    
+    # Compaction replaces the content but keeps the id
+    compacted = AIMessage(content="short summary", id="msg-1")
+    assert counter.count_message(compacted, "test:m") == 2
+    assert counter.count_messages([compacted], "test:m") == 2
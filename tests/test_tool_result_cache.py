@@ -0,0 +1,139 @@
+"""ToolResultCache: TTL hits, single-flight coalescing and cancellation."""
+
+import asyncio
+
+import pytest
+
+
+def make_cache(srv, **policy):
+    cache = srv.ToolResultCache(max_entries=8)
+    cache.load_policies({"describe_*": {"read_only": True, "ttl_seconds": 60, **policy}})
+    return cache
+
+
+def test_concurrent_calls_share_one_invocation(srv, run):
+    cache = make_cache(srv)
+    calls = []
+    
+    async def invoke():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+    
+    async def main():
+        results = await asyncio.gather(*(cache.call("describe_object", {"name": "Account"}, invoke) for _ in range(5)))
+        cached = await cache.call("describe_object", {"name": "Account"}, invoke)
+        return results, cached
+    
+    results, cached = run(main())
+    assert len(calls) == 1
+    assert all(r == {"ok": True} for r in results) and cached == {"ok": True}
+    assert cache.stats()["tools"]["describe_object"] == {"hits": 1, "misses": 1, "coalesced": 4, "hit_rate": 0.833}
+
+
+def test_leader_cancel_does_not_cancel_followers(srv, run):
+    cache = make_cache(srv)
+    release = None
+    
+    async def invoke():
+        await release.wait()
+        return "result"
+    
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        leader = asyncio.create_task(cache.call("describe_object", {}, invoke))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.call("describe_object", {}, invoke))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return leader, await follower
+    
+    leader, follower_result = run(main())
+    assert leader.cancelled()
+    assert follower_result == "result"
+
+
+def test_last_waiter_cancel_stops_the_call(srv, run):
+    cache = make_cache(srv)
+    state = {"cancelled": False}
+    
+    async def invoke():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+    
+    async def main():
+        callers = [asyncio.create_task(cache.call("describe_object", {}, invoke)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.01)
+    
+    run(main())
+    assert state["cancelled"]
+    assert cache.stats()["inflight"] == 0
+
+
+def test_errors_reach_every_waiter_and_are_not_cached(srv, run):
+    cache = make_cache(srv)
+    calls = []
+    
+    async def invoke():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+    
+    async def main():
+        results = await asyncio.gather(*(cache.call("describe_object", {}, invoke) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await cache.call("describe_object", {}, invoke)
+        return results
+    
+    results = run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(calls) == 2
+
+
+def test_key_fields_and_uncached_tools(srv, run):
+    cache = make_cache(srv, key_fields=["name"])
+    calls = []
+    
+    async def invoke():
+        calls.append(1)
+        return len(calls)
+    
+    async def main():
+        a = await cache.call("describe_object", {"name": "Account", "trace": 1}, invoke)
+        b = await cache.call("describe_object", {"name": "Account", "trace": 2}, invoke)
+        c = await cache.call("update_record", {"name": "Account"}, invoke)
+        d = await cache.call("update_record", {"name": "Account"}, invoke)
+        return a, b, c, d
+    
+    assert run(main()) == (1, 1, 2, 3)
+
+
+def test_shared_tier_serves_other_workers(srv, run, tmp_path):
+    policy = {"describe_*": {"read_only": True, "ttl_seconds": 60}}
+    writer = srv.ToolResultCache(8, shared_dir=str(tmp_path))
+    reader = srv.ToolResultCache(8, shared_dir=str(tmp_path))
+    writer.load_policies(policy)
+    reader.load_policies(policy)
+    
+    async def invoke():
+        return {"rows": [1, 2, 3]}
+    
+    async def never():
+        raise AssertionError("should be served from the shared tier")
+    
+    async def main():
+        await writer.call("describe_object", {}, invoke)
+        return await reader.call("describe_object", {}, never)
+    
+    assert run(main()) == {"rows": [1, 2, 3]}
+    assert reader.shared_hits == 1
@@ -0,0 +1,70 @@
+"""Chunking of large responses and the per-chat vector index."""
+
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture
+def manager(srv):
+    return srv.ContextWindowManager()
+
+
+def test_split_repeats_small_envelope(manager):
+    data = {"totalSize": 300, "done": True, "records": [{"Id": i, "Name": f"Account {i}"} for i in range(300)]}
+    chunks = manager._split_for_summary(json.dumps(data), 1000)
+    parsed = [json.loads(chunk) for chunk in chunks]
+    
+    assert len(chunks) > 1 and all(len(chunk) <= 1000 for chunk in chunks)
+    assert all(part["totalSize"] == 300 for part in parsed)
+    assert [r["Id"] for part in parsed for r in part["records"]] == list(range(300))
+
+
+def test_split_does_not_repeat_large_envelope(manager):
+    data = {"schema": "x" * 5000, "records": [{"Id": i} for i in range(500)]}
+    chunks = manager._split_for_summary(json.dumps(data), 2000)
+    
+    assert all(len(chunk) <= 2000 for chunk in chunks)
+    assert sum(chunk.count("x" * 100) > 0 for chunk in chunks) == 3  # The envelope, split once
+    records = [r["Id"] for chunk in chunks if chunk.startswith('{"records"') for r in json.loads(chunk)["records"]]
+    assert records == list(range(500))
+
+
+def test_split_breaks_up_oversized_records(manager):
+    data = [
+        {"Id": 1, "Lines": [{"n": i, "text": "line item"} for i in range(400)]},
+        {"Id": 2, "Body": "b" * 5000},
+        {"Id": 3},
+    ]
+    chunks = manager._split_for_summary(json.dumps(data), 1000)
+    
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    joined = "".join(chunks)
+    assert '"n":399' in joined and joined.count("b") >= 5000 and '"Id":3' in joined
+
+
+def test_index_and_search_per_chat(srv, monkeypatch):
+    monkeypatch.setattr(srv.config, "OPENAI_API_KEY", "")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    store = srv.VectorIndexStore(max_chats=4, idle_seconds=3600)
+    chunks = ["invoice overdue for acme corp", "weather report sunny", "acme corp renewal contract"]
+    
+    async def main():
+        indexed = await store.add("chat-a", "ref1", "get_records", chunks)
+        again = await store.add("chat-a", "ref1", "get_records", chunks)
+        results = await store.search("chat-a", "acme corp", k=2)
+        other = await store.search("chat-b", "acme corp")
+        return indexed, again, results, other
+    
+    indexed, again, results, other = asyncio.run(main())
+    assert indexed == again == 3
+    assert {r["text"] for r in results} == {chunks[0], chunks[2]}
+    assert other == []
+
+
+def test_index_reports_partial_coverage(srv, monkeypatch):
+    monkeypatch.setattr(srv.config, "VECTOR_INDEX_MAX_CHUNKS", 2)
+    store = srv.VectorIndexStore(max_chats=4, idle_seconds=3600)
+    store._embedder = srv.HashingEmbedder(64)
+    assert asyncio.run(store.add("chat", "ref", "tool", ["a", "b", "c", "d"])) == 2
@@ -0,0 +1,102 @@
+"""WorkerSync event log and the shared MCP config file."""
+
+import asyncio
+import json
+import threading
+import time
+
+
+def test_events_reach_other_workers_only(srv, tmp_path):
+    a = srv.WorkerSync(str(tmp_path), interval=0.1, enabled=True)
+    b = srv.WorkerSync(str(tmp_path), interval=0.1, enabled=True)
+    received = {"a": [], "b": []}
+    
+    async def on_a(record):
+        received["a"].append(record)
+    
+    async def on_b(record):
+        received["b"].append(record)
+    
+    a.subscribe("mcp_config", on_a)
+    b.subscribe("mcp_config", on_b)
+    
+    async def main():
+        a.start()
+        b.start()
+        await a.publish("mcp_config", server="x")
+        await b.publish("unhandled")
+        await asyncio.sleep(0.35)
+        await a.stop()
+        await b.stop()
+    
+    asyncio.run(main())
+    assert received["a"] == []
+    assert [r["server"] for r in received["b"]] == ["x"]
+    assert a.received == 1 and b.received == 1
+
+
+def test_rotation_keeps_events_from_the_rotated_file(srv, tmp_path, monkeypatch):
+    monkeypatch.setattr(srv.WorkerSync, "MAX_BYTES", 200)
+    publisher = srv.WorkerSync(str(tmp_path), interval=0.1, enabled=True)
+    reader = srv.WorkerSync(str(tmp_path), interval=0.1, enabled=True)
+    reader._inode, reader._offset = None, 0
+    
+    async def main():
+        seen = []
+        for i in range(6):
+            await publisher.publish("job_cancel", job_id=str(i))
+            seen.extend(r["job_id"] for r in reader._read_new())
+        return seen
+    
+    assert asyncio.run(main()) == [str(i) for i in range(6)]
+
+
+def test_disabled_sync_publishes_nothing(srv, tmp_path):
+    sync = srv.WorkerSync(str(tmp_path), interval=0.1, enabled=False)
+    asyncio.run(sync.publish("mcp_config"))
+    assert not (tmp_path / "events.jsonl").exists()
+
+
+def test_config_update_runs_off_the_event_loop_and_merges(srv, tmp_path):
+    path = tmp_path / "mcp_config.json"
+    first = srv.MCPConfigManager(str(path))
+    second = srv.MCPConfigManager(str(path))
+    
+    def add(name):
+        def mutate(current):
+            current.setdefault("mcp_servers", {})[name] = {"command": "x", "enabled": True}
+        return mutate
+    
+    async def main():
+        await first.update(add("one"))
+        await second.update(add("two"))
+        await first.reload()
+        
+        # Another process holding the lock must not stall this event loop
+        ticks = []
+        
+        async def ticker():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+        
+        holding = threading.Event()
+        
+        def hold_lock():
+            with srv.file_lock(first.lock_file):
+                holding.set()
+                time.sleep(0.3)
+        
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        holding.wait()
+        tick_task = asyncio.create_task(ticker())
+        await first.update(add("three"))
+        tick_task.cancel()
+        holder.join()
+        return ticks
+    
+    ticks = asyncio.run(main())
+    assert set(first.config["mcp_servers"]) >= {"one", "two", "three"}
+    assert set(json.loads(path.read_text())["mcp_servers"]) >= {"one", "two", "three"}
+    assert len(ticks) > 10